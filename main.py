@@ -1,18 +1,32 @@
 # External dependencies
+import datetime
+import json
+import os
 import smbus
 import trio
 from gpiozero import DigitalInputDevice
 from systems.traction_system import TractionSystem
-from systems.battery_measure import BatteryEventArgs
-from systems.current_measure import CurrentEventArgs
+from systems.pwm import PWM_BACKEND_PIGPIO, PWM_BACKEND_DUMMY
+from systems.heading import HeadingController
+from systems.bearing_fusion import BearingFusion
+from systems.control_loop import ControlLoop
+from systems.localization import Localization
+from systems.rssi_filter import RSSIHysteresis, ZONE_LOST, ZONE_FAR, ZONE_CLOSE, ZONE_REACHED
+from systems.state_machine import StateMachine
+from systems.telemetry import TelemetryStore
+from systems.history import TelemetryHistory
+from systems.telemetry_log import TelemetryLogger
+from systems.state_of_charge import SoCEstimator
+from systems.overcurrent import OvercurrentGuard, OvercurrentEventArgs
 from systems.gps import LocationEventArgs, VisibleSatellitesEventArgs
+from systems.gps_config import PROTOCOL_UBX
 from systems.server import ServerErrorArgs
 from systems.commands import CommandSystem, CommandEventArgs
-from systems.receptor import ReceptorEventArgs
 
 
 # ---- DEBUG CONFIG -----------------------
 DEBUG_ADC = False
+DEBUG_TRACTION = False
 DEBUG_RADIOSYSTEM = False
 DEBUG_SENSORS = False
 DEBUG_BATTERY = False
@@ -27,6 +41,11 @@ SERVER_ADDRESS = 'ec2-13-53-130-185.eu-north-1.compute.amazonaws.com'
 SERVER_PORT = 80
 COMMAND_PORT = 8000
 # ------------------------------------------
+# ---- TELEMETRY LOG CONFIG ----------------
+TELEMETRY_LOG_DIRECTORY = "logs"  # One session directory per run (read them with telemetry_log.load_session)
+TELEMETRY_LOG_SEGMENT_SIZE = 256 * 1024  # Bytes per segment file
+TELEMETRY_LOG_FLUSH_PERIOD = 5  # s
+# ------------------------------------------
 # ---- A/D CONFIG --------------------------
 DEVICE_BUS = 1  # In Raspberry Pi 3+, bus 1 is used
 DEVICE_ADDRESS = 0x48  # ADS1015 address (if ADDR = GND -> address 0x48)
@@ -35,6 +54,11 @@ RADIO_CHANNEL = 0
 BATTERY_CHANNEL = 3
 CURRENT_CHANNEL = 1
 # ------------------------------------------
+# ---- BATTERY CONFIG ----------------------
+BATTERY_CAPACITY = 2.6  # Ah
+BATTERY_INTERNAL_RESISTANCE = 0.15  # Ohm, battery + wiring (load compensation of the measured voltage)
+BATTERY_QUIESCENT_CURRENT = 0.6  # A, Raspberry Pi + peripherals (not measured by the current sensor)
+# ------------------------------------------
 # ---- TRACTION SYSTEM CONFIG --------------
 DRIVER_ENABLE_PIN = 12
 MOTOR_R_FORWARD_PIN = 17
@@ -43,6 +67,8 @@ MOTOR_R_ENABLE_PIN = 27
 MOTOR_L_FORWARD_PIN = 5
 MOTOR_L_BACKWARD_PIN = 6
 MOTOR_L_ENABLE_PIN = 13
+ROVER_MAX_SPEED = 0.5  # m/s, forward speed at full linear velocity (needs calibration). Used for dead-reckoning
+TRACTION_PWM_FREQUENCY = 10000  # Hz. Enable pins on GPIO 12/13/18/19 get hardware PWM, the rest DMA-timed PWM
 # ------------------------------------------
 # ---- SENSE HAT PINS (FIXED) --------------
 # 5V, 3V3, GND
@@ -61,6 +87,9 @@ MOTOR_L_ENABLE_PIN = 13
 # RXD (GPIO 15)
 # GPS_PORT = "/dev/serial0"  # Raspberry Pi 4
 GPS_PORT = "/dev/ttyS0"  # Raspberry Pi 3
+GPS_BAUD_RATE = 115200  # Needed for update rates over ~2Hz
+GPS_UPDATE_RATE = 5  # Hz
+GPS_PROTOCOL = PROTOCOL_UBX
 # ------------------------------------------
 # ---- TX/RX PINS (SPI0) -------------------
 # SPI0 MOSI (GPIO 10)
@@ -75,6 +104,10 @@ TX_DEVICE = 1
 # ------------------------------------------
 
 # --------- DEBUG IMPORTS ------------------
+if DEBUG_TRACTION:
+    TRACTION_PWM_BACKEND = PWM_BACKEND_DUMMY
+else:
+    TRACTION_PWM_BACKEND = PWM_BACKEND_PIGPIO
 if DEBUG_ADC:
     from systems.ads1015 import DummyADS1015 as ADS1015
 else:
@@ -132,41 +165,74 @@ class ControlSystem:
     RSSI_STOP_THRESHOLD = -64
     RSSI_FOLLOW_THRESHOLD = -78
     RSSI_GIVEUP_THRESHOLD = -140
+    # Zone changes need the filtered RSSI "HYSTERESIS" dB past a threshold for "DWELL_TIME" seconds
+    RSSI_HYSTERESIS = 2  # dB
+    RSSI_DWELL_TIME = 1  # s
+    RSSI_MIN_CONFIDENCE = 0.2  # Below it (no recent samples) the beacon is considered lost
     # --------------------------------------
     # ---- BATTERY & CURRENT THRESHOLDS ----
     BATTERY_SAVER_THRESHOLD = 10 # %
     CURRENT_PROTECTION_THRESHOLD = 0.7  # A, max motor current
+    # Fast protection (OvercurrentGuard): cuts the driver when the instantaneous current exceeds the limit
+    CURRENT_TRIP_THRESHOLD = 1.0  # A
+    CURRENT_TRIP_SAMPLES = 3  # Consecutive samples over the limit
+    CURRENT_TRIP_RATE = 100  # Hz (each sample blocks the shared ADC, see OvercurrentGuard)
     # --------------------------------------
-    # ---- TRACTION TRANSLATION ------------
-    # Used in AUTOMATIC mode to transform angle values into traction states
-    TRACTION_TRANSLATOR = {  # Translates from angle signs received from radio system into traction states
-        0: TractionSystem.FORWARD_STATE,
-        1: TractionSystem.TURN_LEFT_STATE,
-        -1: TractionSystem.TURN_RIGHT_STATE,
-        None: TractionSystem.IDLE_STATE,
-    }
+    # ---- AUTOMATIC STEERING --------------
+    # Used in AUTOMATIC mode to transform angle values into closed-loop heading targets
+    AUTO_LINEAR_SPEED = 0.8  # Forward speed while following the beacon
+    AUTO_BEARING_SCALE = 45  # Degrees to turn per unit of normalized angle offset
+    AUTO_TURN_ANGLE = 30  # Degrees to turn when only the angle sign is known
+    AUTO_MAX_BEARING_STD = 25  # Degrees, fused bearing uncertainty above which the course is not changed
+    # --------------------------------------
+
+    PROTECTION_RESTORE_TIME = 3  # s, time in CURRENT_PROTECTION before restoring the previous mode
+    # ---- CONTROL LOOP --------------------
+    # Control decisions (control_step) are taken at a fixed rate from the latest telemetry values
+    CONTROL_PERIOD = 0.1  # s
+    # --------------------------------------
+    # ---- TELEMETRY -----------------------
+    TELEMETRY_FIELDS = (
+        'temperature',
+        'pressure',
+        'humidity',
+        'slope',
+        'num_satellites',
+        'latitude',
+        'longitude',
+        'altitude',
+        'gps_fix',
+        'ground_speed',
+        'course',
+        'pose_x',
+        'pose_y',
+        'pose_heading',
+        'bearing',
+        'bearing_std',
+        'message',
+        'beacon',
+        'rssi',
+        'rssi_confidence',
+        'session_state',
+        'session_substate',
+        'battery',
+        'motor_current',
+        'session_id',
+        'rover_id',
+    )
+    # Numeric fields whose history is kept (raw samples, 1s and 1min aggregates)
+    HISTORY_FIELDS = ('temperature', 'pressure', 'humidity', 'slope', 'altitude', 'ground_speed', 'rssi', 'battery',
+                      'motor_current')
     # --------------------------------------
 
     def __init__(self, nursery: trio.Nursery):
         self._nursery = nursery  # type: trio.Nursery
-        self._operation_mode = None
-        self._system_state = None
-        self._sensor_data = {
-            'temperature': None,
-            'pressure': None,
-            'humidity': None,
-            'slope': None,
-            'num_satellites': None,
-            'latitude': None,
-            'longitude': None,
-            'altitude': None,
-            'message': None,
-            'rssi': None,
-            'session_state': None,
-            'session_substate': None,
-            'battery': None,
-            'motor_current': None
-        }
+        self._telemetry = TelemetryStore(self.TELEMETRY_FIELDS)  # type: TelemetryStore
+        self._history = TelemetryHistory(self.HISTORY_FIELDS)  # type: TelemetryHistory
+        self._telemetry.add_sink(self._history.record)
+        log_directory = os.path.join(TELEMETRY_LOG_DIRECTORY, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        self._logger = TelemetryLogger(log_directory, segment_size=TELEMETRY_LOG_SEGMENT_SIZE)
+        self._telemetry.add_sink(self._logger.record)
 
         # Traction system ----------------
         self._tractor = TractionSystem(  # type: TractionSystem
@@ -176,7 +242,9 @@ class ControlSystem:
             forward_l=MOTOR_L_FORWARD_PIN,
             backward_l=MOTOR_L_BACKWARD_PIN,
             enable_l=MOTOR_L_ENABLE_PIN,
-            enable_global=DRIVER_ENABLE_PIN
+            enable_global=DRIVER_ENABLE_PIN,
+            pwm_backend=TRACTION_PWM_BACKEND,
+            pwm_frequency=TRACTION_PWM_FREQUENCY
         )
 
         # ADC -----------------------------
@@ -185,100 +253,218 @@ class ControlSystem:
         self._adc = ADS1015(bus, DEVICE_ADDRESS, alert_ready, channel=RADIO_CHANNEL)  # type: ADS1015
 
         # Radio System -------------------
-        self._radio_system = RadioDetection(self._adc, self._nursery, notification_callbacks=[self.radio_listener])
+        self._radio_system = RadioDetection(self._adc, self._nursery)
         self._radio_system.subscribe(notification_callbacks=[radio_printer])  # DEBUG ONLY
 
         # SenseHat ------------------------
-        self._sensors = SenseHatWrapper(nursery, data=self._sensor_data)
+        self._sensors = SenseHatWrapper(nursery, data=self._telemetry)
+
+        # Heading control (IMU yaw) --------
+        self._heading = HeadingController(self._tractor, self._sensors, nursery)
+
+        # Beacon bearing (phase detector + RSSI while turning + IMU yaw) --
+        self._bearing = BearingFusion(self._sensors, self._telemetry, nursery, self.AUTO_BEARING_SCALE,
+                                      self.AUTO_TURN_ANGLE)
+        self._radio_system.subscribe(notification_callbacks=[self._bearing.direction_listener])
 
         # GPS -----------------------------
         # Lat/long/alt data is updated automatically, the satellite list is not used for now
-        self._gps = GPS(GPS_PORT, nursery, data=self._sensor_data)
+        self._gps = GPS(GPS_PORT, nursery, data=self._telemetry, baud_rate=GPS_BAUD_RATE, update_rate=GPS_UPDATE_RATE,
+                        protocol=GPS_PROTOCOL)
+
+        # Localization (GPS + IMU + commanded speed) --
+        self._localization = Localization(self._tractor, self._sensors, self._telemetry, nursery, ROVER_MAX_SPEED)
 
         # Transceiver --------------------
         self._transceiver = ReceptorSystem(RX_INTERRUPTION_PIN, TX_DEVICE, nursery,
-                                           notification_callbacks=[self.transceiver_listener], data=self._sensor_data)
+                                           notification_callbacks=[self.transceiver_listener], data=self._telemetry)
+        self._rssi_zones = RSSIHysteresis(self.RSSI_GIVEUP_THRESHOLD, self.RSSI_FOLLOW_THRESHOLD,
+                                          self.RSSI_STOP_THRESHOLD, self.RSSI_HYSTERESIS, self.RSSI_DWELL_TIME)
 
         # Battery & current measurements -----------
-        self._battery = BatteryMeasure(nursery, self._adc, BATTERY_CHANNEL, data=self._sensor_data)
-        self._battery.subscribe(notification_callbacks=[self.battery_listener])
-        self._current_meas = CurrentMeasure(nursery, self._adc, CURRENT_CHANNEL, data=self._sensor_data)
-        self._current_meas.subscribe(notification_callbacks=[self.current_listener])
+        # The state of charge integrates every current measurement written to the telemetry store
+        self._soc = SoCEstimator(BATTERY_CAPACITY, BATTERY_INTERNAL_RESISTANCE, BATTERY_QUIESCENT_CURRENT)
+        self._telemetry.add_sink(self._soc.record)
+        self._battery = BatteryMeasure(nursery, self._adc, BATTERY_CHANNEL, data=self._telemetry, estimator=self._soc)
+        self._current_meas = CurrentMeasure(nursery, self._adc, CURRENT_CHANNEL, data=self._telemetry)
+        self._overcurrent = OvercurrentGuard(self._tractor, self._adc, CURRENT_CHANNEL, nursery,
+                                             self.CURRENT_TRIP_THRESHOLD, self.CURRENT_TRIP_RATE,
+                                             self.CURRENT_TRIP_SAMPLES,
+                                             notification_callbacks=[self.overcurrent_listener])
 
         # Server -------------------------
-        self._server = Server(SERVER_ADDRESS, SERVER_PORT, self._sensor_data, ROVER_ID, nursery,
+        self._server = Server(SERVER_ADDRESS, SERVER_PORT, self._telemetry, ROVER_ID, nursery,
                               error_callbacks=[self.server_error])
 
         # Command system -----------------
         self._commands = CommandSystem(COMMAND_PORT, nursery, notification_callbacks=[self.command_listener])
 
         # --------------- Start in idle mode ------------
-        self._change_mode(self.MODE_IDLE)
+        self._build_state_machine()
+        self._machine.start(self._st_idle)
+        self._control_loop = ControlLoop(self.control_step, self.CONTROL_PERIOD)  # type: ControlLoop
+        self._battery_version = 0
+        self._current_version = 0
+
+    def _build_state_machine(self):
+        """
+        Operation modes (outermost states) and system states (nested states), as a transition table
+        """
+        machine = StateMachine(on_transition=self._on_transition)
+        self._machine = machine  # type: StateMachine
+
+        # Events
+        self._ev_select_mode = {}  # Mode name (as received in commands) -> event
+        for mode in (self.MODE_IDLE, self.MODE_AUTOMATIC, self.MODE_MANUAL, self.MODE_BATTERY_SAVER,
+                     self.MODE_CURRENT_PROTECTION):
+            self._ev_select_mode[mode] = machine.add_event(f"SELECT_{mode}")
+        self._ev_low_battery = machine.add_event("LOW_BATTERY")
+        self._ev_overcurrent = machine.add_event("OVERCURRENT")
+        self._ev_protection_timeout = machine.add_event("PROTECTION_TIMEOUT")
+        self._ev_rssi_lost = machine.add_event("RSSI_LOST")  # RSSI < RSSI_GIVEUP_THRESHOLD
+        self._ev_rssi_far = machine.add_event("RSSI_FAR")  # RSSI < RSSI_FOLLOW_THRESHOLD
+        self._ev_rssi_close = machine.add_event("RSSI_CLOSE")  # RSSI_FOLLOW_THRESHOLD <= RSSI <= RSSI_STOP_THRESHOLD
+        self._ev_rssi_reached = machine.add_event("RSSI_REACHED")  # RSSI > RSSI_STOP_THRESHOLD
+
+        # States
+        self._st_idle = machine.add_state(self.MODE_IDLE, on_entry=self._enter_disabled_mode)
+        self._st_automatic = machine.add_state(self.MODE_AUTOMATIC, on_entry=self._enter_enabled_mode)
+        self._st_auto_notfound = machine.add_state(self.SYSTEM_AUTO_NOTFOUND, self._st_automatic, initial=True,
+                                                   on_entry=self._idle_traction)
+        self._st_auto_following = machine.add_state(self.SYSTEM_AUTO_FOLLOWING, self._st_automatic)
+        self._st_auto_reached = machine.add_state(self.SYSTEM_AUTO_REACHED, self._st_automatic,
+                                                  on_entry=self._idle_traction)
+        self._st_manual = machine.add_state(self.MODE_MANUAL, on_entry=self._enter_enabled_mode)
+        self._st_protection = machine.add_state(self.MODE_CURRENT_PROTECTION, on_entry=self._enter_disabled_mode,
+                                                on_exit=self._tractor.reset_trip)
+        self._st_battery_saver = machine.add_state(self.MODE_BATTERY_SAVER, on_entry=self._enter_disabled_mode)
+        mode_states = {
+            self.MODE_IDLE: self._st_idle,
+            self.MODE_AUTOMATIC: self._st_automatic,
+            self.MODE_MANUAL: self._st_manual,
+            self.MODE_CURRENT_PROTECTION: self._st_protection,
+            self.MODE_BATTERY_SAVER: self._st_battery_saver,
+        }
+        # RSSI polling profile of every state (the innermost state with a profile applies)
+        self._rssi_polling = {
+            self._st_idle: ReceptorSystem.POLLING_SLOW,
+            self._st_automatic: ReceptorSystem.POLLING_NORMAL,
+            self._st_auto_following: ReceptorSystem.POLLING_FAST,
+            self._st_manual: ReceptorSystem.POLLING_SLOW,
+            self._st_protection: ReceptorSystem.POLLING_SLOW,
+            self._st_battery_saver: ReceptorSystem.POLLING_WOR,
+        }
+
+        # Transitions
+        for source in (self._st_idle, self._st_automatic, self._st_manual, self._st_protection):
+            for mode, event in self._ev_select_mode.items():
+                machine.add_transition(source, event, mode_states[mode])
+            machine.add_transition(source, self._ev_low_battery, self._st_battery_saver)
+        for source in (self._st_idle, self._st_automatic, self._st_manual):
+            machine.add_transition(source, self._ev_overcurrent, self._st_protection)
+        # Battery saver is never left
+        for event in self._ev_select_mode.values():
+            machine.add_transition(self._st_battery_saver, event, None,
+                                   action=lambda: print("Could not change mode - Currently in battery saver"))
+        # Current protection restores the previous mode after some time
+        machine.add_timer(self._st_protection, self.PROTECTION_RESTORE_TIME, self._ev_protection_timeout)
+        machine.add_transition(self._st_protection, self._ev_protection_timeout, StateMachine.HISTORY)
+        # Automatic mode substates
+        machine.add_transition(self._st_automatic, self._ev_rssi_lost, self._st_auto_notfound)
+        machine.add_transition(self._st_automatic, self._ev_rssi_far, self._st_auto_following)
+        machine.add_transition(self._st_automatic, self._ev_rssi_reached, self._st_auto_reached)
+        machine.add_transition(self._st_auto_notfound, self._ev_rssi_close, self._st_auto_reached)
 
 
     async def initialize_components(self):
         self._nursery.start_soon(self._radio_system.a_run_notification_loop)
         self._nursery.start_soon(self._gps.a_run_notification_loop)
         self._nursery.start_soon(self._sensors.a_run_notification_loop)
+        self._nursery.start_soon(self._heading.a_run_control_loop)
+        self._nursery.start_soon(self._bearing.a_run_notification_loop)
+        self._nursery.start_soon(self._localization.a_run_notification_loop)
         self._nursery.start_soon(self._battery.a_run_notification_loop)
         self._nursery.start_soon(self._current_meas.a_run_notification_loop)
+        self._nursery.start_soon(self._overcurrent.a_run_notification_loop)
         self._nursery.start_soon(self._transceiver.a_run_notification_loop)
         self._nursery.start_soon(self._server.initialize_session, True)
         self._nursery.start_soon(self._commands.run)
-        self._tractor.toggle_enable(True)
+        self._nursery.start_soon(self._control_loop.a_run)
+        self._nursery.start_soon(self._logger.a_run_flush_loop, TELEMETRY_LOG_FLUSH_PERIOD)
 
         self._nursery.start_soon(self.visualize_data_values)  # DEBUG
-        self._change_mode(self.MODE_AUTOMATIC)
+        self._machine.dispatch(self._ev_select_mode[self.MODE_AUTOMATIC])
 
-    async def radio_listener(self, source, param):
-        if self._operation_mode != self.MODE_AUTOMATIC or self._system_state != self.SYSTEM_AUTO_FOLLOWING:
+    def control_step(self):
+        """
+        One control cycle (CONTROL_PERIOD), run by the control loop: state machine timers, and decisions taken from
+        the latest telemetry values. Battery and current are only checked when there is a new measurement
+        """
+        data = self._telemetry
+        self._machine.poll_timers()
+
+        version = data.version_of('battery')
+        if version != self._battery_version:
+            self._battery_version = version
+            if data['battery'] is not None and data['battery'] < self.BATTERY_SAVER_THRESHOLD:
+                self._machine.dispatch(self._ev_low_battery)
+        version = data.version_of('motor_current')
+        if version != self._current_version:
+            self._current_version = version
+            if data['motor_current'] is not None and data['motor_current'] > self.CURRENT_PROTECTION_THRESHOLD:
+                self._machine.dispatch(self._ev_overcurrent)
+
+        self._update_rssi_zone(data['rssi'], data['rssi_confidence'])
+        if self._machine.state is self._st_auto_following:
+            self._follow_bearing(data['bearing'], data['bearing_std'])
+
+    def _update_rssi_zone(self, rssi, confidence):
+        if rssi is None or confidence is None or confidence < self.RSSI_MIN_CONFIDENCE:
+            self._rssi_zones.reset()
+            self._machine.dispatch(self._ev_rssi_lost)
             return
-        angle_sign = param.angle_sign
-        translated_traction = self.TRACTION_TRANSLATOR[angle_sign]
-        is_confident = param.is_confident
-
-        if self._tractor.state == translated_traction or not is_confident:  # If no change is needed, don't change
+        zone = self._rssi_zones.update(rssi, trio.current_time())
+        if zone == ZONE_LOST:
+            self._machine.dispatch(self._ev_rssi_lost)
+        elif zone == ZONE_FAR:
+            self._machine.dispatch(self._ev_rssi_far)
+        elif zone == ZONE_CLOSE:
+            self._machine.dispatch(self._ev_rssi_close)
+        elif zone == ZONE_REACHED:
+            self._machine.dispatch(self._ev_rssi_reached)
+
+    def _follow_bearing(self, bearing, bearing_std):
+        if bearing is None:  # No beacon signal
+            self._heading.release()
+            if self._tractor.velocity != (0, 0):
+                self._tractor.stop(1)
+            return
+        if bearing_std > self.AUTO_MAX_BEARING_STD:  # Don't change course if not confident
             return
 
-        if angle_sign is None:
-            self._tractor.stop(1)
-        elif angle_sign == 0:
-            self._tractor.forward(1)
-        else:
-            self._tractor.turn(angle_sign*0.8)
-
-    async def battery_listener(self, source, param: BatteryEventArgs):
-        if param.data['battery'] < self.BATTERY_SAVER_THRESHOLD and self._operation_mode != self.MODE_BATTERY_SAVER:
-            self._change_mode(self.MODE_BATTERY_SAVER)
+        # The heading controller turns (while moving forwards) until the new bearing is reached
+        self._heading.turn_to(bearing, linear=self.AUTO_LINEAR_SPEED)
 
-    async def current_listener(self, source, param: CurrentEventArgs):
-        if param.data['motor_current'] > self.CURRENT_PROTECTION_THRESHOLD and self._operation_mode != self.MODE_CURRENT_PROTECTION:
-            previous_mode = self._operation_mode
-            self._change_mode(self.MODE_CURRENT_PROTECTION)
-            self._nursery.start_soon(schedule, self._change_mode, 3, previous_mode)
+    async def overcurrent_listener(self, source, param: OvercurrentEventArgs):
+        # The driver has already been cut off by the guard
+        print(f"!!!! OVERCURRENT TRIP: {param.current:.2f}A")
+        self._logger.log_event('overcurrent_trip', param.current)
+        self._machine.dispatch(self._ev_overcurrent)
 
-    async def transceiver_listener(self, source, param: ReceptorEventArgs):
-        if self._operation_mode != self.MODE_AUTOMATIC:
-            return
-        rssi = param.data['rssi']
-        if rssi < self.RSSI_GIVEUP_THRESHOLD:
-            self._change_state(self.SYSTEM_AUTO_NOTFOUND)
-            self._tractor.idle()
-        elif rssi < self.RSSI_FOLLOW_THRESHOLD:
-            self._change_state(self.SYSTEM_AUTO_FOLLOWING)
-        elif rssi > self.RSSI_STOP_THRESHOLD \
-                or (rssi > self.RSSI_FOLLOW_THRESHOLD and self._system_state == self.SYSTEM_AUTO_NOTFOUND):
-            self._change_state(self.SYSTEM_AUTO_REACHED)
-            self._tractor.idle()
+    async def transceiver_listener(self, source, param):
+        # RSSI values are read by the control loop
+        if param.event_type == ReceptorSystem.PACKET_EVENT:
+            self._logger.log_event('packet', param.packet.payload.hex())
 
     async def command_listener(self, source, param: CommandEventArgs):
         command_data = param.data
         print(f"Received command: {command_data}")
+        self._logger.log_event('command', json.dumps(command_data, sort_keys=True))
         if not "command" in command_data:
             print("!!!! INVALID COMMAND")
             return
         if command_data['command'] == CommandSystem.DIRECTION_COMMAND:
-            if self._operation_mode != self.MODE_MANUAL:
+            if not self._machine.is_in(self._st_manual):
                 return
             if "param" not in command_data:
                 print("!!!! INVALID COMMAND")
@@ -301,7 +487,17 @@ class ControlSystem:
             if "param" not in command_data:
                 print("!!!! INVALID COMMAND")
                 return
-            self._change_mode(command_data["param"])
+            event = self._ev_select_mode.get(command_data["param"])
+            if event is None:
+                print(f"!!!! Invalid or unimplemented operation mode: {command_data['param']}")
+                return
+            self._machine.dispatch(event)
+
+        elif command_data['command'] == CommandSystem.BEACON_COMMAND:
+            # Beacon to follow in AUTOMATIC mode. No (or null) param: the strongest one
+            beacon_id = command_data.get("param")
+            self._transceiver.select_beacon(beacon_id)
+            print(f"TRACKED BEACON: {beacon_id if beacon_id is not None else 'STRONGEST'}")
 
         elif command_data['command'] == CommandSystem.SESSION_COMMAND:
             self._nursery.start_soon(self._server.initialize_session, True)
@@ -329,45 +525,29 @@ class ControlSystem:
             print(f"!!!! DETECTED UNKNOWN SERVER ERROR: {error_code}. WasRunning: {was_running}")
 
 
-    def _change_mode(self, mode):
-        if self._operation_mode == self.MODE_BATTERY_SAVER:
-            print("Could not change mode - Currently in battery saver")
-            return
-        if mode == self.MODE_IDLE:  # Nothing to set up for idle mode (for now at least)
-            self._operation_mode = self.MODE_IDLE
-            self._change_state(None)
-            self._tractor.idle()
-            self._tractor.toggle_enable(False)
-        elif mode == self.MODE_AUTOMATIC:
-            self._operation_mode = self.MODE_AUTOMATIC
-            self._change_state(self.SYSTEM_AUTO_NOTFOUND)
-            self._tractor.idle()
-            self._tractor.toggle_enable(True)
-        elif mode == self.MODE_MANUAL:
-            self._operation_mode = self.MODE_MANUAL
-            self._change_state(None)
-            self._tractor.idle()
-            self._tractor.toggle_enable(True)
-        elif mode == self.MODE_CURRENT_PROTECTION:
-            self._operation_mode = self.MODE_CURRENT_PROTECTION
-            self._change_state(None)
-            self._tractor.idle()
-            self._tractor.toggle_enable(False)
-        elif mode == self.MODE_BATTERY_SAVER:
-            self._operation_mode = self.MODE_BATTERY_SAVER
-            self._change_state(None)
-            self._tractor.idle()
-            self._tractor.toggle_enable(False)
-
-        else:
-            print(f"!!!! Invalid or unimplemented operation mode: {mode}")
-
-        print(f"### NEW MODE: {self._operation_mode}")
-        self._sensor_data['session_state'] = self._operation_mode
+    def _enter_enabled_mode(self):
+        self._idle_traction()
+        self._tractor.toggle_enable(True)
 
-    def _change_state(self, new_state):
-        self._system_state = new_state
-        self._sensor_data['session_substate'] = new_state
+    def _enter_disabled_mode(self):
+        self._idle_traction()
+        self._tractor.toggle_enable(False)
+
+    def _idle_traction(self):
+        self._heading.release()  # Otherwise, the heading controller would keep driving the motors
+        self._tractor.idle()
+
+    def _on_transition(self, source, event, target):
+        self._logger.log_event('state_transition', target.name)
+        mode = target.path[0]
+        if source is None or source.path[0] is not mode:
+            print(f"### NEW MODE: {mode.name}")
+        self._telemetry.update({'session_state': mode.name,
+                                'session_substate': target.name if target is not mode else None})
+        for state in reversed(target.path):
+            if state in self._rssi_polling:
+                self._transceiver.set_polling_profile(self._rssi_polling[state])
+                break
 
     async def visualize_data_values(self):
         """
@@ -376,16 +556,15 @@ class ControlSystem:
         """
         counter = 0
         while True:
-            print(f"### {counter}s ###  Data: {self._sensor_data}")
+            print(f"### {counter}s ###  Data: {self._telemetry.snapshot().as_dict()}")
+            print(f"### Motor current over the last 10s (min, max, mean): {self._history['motor_current'].stats(10)}")
+            print(f"### Radio: {self._transceiver.polling_profile} polling, "
+                  f"RX duty cycle {self._transceiver.rx_duty_cycle:.1%}, {self._transceiver.spi_transfers} SPI transfers")
+            print(f"### {self._control_loop}")
             counter += 1
             await trio.sleep(1)
 
 
-async def schedule(function, scheduled_time, *args, **kwargs):
-    await trio.sleep(scheduled_time)
-    function(*args, **kwargs)
-
-
 async def radio_printer(source, param):
     # For debugging purposes only
     print(f"New radio system event: ## {param.angle_sign} ##\t## {param.is_confident}")
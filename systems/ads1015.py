@@ -1,5 +1,6 @@
 import time
 import smbus
+from threading import RLock
 from gpiozero import DigitalInputDevice
 
 
@@ -18,6 +19,12 @@ class ADS1015:
         self._default_channel = channel
         self._default_sample_rate = sample_rate
         self._default_voltage_ref = voltage_ref
+        # Serializes bus transactions and configuration changes (the device may be read from several threads)
+        self._lock = RLock()
+        # After a single-shot read of another channel, the conversion register keeps that channel's sample until the
+        # first conversion of the default channel ends: continuous reads return the last valid value until then
+        self._valid_after = 0  # time.monotonic()
+        self._last_continuous = None
 
         self._disable_comparator()
         self.configure_defaults(self._default_channel, self._default_voltage_ref, self._default_sample_rate)
@@ -92,6 +99,12 @@ class ADS1015:
         self._ready_pin.wait_for_active(1/self._default_sample_rate)
         self._ready_pin.wait_for_inactive(0.5/self._default_sample_rate)
 
+    def _wait_idle(self, sample_rate):
+        # Polls the OS bit (1: no conversion in progress), for two conversion times at most
+        deadline = time.monotonic() + 2 / sample_rate + 0.001
+        while not self._read_config()[0] & 0x80 and time.monotonic() < deadline:
+            pass
+
     def _read_config(self):
         # Reads the ADS1015 configuration register
         config = self._bus.read_i2c_block_data(self._device_address, self._CONFIG_REGISTER, 2)
@@ -118,52 +131,87 @@ class ADS1015:
         #   (7) COMP_POL[3] = 1, polarity of the conversion ready signal
         #   (8) COMP_LAT[2] = irrelevant when using the ADDR/READY pin as a conversion ready signal
         #   (9) COMP_QUE[1:0] = any value other than 11 when using ADDR/READY as a conversion ready signal
+        with self._lock:
+            self._bus.write_i2c_block_data(self._device_address, self._CONFIG_REGISTER,
+                                           self._config_bytes(channel, voltage_reference, sample_rate, False))
+            # First conversion of the new configuration (plus the ~25us wake-up)
+            self._valid_after = time.monotonic() + 1.1 / sample_rate + 25e-6
+
+    @staticmethod
+    def _config_bytes(channel, voltage_reference, sample_rate, single_shot, start=False):
+        # Single-shot: MODE[8] = 1. OS[15] = 1 starts a conversion (only from the power-down state)
         mux_code = ADS1015._get_channel(channel)
         pga_code = ADS1015._get_pga(voltage_reference)
         data_rate_code = ADS1015._get_data_rate(sample_rate)
-        config_first_byte = (0 << 7) | (mux_code << 4) | (pga_code << 1) | 0
+        config_first_byte = (int(start) << 7) | (mux_code << 4) | (pga_code << 1) | int(single_shot)
         config_second_byte = (data_rate_code << 5) | (0 << 4) | (1 << 3) | 0
-        self._bus.write_i2c_block_data(self._device_address, self._CONFIG_REGISTER,
-                                       [config_first_byte, config_second_byte])  # starting continuous?-shot conversion
+        return [config_first_byte, config_second_byte]
 
     def read_continuous(self):
         # Reads the conversion stored in the conversion register (last conversion value)
         # The analog value is represented by a two's complement format left-adjusted 12-bit word within
         # 16-bit data (2 bytes)
-        reg = self._bus.read_i2c_block_data(self._device_address, self._CONVERSION_REGISTER, 2)
-        return self._data_processing(reg, self._default_voltage_ref)
+        with self._lock:
+            wait = self._valid_after - time.monotonic()
+            if wait > 0:  # Conversion register not re-synchronized yet after a channel switch
+                if self._last_continuous is not None:
+                    return self._last_continuous
+                time.sleep(wait)
+            reg = self._bus.read_i2c_block_data(self._device_address, self._CONVERSION_REGISTER, 2)
+            self._last_continuous = self._data_processing(reg, self._default_voltage_ref)
+            return self._last_continuous
 
     def read_single_shot(self, channel: int = None, voltage_reference: float = None, sample_rate: int = None):
         channel = channel if channel is not None else self._default_channel
         voltage_reference = voltage_reference if voltage_reference is not None else self._default_voltage_ref
         sample_rate = sample_rate if sample_rate is not None else self._default_sample_rate
-        if all([channel == self._default_channel, voltage_reference == self._default_voltage_ref,
-                sample_rate == self._default_sample_rate]):
-            reg = self._bus.read_i2c_block_data(self._device_address, self._CONVERSION_REGISTER, 2)
-        else:
-            old_channel = self._default_channel
-            old_voltage = self._default_voltage_ref
-            old_sample_rate = self._default_sample_rate
-            self.configure_defaults(channel, voltage_reference, sample_rate)
-            self._wait_ack()
-            #time.sleep(1/sample_rate)
-            reg = self._bus.read_i2c_block_data(self._device_address, self._CONVERSION_REGISTER, 2)
-            self.configure_defaults(old_channel, old_voltage, old_sample_rate)
+        with self._lock:
+            if all([channel == self._default_channel, voltage_reference == self._default_voltage_ref,
+                    sample_rate == self._default_sample_rate]):
+                reg = self._bus.read_i2c_block_data(self._device_address, self._CONVERSION_REGISTER, 2)
+            else:
+                # True single-shot conversion, completion polled through the OS bit: the READY pulses may come from
+                # the conversion of the default channel in progress, so the pin cannot tell which conversion ended.
+                # Single-shot mode first: the conversion in progress ends and the device powers down
+                config = self._config_bytes(channel, voltage_reference, sample_rate, True)
+                self._bus.write_i2c_block_data(self._device_address, self._CONFIG_REGISTER, config)
+                self._wait_idle(self._default_sample_rate)
+                config[0] |= 0x80  # Start the conversion of "channel"
+                self._bus.write_i2c_block_data(self._device_address, self._CONFIG_REGISTER, config)
+                time.sleep(1 / sample_rate)
+                self._wait_idle(sample_rate)
+                reg = self._bus.read_i2c_block_data(self._device_address, self._CONVERSION_REGISTER, 2)
+                # Back to continuous conversions of the default channel
+                self.configure_defaults(self._default_channel, self._default_voltage_ref, self._default_sample_rate)
         return ADS1015._data_processing(reg, voltage_reference)
 
 
 class DummyADS1015:
-    def __init__(self, *args, **kwargs):
-        pass
+    """
+    Simulated A/D converter. Every channel reads 1V unless another voltage is set (see set_voltage)
+    """
+    DEFAULT_VOLTAGE = 1
 
-    def configure_defaults(self, *args, **kwargs):
-        pass
+    def __init__(self, *args, channel: int = 0, **kwargs):
+        self._default_channel = channel
+        self._voltages = {}  # Channel -> simulated voltage
+
+    def set_voltage(self, channel: int, voltage: float):
+        """
+        Sets the voltage read from now on in "channel". Can be called from any thread
+        """
+        self._voltages[channel] = voltage
+
+    def configure_defaults(self, channel: int = None, *args, **kwargs):
+        if channel is not None:
+            self._default_channel = channel
 
     def read_continuous(self, *args, **kwargs):
-        return 1
+        return self._voltages.get(self._default_channel, self.DEFAULT_VOLTAGE)
 
-    def read_single_shot(self, *args, **kwargs):
-        return 1
+    def read_single_shot(self, channel: int = None, *args, **kwargs):
+        channel = channel if channel is not None else self._default_channel
+        return self._voltages.get(channel, self.DEFAULT_VOLTAGE)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
 from systems.event_source import AsyncEventSource, BaseEventArgs
 from systems.ads1015 import ADS1015
+from systems.telemetry import TelemetryStore, TelemetrySnapshot
+from systems.state_of_charge import SoCEstimator
 from gpiozero import DigitalInputDevice
 import smbus
 import trio
@@ -7,18 +9,22 @@ import trio
 
 class BatteryMeasure(AsyncEventSource):
     """
-    Simple module to perform battery voltage measurements and transform them onto battery levels
+    Simple module to perform battery voltage measurements and transform them onto battery levels.
+    If a SoCEstimator is provided, the reported level is its state of charge (the voltage is only used to correct
+    it). Otherwise, the voltage is linearly mapped onto the battery level.
     """
     BATTERY_EVENT = "BATTERY_EVENT"
     _MAX_BATTERY_VOLTAGE = 4.1
     _MIN_BATTERY_VOLTAGE = 3.2
     _SPAN_BATTERY_VOLTAGE = _MAX_BATTERY_VOLTAGE - _MIN_BATTERY_VOLTAGE
 
-    def __init__(self, nursery, adc: ADS1015, channel: int, data=None, notification_callbacks=None, error_callbacks=None):
+    def __init__(self, nursery, adc: ADS1015, channel: int, data=None, estimator: SoCEstimator = None,
+                 notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
         self._CHANNEL = channel
-        self._data = data if data is not None else {'battery': None}
+        self._data = data if data is not None else TelemetryStore(['battery'])  # type: TelemetryStore
         self._adc = adc  # type: ADS1015
+        self._estimator = estimator  # type: SoCEstimator
         self._running = False
 
     async def a_run_notification_loop(self):
@@ -28,23 +34,27 @@ class BatteryMeasure(AsyncEventSource):
         while self._running:
             await trio.sleep(1)
             bat_voltage = self._adc.read_single_shot(channel=self._CHANNEL)
-            battery_percent = max(0, min((bat_voltage - self._MIN_BATTERY_VOLTAGE)/self._SPAN_BATTERY_VOLTAGE * 100, 100))
+            if self._estimator is not None:
+                battery_percent = self._estimator.update_voltage(bat_voltage)
+            else:
+                battery_percent = max(0, min((bat_voltage - self._MIN_BATTERY_VOLTAGE)/self._SPAN_BATTERY_VOLTAGE * 100, 100))
             self._data['battery'] = battery_percent
-            await self.raise_event(BatteryEventArgs(self.BATTERY_EVENT, self._data.copy()))
+            await self.raise_event(BatteryEventArgs(self.BATTERY_EVENT, self._data.snapshot()))
 
     def stop_notification_loop(self):
         self._running = False
 
 class BatteryEventArgs(BaseEventArgs):
-    def __init__(self, event_type, data_dict: dict):
+    def __init__(self, event_type, data: TelemetrySnapshot):
         super().__init__(event_type)
-        self.data = data_dict  # type: dict
+        self.data = data  # type: TelemetrySnapshot
 
 
 class DummyBatteryMeasure(AsyncEventSource):
-    def __init__(self, nursery, adc: ADS1015, channel: int, data=None, notification_callbacks=None, error_callbacks=None):
+    def __init__(self, nursery, adc: ADS1015, channel: int, data=None, estimator: SoCEstimator = None,
+                 notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
-        self._data = data if data is not None else {'battery': None}
+        self._data = data if data is not None else TelemetryStore(['battery'])  # type: TelemetryStore
         self._running = False
 
     async def a_run_notification_loop(self):
@@ -54,7 +64,7 @@ class DummyBatteryMeasure(AsyncEventSource):
         while self._running:
             await trio.sleep(1)
             self._data['battery'] = 100
-            await self.raise_event(BatteryEventArgs(BatteryMeasure.BATTERY_EVENT, self._data.copy()))
+            await self.raise_event(BatteryEventArgs(BatteryMeasure.BATTERY_EVENT, self._data.snapshot()))
 
     def stop_notification_loop(self):
         self._running = False
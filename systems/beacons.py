@@ -0,0 +1,132 @@
+import time
+from systems.history import RingBuffer
+from systems.packets import Packet
+
+
+def default_beacon_id(packet: Packet) -> str:
+    """
+    Beacons send their ID as the payload text, optionally followed by ",<data>" (e.g. "B1" or "B1,42")
+    """
+    return packet.text.split(',', 1)[0]
+
+
+class Beacon:
+    """
+    Reception state of a single beacon
+    """
+    __slots__ = ('id', 'rssi_history', 'smoothed_rssi', 'first_seen', 'last_seen', 'packet_count')
+
+    def __init__(self, beacon_id, history_length: int):
+        self.id = beacon_id
+        self.rssi_history = RingBuffer(history_length)  # type: RingBuffer
+        self.smoothed_rssi = None  # dBm, exponential moving average
+        self.first_seen = None  # time.monotonic()
+        self.last_seen = None  # time.monotonic()
+        self.packet_count = 0
+
+    def get_rssi_trend(self, duration: float = None):
+        """
+        RSSI slope in dBm/s over the last "duration" seconds (positive: getting closer). None without enough samples
+        """
+        return self.rssi_history.trend(duration)
+
+    def __repr__(self):
+        return f"Beacon({self.id!r}, {self.smoothed_rssi:.1f}dBm, {self.packet_count} packets)"
+
+
+class BeaconRegistry:
+    """
+    Beacons heard by the receiver, keyed by beacon ID (taken from every valid packet), each with its RSSI history,
+    smoothed RSSI (exponential moving average) and last time seen. Beacons not heard for "stale_time" seconds are
+    evicted.
+    The target is the selected beacon (select), or the strongest one if none is selected.
+    """
+    def __init__(self, stale_time: float = 5, smoothing: float = 0.3, history_length: int = 60,
+                 beacon_id=default_beacon_id, clock=time.monotonic):
+        """
+        :param stale_time: seconds without packets before a beacon is evicted
+        :param smoothing: EMA weight of every new RSSI sample (0 to 1, 1: no smoothing)
+        :param history_length: RSSI samples kept per beacon
+        :param beacon_id: callable(Packet) -> beacon ID (hashable)
+        :param clock: time source (must match the packet timestamps)
+        """
+        self._stale_time = stale_time
+        self._smoothing = smoothing
+        self._history_length = history_length
+        self._beacon_id = beacon_id
+        self._clock = clock
+        self._beacons = {}
+        self._selected_id = None
+
+    def record(self, packet: Packet):
+        """
+        Updates the beacon that sent the packet. Packets with a wrong CRC or without RSSI are ignored
+        :return: the updated Beacon, None if the packet was ignored
+        """
+        if not packet.crc_ok or packet.rssi is None:
+            return None
+        beacon_id = self._beacon_id(packet)
+        beacon = self._beacons.get(beacon_id)
+        if beacon is None:
+            beacon = self._beacons[beacon_id] = Beacon(beacon_id, self._history_length)
+            beacon.first_seen = packet.timestamp
+        beacon.last_seen = packet.timestamp
+        beacon.packet_count += 1
+        beacon.rssi_history.append(packet.rssi, packet.timestamp)
+        if beacon.smoothed_rssi is None:
+            beacon.smoothed_rssi = packet.rssi
+        else:
+            beacon.smoothed_rssi += self._smoothing * (packet.rssi - beacon.smoothed_rssi)
+        return beacon
+
+    def evict_stale(self, now: float = None):
+        """
+        Removes the beacons not heard for "stale_time" seconds
+        :return: IDs of the removed beacons
+        """
+        now = now if now is not None else self._clock()
+        stale = [beacon_id for beacon_id, beacon in self._beacons.items()
+                 if now - beacon.last_seen > self._stale_time]
+        for beacon_id in stale:
+            del self._beacons[beacon_id]
+        return stale
+
+    def strongest(self):
+        """
+        Beacon with the highest smoothed RSSI, None if there are none
+        """
+        return max(self._beacons.values(), key=lambda beacon: beacon.smoothed_rssi, default=None)
+
+    def select(self, beacon_id):
+        """
+        Tracks a specific beacon (even if it is not currently heard). None: track the strongest one
+        """
+        self._selected_id = beacon_id
+
+    @property
+    def selected_id(self):
+        return self._selected_id
+
+    @property
+    def target(self):
+        """
+        Selected beacon if there is a selection (None while it is not heard), strongest beacon otherwise
+        """
+        if self._selected_id is not None:
+            return self._beacons.get(self._selected_id)
+        return self.strongest()
+
+    def __len__(self):
+        return len(self._beacons)
+
+    def __iter__(self):
+        return iter(list(self._beacons.values()))
+
+    def __contains__(self, beacon_id):
+        return beacon_id in self._beacons
+
+    def __getitem__(self, beacon_id) -> Beacon:
+        return self._beacons[beacon_id]
+
+    def __repr__(self):
+        return f"BeaconRegistry({list(self._beacons.values())}, selected: {self._selected_id!r})"
@@ -0,0 +1,236 @@
+from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.heading import IMU_YAW_SIGN, wrap_angle
+from systems.telemetry import TelemetryStore
+import math
+import trio
+
+
+class BearingEstimator:
+    """
+    Kalman filter for the bearing of the beacon, kept in the IMU frame (degrees, counter-clockwise, same frame as
+    HeadingController.heading), so the estimate is not affected by the rover turning: the bearing relative to the
+    rover is bearing - heading. Random walk model (the rover and the beacon move).
+    Measurements are relative bearings taken at a known heading, each with its own standard deviation
+    """
+    def __init__(self, process_noise: float = 25.0):
+        """
+        :param process_noise: bearing variance growth (deg^2/s)
+        """
+        self.process_noise = process_noise
+        self.reset()
+
+    def reset(self):
+        self._bearing = None
+        self._variance = math.inf
+
+    @property
+    def bearing(self):
+        """
+        Beacon bearing in the IMU frame (degrees), None without measurements
+        """
+        return self._bearing
+
+    @property
+    def std(self) -> float:
+        """
+        Bearing standard deviation (degrees), infinite without measurements
+        """
+        return math.sqrt(self._variance)
+
+    def relative(self, heading: float):
+        """
+        Beacon bearing relative to the rover (degrees, positive: counter-clockwise), None without measurements
+        :param heading: current heading (IMU frame)
+        """
+        return wrap_angle(self._bearing - heading) if self._bearing is not None else None
+
+    def predict(self, dt: float):
+        if self._bearing is not None:
+            self._variance += self.process_noise * dt
+
+    def update(self, relative_bearing: float, heading: float, std: float):
+        """
+        :param relative_bearing: measured bearing relative to the rover (degrees, positive: counter-clockwise)
+        :param heading: heading at the time of the measurement (IMU frame)
+        :param std: measurement standard deviation (degrees)
+        """
+        measurement = wrap_angle(heading + relative_bearing)
+        noise = std * std
+        if self._bearing is None:
+            self._bearing, self._variance = measurement, noise
+            return
+        gain = self._variance / (self._variance + noise)
+        self._bearing = wrap_angle(self._bearing + gain * wrap_angle(measurement - self._bearing))
+        self._variance *= 1 - gain
+
+
+class BearingFusion(AsyncEventSource):
+    """
+    Single beacon bearing estimate (BearingEstimator) for the control system, updated at a fixed rate with:
+        - the phase detector (RadioDetection events, through direction_listener): angle offset, or angle sign only,
+          less trusted when not confident. A confident "no beacon" reading discards the estimate,
+        - the RSSI gradient while turning: if the RSSI ("rssi" store field, when "rssi_confidence" is high enough)
+          grows while the rover turns, the beacon is on that side,
+        - the IMU yaw, which keeps the estimate in a fixed frame while the rover turns.
+    Results are published as BEARING_EVENT events and "bearing", "bearing_std" store fields (bearing relative to the
+    rover, degrees counter-clockwise).
+    """
+    BEARING_EVENT = "BEARING_EVENT"
+    # --- Needs calibration ---
+    _PROCESS_NOISE = 25  # deg^2/s
+    _PHASE_STD = 15  # deg, phase detector reading
+    _PHASE_UNCONFIDENT_FACTOR = 3  # Standard deviation multiplier for non-confident phase readings
+    _RSSI_ANGLE = 45  # deg, bearing towards the side where the RSSI grows
+    _RSSI_STD = 60  # deg
+    _RSSI_MIN_TURN = 10  # deg turned between the compared RSSI samples
+    _RSSI_MIN_CHANGE = 1.5  # dB between the compared RSSI samples
+    _RSSI_WINDOW = 2  # s, max. age of the reference RSSI sample (older RSSI changes come from moving, not turning)
+    _RSSI_MIN_CONFIDENCE = 0.2
+    _YAW_SIGN = IMU_YAW_SIGN
+    # -------------------------
+
+    def __init__(self, sensors, data: TelemetryStore, nursery, phase_scale: float, sign_angle: float,
+                 rate: float = 10, estimator: BearingEstimator = None, notification_callbacks=None,
+                 error_callbacks=None):
+        """
+        :param sensors: SenseHatWrapper (or compatible), providing the "yaw" property
+        :param data: telemetry store with the RSSI fields (and the bearing fields, which are updated)
+        :param nursery: Trio nursery
+        :param phase_scale: degrees per unit of normalized phase detector offset
+        :param sign_angle: degrees for a phase detector reading with the angle sign only
+        :param rate: fusion and publication rate (Hz)
+        :param estimator: filter to be used (a default BearingEstimator otherwise)
+        """
+        super().__init__(nursery, notification_callbacks, error_callbacks)
+        self._sensors = sensors
+        self._data = data  # type: TelemetryStore
+        self._phase_scale = phase_scale
+        self._sign_angle = sign_angle
+        self._period = 1 / rate
+        self.estimator = estimator if estimator is not None else BearingEstimator(self._PROCESS_NOISE)
+        self._direction = None  # Latest phase detector event, not fused yet
+        self._rssi_version = 0
+        self._rssi_reference = None  # (rssi, heading, time) compared with the following samples
+        self._time = 0.0  # s, fusion steps run
+        self._is_running = False
+
+    @property
+    def heading(self) -> float:
+        return wrap_angle(self._YAW_SIGN * self._sensors.yaw)
+
+    @property
+    def relative_bearing(self):
+        """
+        Beacon bearing relative to the rover (degrees, positive: counter-clockwise), None if unknown
+        """
+        return self.estimator.relative(self.heading)
+
+    async def direction_listener(self, source, param):
+        """
+        RadioDetection notification callback (BeaconDirectionEventArgs)
+        """
+        self._direction = param
+
+    def step(self):
+        """
+        Runs one fusion step with the latest inputs
+        """
+        estimator = self.estimator
+        heading = self.heading
+        self._time += self._period
+        estimator.predict(self._period)
+
+        direction, self._direction = self._direction, None
+        if direction is not None:
+            if direction.angle_sign is None:
+                if direction.is_confident:  # No beacon signal at all
+                    estimator.reset()
+            else:
+                if direction.offset is not None:
+                    relative = self._phase_scale * direction.offset
+                else:
+                    relative = direction.angle_sign * self._sign_angle
+                std = self._PHASE_STD if direction.is_confident else self._PHASE_STD * self._PHASE_UNCONFIDENT_FACTOR
+                estimator.update(relative, heading, std)
+
+        version = self._data.version_of('rssi')
+        if version != self._rssi_version:
+            self._rssi_version = version
+            self._update_rssi(self._data['rssi'], self._data['rssi_confidence'], heading)
+
+    def _update_rssi(self, rssi, confidence, heading: float):
+        if rssi is None or confidence is None or confidence < self._RSSI_MIN_CONFIDENCE:
+            self._rssi_reference = None
+            return
+        reference = self._rssi_reference
+        if reference is None or self._time - reference[2] > self._RSSI_WINDOW:
+            self._rssi_reference = (rssi, heading, self._time)
+            return
+        turned = wrap_angle(heading - reference[1])
+        if abs(turned) < self._RSSI_MIN_TURN:
+            return
+        change = rssi - reference[0]
+        if abs(change) >= self._RSSI_MIN_CHANGE:
+            side = 1 if (change > 0) == (turned > 0) else -1
+            self.estimator.update(side * self._RSSI_ANGLE, heading, self._RSSI_STD)
+        self._rssi_reference = (rssi, heading, self._time)
+
+    async def a_run_notification_loop(self):
+        if self._is_running:
+            return
+        self._is_running = True
+        next_step = trio.current_time()
+        while self._is_running:
+            next_step += self._period
+            await trio.sleep_until(next_step)
+            self.step()
+            relative = self.relative_bearing
+            std = self.estimator.std if relative is not None else None
+            self._data.update({'bearing': relative, 'bearing_std': std})
+            await self.raise_event(BearingEventArgs(self.BEARING_EVENT, relative, std, self.estimator.bearing))
+
+    def stop_notification_loop(self):
+        self._is_running = False
+
+
+class BearingEventArgs(BaseEventArgs):
+    def __init__(self, event_type: str, relative: float, std: float, bearing: float):
+        """
+        :param event_type: event identifier
+        :param relative: beacon bearing relative to the rover (degrees, positive: counter-clockwise), None if unknown
+        :param std: bearing standard deviation (degrees), None if unknown
+        :param bearing: beacon bearing in the IMU frame (degrees), None if unknown
+        """
+        super().__init__(event_type)
+        self.relative = relative  # type: float
+        self.std = std  # type: float
+        self.bearing = bearing  # type: float
+
+
+if __name__ == "__main__":
+    # Simulation: beacon 60deg counter-clockwise, noisy phase readings, rover turning towards the fused bearing
+    import random
+    from types import SimpleNamespace
+
+    def simulate(nursery):
+        random.seed(0)
+        sensors = SimpleNamespace(yaw=0.0)
+        data = TelemetryStore(['rssi', 'rssi_confidence', 'bearing', 'bearing_std'])
+        fusion = BearingFusion(sensors, data, nursery, phase_scale=45, sign_angle=30)
+        for step in range(50):
+            heading = fusion.heading
+            offset = max(-1.0, min(1.0, (wrap_angle(60 - heading) + random.gauss(0, 10)) / 45))
+            fusion._direction = SimpleNamespace(angle_sign=(offset > 0) - (offset < 0), offset=offset,
+                                                is_confident=True)
+            data.update({'rssi': -70 - abs(wrap_angle(60 - heading)) / 10, 'rssi_confidence': 0.9})
+            fusion.step()
+            relative = fusion.relative_bearing
+            sensors.yaw += IMU_YAW_SIGN * 0.3 * relative  # Turn towards the beacon
+            if step % 5 == 0:
+                print(f"Heading {heading:6.1f}  Relative bearing {relative:6.1f} +- {fusion.estimator.std:4.1f}")
+
+    async def parent():
+        async with trio.open_nursery() as nursery:
+            simulate(nursery)
+
+    trio.run(parent)
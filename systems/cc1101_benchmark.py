@@ -0,0 +1,88 @@
+import time
+from systems.pycc1101 import TICC1101, DummySpiDev
+
+'''
+    TICC1101 driver benchmark, against the simulated CC1101 (DummySpiDev): no hardware needed.
+    For every operation:
+        - Python time per operation (driver overhead, measured),
+        - SPI transfers and bytes per operation (counted by the simulator),
+        - estimated bus time per operation at the default and at the performance mode SPI clocks
+          (8 bits per byte, plus the per-transfer overhead of spidev).
+    Operations with fixed waits inside the driver (sendData: 2ms before TX) are measured with those waits.
+'''
+
+DEFAULT_SPI_SPEED = 50000  # Hz, TICC1101 default
+TRANSFER_OVERHEAD = 30e-6  # s, approx. spidev ioctl + chip select per transfer on a Raspberry Pi
+PAYLOAD = list(b"BEACON-01\x00")
+
+
+def make_radio(performance_mode=True):
+    spi = DummySpiDev()
+    radio = TICC1101(debug=False, performance_mode=performance_mode, spi=spi)
+    radio.reset()
+    radio.setDefaultValues()
+    # As ReceptorSystem (MCSM1_VALUE): no address check, status bytes appended, CCA unless receiving a packet, stay
+    # in RX after every packet and after every transmission
+    radio._writeSingleByte(radio.PKTCTRL1, 0x04)
+    radio._writeSingleByte(radio.MCSM1, 0x2F)
+    radio._setRXState()
+    return radio, spi
+
+
+def measure(name, operation, repetitions, radio, spi):
+    """
+    :return: (name, Python time per operation, transfers per operation, bytes per operation)
+    """
+    transfers = spi.transfers
+    transferred = spi.bytes_transferred
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        operation()
+    elapsed = (time.perf_counter() - start) / repetitions
+    return (name, elapsed, (spi.transfers - transfers) / repetitions,
+            (spi.bytes_transferred - transferred) / repetitions)
+
+
+def run_benchmark(repetitions=2000):
+    radio, spi = make_radio()
+    config_radio, config_spi = make_radio()  # Reconfigured with the defaults (no longer set up as a receiver)
+
+    def receive():
+        spi.inject_packet(PAYLOAD, rssi=-70, lqi=10)
+        radio.recvPacket()
+
+    def fifo_burst():
+        spi.rx_fifo += bytes(spi.FIFO_SIZE)
+        radio._readBurst(radio.RXFIFO, spi.FIFO_SIZE)
+
+    results = [
+        measure("Register read (SPI)", lambda: radio._readSingleByte(radio.PKTCTRL0), repetitions, radio, spi),
+        measure("Register read (cached)", lambda: radio._readRegister(radio.PKTCTRL0), repetitions, radio, spi),
+        measure("Register write", lambda: radio._writeSingleByte(radio.CHANNR, 0x1F), repetitions, radio, spi),
+        measure("Register bit update", lambda: radio.setSyncMode(3), repetitions, radio, spi),
+        measure("Full configuration", config_radio.setDefaultValues, repetitions, config_radio, config_spi),
+        measure("RX FIFO burst (64B)", fifo_burst, repetitions, radio, spi),
+        measure(f"Packet receive ({len(PAYLOAD)}B)", receive, repetitions, radio, spi),
+        measure(f"Packet send ({len(PAYLOAD)}B)", lambda: radio.sendData(list(PAYLOAD)), repetitions // 100,
+                radio, spi),
+    ]
+    return results
+
+
+def bus_time(transfers, transferred, speed):
+    return transfers * TRANSFER_OVERHEAD + transferred * 8 / speed
+
+
+if __name__ == "__main__":
+    results = run_benchmark()
+    print(f"{'Operation':<26}{'Python':>10}{'Xfers':>7}{'Bytes':>7}"
+          f"{'Bus @' + str(DEFAULT_SPI_SPEED // 1000) + 'kHz':>14}"
+          f"{'Bus @' + str(TICC1101.MAX_SPI_SPEED / 1e6) + 'MHz':>14}")
+    for name, elapsed, transfers, transferred in results:
+        print(f"{name:<26}{elapsed * 1e6:>8.1f}us{transfers:>7.1f}{transferred:>7.1f}"
+              f"{bus_time(transfers, transferred, DEFAULT_SPI_SPEED) * 1e6:>12.1f}us"
+              f"{bus_time(transfers, transferred, TICC1101.MAX_SPI_SPEED) * 1e6:>12.1f}us")
+    _, elapsed, _, transferred = results[5]
+    print(f"RX FIFO throughput: {transferred / elapsed / 1000:.0f}kB/s (Python only), "
+          f"{transferred / bus_time(1, transferred, TICC1101.MAX_SPI_SPEED) / 1000:.0f}kB/s "
+          f"(bus at {TICC1101.MAX_SPI_SPEED / 1e6}MHz)")
@@ -7,6 +7,7 @@ class CommandSystem(AsyncEventSource):
     MODE_COMMAND = "SELECT_MODE"
     DIRECTION_COMMAND = "SET_DIRECTION"
     SESSION_COMMAND = "NEW_SESSION"
+    BEACON_COMMAND = "SELECT_BEACON"
 
     DIRECTION_FORWARDS = "FORWARDS"
     DIRECTION_LEFT = "LEFT"
@@ -0,0 +1,117 @@
+from systems.history import RingBuffer
+import math
+import trio
+
+
+class ControlLoop:
+    """
+    Fixed-rate scheduler for a control step: a plain (synchronous) function run at absolute deadlines of the Trio
+    clock, so the rate does not drift and every decision is taken at a known instant, one at a time.
+    A step that ends after the following deadline is an overrun: the missed cycles are skipped (the loop keeps its
+    phase instead of running late steps back to back) and counted.
+    Timing is recorded for every cycle (timestamped with its deadline):
+        - jitter: start delay with respect to the deadline (Trio scheduling, other tasks),
+        - durations: step execution time.
+    """
+    def __init__(self, step, period: float, history_length: int = 600):
+        """
+        :param step: callable (no parameters), run once per cycle
+        :param period: cycle period (s)
+        :param history_length: cycles kept in the timing histories
+        """
+        if period <= 0:
+            raise ValueError("ControlLoop period must be positive")
+        self._step = step
+        self._period = period
+        self.jitter = RingBuffer(history_length)  # type: RingBuffer
+        self.durations = RingBuffer(history_length)  # type: RingBuffer
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped_cycles = 0
+        self.max_jitter = 0.0  # s, since the loop started
+        self.max_duration = 0.0  # s, since the loop started
+        self._is_running = False
+
+    @property
+    def period(self) -> float:
+        return self._period
+
+    def jitter_stats(self, duration: float = None):
+        """
+        :param duration: window length in seconds (None: every stored cycle)
+        :return: (mean, standard deviation, max) jitter (s) over the window, or (None, None, None) without cycles
+        """
+        _, values = self.jitter.window(duration)
+        if not len(values):
+            return None, None, None
+        return float(values.mean()), float(values.std()), float(values.max())
+
+    def load(self, duration: float = None):
+        """
+        Mean fraction of the period used by the step over the window, None without cycles
+        """
+        mean = self.durations.mean(duration)
+        return mean / self._period if mean is not None else None
+
+    async def a_run(self):
+        if self._is_running:
+            return
+        self._is_running = True
+        deadline = trio.current_time()
+        while self._is_running:
+            deadline += self._period
+            await trio.sleep_until(deadline)
+            start = trio.current_time()
+            self._step()
+            end = trio.current_time()
+            self.cycles += 1
+            self.jitter.append(start - deadline, deadline)
+            self.durations.append(end - start, deadline)
+            self.max_jitter = max(self.max_jitter, start - deadline)
+            self.max_duration = max(self.max_duration, end - start)
+            missed = math.floor((end - deadline) / self._period)
+            if missed > 0:  # The next deadline has already passed
+                self.overruns += 1
+                self.skipped_cycles += missed
+                deadline += missed * self._period
+
+    def stop(self):
+        """
+        Stops after the current cycle
+        """
+        self._is_running = False
+
+    def __repr__(self):
+        mean, std, _ = self.jitter_stats()
+        load = self.load()
+        return (f"ControlLoop({self._period * 1000:.0f}ms: {self.cycles} cycles, {self.overruns} overruns, "
+                f"{self.skipped_cycles} skipped, jitter "
+                + (f"{mean * 1000:.2f}+-{std * 1000:.2f}ms (max {self.max_jitter * 1000:.2f}ms), load {load:.1%})"
+                   if mean is not None else "n/a)"))
+
+
+if __name__ == "__main__":
+    # Simulated 100ms loop whose step sometimes takes too long (virtual clock: runs instantly)
+    import trio.testing
+
+    clock = trio.testing.MockClock(autojump_threshold=0)
+
+    async def parent():
+        cycle = 0
+
+        def step():
+            nonlocal cycle
+            cycle += 1
+            if cycle % 10 == 0:  # Busy-wait on the virtual clock: 250ms step
+                clock.jump(0.25)
+
+        loop = ControlLoop(step, 0.1)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(loop.a_run)
+            await trio.sleep(10)
+            loop.stop()
+            nursery.cancel_scope.cancel()
+        print(loop)
+        print(f"Step durations: mean {loop.durations.mean() * 1000:.1f}ms, max {loop.max_duration * 1000:.1f}ms")
+
+    trio.run(parent, clock=clock)
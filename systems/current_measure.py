@@ -1,5 +1,7 @@
 from systems.event_source import AsyncEventSource, BaseEventArgs
 from systems.ads1015 import ADS1015
+from systems.telemetry import TelemetryStore, TelemetrySnapshot
+from systems.history import RingBuffer
 from gpiozero import DigitalInputDevice
 import smbus
 import trio
@@ -12,40 +14,47 @@ class CurrentMeasure(AsyncEventSource):
     CURRENT_EVENT = "CURRENT_EVENT"
     _SENSITIVITY = 0.187  # V/A
     _ZERO_SENSOR_VOLTAGE = 2.5  # Output voltage at zero-current
+    _AVERAGE_SAMPLES = 4  # Samples averaged on every reported value
 
     def __init__(self, nursery, adc: ADS1015, channel: int, data=None, notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
         self._CHANNEL = channel
-        self._data = data if data is not None else {'motor_current': None}
+        self._data = data if data is not None else TelemetryStore(['motor_current'])  # type: TelemetryStore
         self._adc = adc  # type: ADS1015
+        self._samples = RingBuffer(self._AVERAGE_SAMPLES)  # type: RingBuffer
         self._running = False
 
+    @classmethod
+    def voltage_to_current(cls, voltage: float) -> float:
+        """
+        Current (A) corresponding to a sensor output voltage
+        """
+        return (voltage - cls._ZERO_SENSOR_VOLTAGE) / cls._SENSITIVITY
+
     async def a_run_notification_loop(self):
         if self._running:
             return
         self._running = True
-        fifo_stack = [0,0,0,0]
         while self._running:
             await trio.sleep(0.5)
-            fifo_stack[1:len(fifo_stack)] = fifo_stack[0:(len(fifo_stack)-1)]
-            fifo_stack[0] = self._adc.read_single_shot(channel=self._CHANNEL)
-            mean_voltage = sum(fifo_stack)/len(fifo_stack)
-            self._data['motor_current'] = (mean_voltage - self._ZERO_SENSOR_VOLTAGE) / self._SENSITIVITY
-            await self.raise_event(CurrentEventArgs(self.CURRENT_EVENT, self._data))
+            self._samples.append(self._adc.read_single_shot(channel=self._CHANNEL), trio.current_time())
+            mean_voltage = self._samples.mean()
+            self._data['motor_current'] = self.voltage_to_current(mean_voltage)
+            await self.raise_event(CurrentEventArgs(self.CURRENT_EVENT, self._data.snapshot()))
 
     def stop_notification_loop(self):
         self._running = False
 
 class CurrentEventArgs(BaseEventArgs):
-    def __init__(self, event_type, data: dict):
+    def __init__(self, event_type, data: TelemetrySnapshot):
         super().__init__(event_type)
-        self.data = data  # type: dict
+        self.data = data  # type: TelemetrySnapshot
 
 
 class DummyCurrentMeasure(AsyncEventSource):
     def __init__(self, nursery, adc: ADS1015, channel: int, data=None, notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
-        self._data = data if data is not None else {'motor_current': 0}
+        self._data = data if data is not None else TelemetryStore(['motor_current'])
         #self._reported_data = [0,0,0,1,1.2,1.3,1.5,1.5,1.5,1.5,1.5,1.5,1.5,0,0,0]
         self._running = False
 
@@ -58,7 +67,7 @@ class DummyCurrentMeasure(AsyncEventSource):
             await trio.sleep(1)
             #self._data['motor_current'] = self._reported_data[counter % len(self._reported_data)]
             self._data['motor_current'] = 0
-            await self.raise_event(CurrentEventArgs(CurrentMeasure.CURRENT_EVENT, self._data))
+            await self.raise_event(CurrentEventArgs(CurrentMeasure.CURRENT_EVENT, self._data.snapshot()))
             # counter += 1
 
     def stop_notification_loop(self):
@@ -1,126 +1,105 @@
 import trio
 import serial
-import pynmea2
-from typing import List, Union
 from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.telemetry import TelemetryStore, TelemetrySnapshot
+from systems.nmea import NMEAParser, SENTENCE_GGA, SATELLITES_COMPLETE
+from systems.satellites import SatelliteTable
+from systems.gps_config import GPSConfigurator, UBXParser, PROTOCOL_NMEA, PROTOCOL_UBX, MESSAGE_NAV_PVT
 
 
 class GPS(AsyncEventSource):
     """
     GPS module. Compatible with an event-based architecture (listeners are subscribed to GPS updates/errors),
     as well as with a polling-based architecture (latest GPS values are periodically checked externally).
-    If a data dictionary-like parameter is provided, its "latitude", "longitude" and "altitude" fields are updated
-    automatically.
+    If a telemetry store is provided, its "latitude", "longitude", "altitude", "gps_fix", "ground_speed", "course"
+    and "num_satellites" fields are updated automatically.
+    Serial data is read in chunks (whatever has been received) and parsed incrementally (see NMEAParser).
+    The module can be reconfigured when the notification loop starts (see GPSConfigurator, run in a worker thread):
+    higher baud and update rates, and the UBX binary protocol (NAV-PVT) instead of NMEA for the navigation solution.
     """
     LOCATION_EVENT = "LOCATION_EVENT"
     SATELLITE_LIST_EVENT = "SATELLITE_LIST_EVENT"
+    DATA_FIELDS = ['latitude', 'longitude', 'altitude', 'gps_fix', 'ground_speed', 'course', 'num_satellites']
+    DEFAULT_BAUD_RATE = 9600  # Module baud rate after power-up
 
-    def __init__(self, port, nursery, data=None, notification_callbacks=None, error_callbacks=None):
+    def __init__(self, port, nursery, data=None, connection=None, baud_rate: int = None, update_rate: float = None,
+                 protocol: str = PROTOCOL_NMEA, notification_callbacks=None, error_callbacks=None):
+        """
+        :param port: serial port (ignored if a connection is provided)
+        :param nursery: Trio nursery
+        :param data: telemetry store to be updated
+        :param connection: already open serial.Serial (or compatible, e.g. gps_config.DummySerial) connection
+        :param baud_rate: baud rate to switch the module to (None: keep DEFAULT_BAUD_RATE)
+        :param update_rate: navigation solutions per second (None: module default, usually 1Hz)
+        :param protocol: PROTOCOL_NMEA or PROTOCOL_UBX
+        """
         super().__init__(nursery, notification_callbacks, error_callbacks)
-        if port is None:
+        if port is None and connection is None:
             raise ValueError('port cannot be None')
         try:
-            self._connection = serial.Serial(port, 9600, timeout=5.0)
+            self._connection = connection if connection is not None else \
+                serial.Serial(port, self.DEFAULT_BAUD_RATE, timeout=5.0)
             self._a_connection = trio.wrap_file(self._connection)
-            self._data = data if data is not None else {'latitude': None, 'longitude': None, 'altitude': None,
-                                                        'num_satellites': None}
+            self._data = data if data is not None else TelemetryStore(self.DATA_FIELDS)  # type: TelemetryStore
         except serial.SerialException:
             print("ERROR initializing GPS module")
             raise
 
-        self.location = None  # type: Union[pynmea2.GGA, None]
-        self.visible_satellites = []  # type: List[SatelliteMeasurement]
-
-        self._new_satellites = []  # New list of satellites being constructed (multiple NMEA sentences are required)
+        self.satellites = SatelliteTable()  # type: SatelliteTable
+        self.parser = NMEAParser(self._data, satellite_callback=self.satellites.update)  # type: NMEAParser
+        self._ubx_parser = UBXParser(self._data) if protocol == PROTOCOL_UBX else None  # type: UBXParser
+        # Applied by the notification loop (None: keep the module configuration)
+        self._configuration = (baud_rate, update_rate, protocol) \
+            if baud_rate is not None or update_rate is not None or protocol != PROTOCOL_NMEA else None
         self._is_running = False
 
     async def _a_receive_data(self, do_update=True):
         """
-        Receives one NMEA sentence. If do_update is True, the stored data is updated. Asynchronous.
+        Receives the available serial data (waits for at least one byte). If do_update is True, it is parsed and
+        the stored data is updated. Asynchronous.
         """
         try:
-            line = (await self._a_connection.readline()).decode("UTF-8")
+            chunk = await self._a_connection.read(self._connection.in_waiting or 1)
             if do_update:
-                await self._parse_line(line)
+                await self._a_parse_chunk(chunk)
         except serial.SerialException as e:
             await self.raise_error(e)
-        except UnicodeDecodeError as e:
-            await self.raise_error(e)
 
-    async def _a_flush_input(self):
+    async def _a_configure(self):
         """
-        Flushes UART input buffer, and reads until the next EOL, so that the next received
-        NMEA sentence is guaranteed to be complete. Asynchronous.
+        Applies the module configuration given on creation (blocking UBX exchange, run in a worker thread).
+        Asynchronous.
         """
+        configuration, self._configuration = self._configuration, None
         try:
-            self._connection.flushInput()
-            await self._a_connection.readline()
+            configured = await trio.to_thread.run_sync(GPSConfigurator(self._connection).configure, *configuration)
+            if not configured:
+                print("WARNING: GPS module configuration not acknowledged")
         except serial.SerialException as e:
             await self.raise_error(e)
 
-    async def _parse_line(self, line):
+    async def _a_flush_input(self):
+        """
+        Flushes UART input buffer. Asynchronous.
+        """
         try:
-            msg = pynmea2.parse(line)
-            if msg.sentence_type == "GGA":
-                self.location = msg
-                if self.location is not None:
-                    self._data['altitude'] = self.location.altitude if self.location.altitude != 0 else None
-                    self._data['latitude'] = self.location.latitude if self.location.latitude != 0 else None
-                    self._data['longitude'] = self.location.longitude if self.location.longitude != 0 else None
-                    await self.raise_event(LocationEventArgs(GPS.LOCATION_EVENT, self._data.copy()))
-
-            elif msg.sentence_type == "GSV":
-                await self._parse_gsv(msg)
-
-        except pynmea2.ParseError as e:
+            self._connection.flushInput()
+        except serial.SerialException as e:
             await self.raise_error(e)
 
-    async def _parse_gsv(self, msg):
-        try:
-            total_msg = int(msg.num_messages)
-            current_msg = int(msg.msg_num)
-            if current_msg == 1:
-                self._new_satellites = []
-            if msg.sv_prn_num_1 != "":
-                self._new_satellites.append(
-                    SatelliteMeasurement(svid=msg.sv_prn_num_1,
-                                         elevation_deg=msg.elevation_deg_1,
-                                         azimuth=msg.azimuth_1,
-                                         snr=msg.snr_1)
-                )
-
-                if msg.sv_prn_num_2 != "":
-                    self._new_satellites.append(
-                        SatelliteMeasurement(svid=msg.sv_prn_num_2,
-                                             elevation_deg=msg.elevation_deg_2,
-                                             azimuth=msg.azimuth_2,
-                                             snr=msg.snr_2)
-                    )
-
-                    if msg.sv_prn_num_3 != "":
-                        self._new_satellites.append(
-                            SatelliteMeasurement(svid=msg.sv_prn_num_3,
-                                                 elevation_deg=msg.elevation_deg_3,
-                                                 azimuth=msg.azimuth_3,
-                                                 snr=msg.snr_3)
-                        )
-
-                        if msg.sv_prn_num_4 != "":
-                            self._new_satellites.append(
-                                SatelliteMeasurement(svid=msg.sv_prn_num_4,
-                                                     elevation_deg=msg.elevation_deg_4,
-                                                     azimuth=msg.azimuth_4,
-                                                     snr=msg.snr_4)
-                            )
-
-            if current_msg == total_msg:
-                self.visible_satellites = self._new_satellites
-                self._new_satellites = []
-                self._data['num_satellites'] = len(self.visible_satellites)
-                await self.raise_event(VisibleSatellitesEventArgs(GPS.SATELLITE_LIST_EVENT, self.visible_satellites))
-
-        except ValueError as e:
-            await self.raise_error(e)
+    async def _a_parse_chunk(self, chunk: bytes):
+        if self._ubx_parser is not None:
+            ubx_parsed, chunk = self._ubx_parser.feed(chunk)
+            parsed = self.parser.feed(chunk)
+            if ubx_parsed & MESSAGE_NAV_PVT:
+                parsed |= SENTENCE_GGA  # New navigation solution
+        else:
+            parsed = self.parser.feed(chunk)
+        if parsed & SENTENCE_GGA:
+            await self.raise_event(LocationEventArgs(GPS.LOCATION_EVENT, self._data.snapshot()))
+        if parsed & SATELLITES_COMPLETE:
+            self.satellites.end_cycle()
+            await self.raise_event(VisibleSatellitesEventArgs(GPS.SATELLITE_LIST_EVENT, self.satellites))
 
     def check_connection(self):
         """
@@ -140,8 +119,9 @@ class GPS(AsyncEventSource):
         """
         if self._is_running:
             return
-        self._new_satellites = []
         self._is_running = True
+        if self._configuration is not None:
+            await self._a_configure()
         await self._a_flush_input()
         while self._is_running:
             await self._a_receive_data()
@@ -153,32 +133,27 @@ class GPS(AsyncEventSource):
         self._is_running = False
 
 
-class SatelliteMeasurement:
-    def __init__(self, svid: str, elevation_deg: str, azimuth: str, snr: str):
-        # svid: Space Vehicle ID
-        # Some fields may be empty
-        self.svid = svid  # type: str
-        self.elevation_deg = elevation_deg  # type: str
-        self.azimuth = azimuth  # type: str
-        self.snr = snr  # type: str
-
-
 class LocationEventArgs(BaseEventArgs):
-    def __init__(self, event_type: str, data: dict):
+    def __init__(self, event_type: str, data: TelemetrySnapshot):
         super().__init__(event_type)
-        self.data = data  # type: dict
+        self.data = data  # type: TelemetrySnapshot
 
 
 class VisibleSatellitesEventArgs(BaseEventArgs):
-    def __init__(self, event_type: str, satellite_list: List[SatelliteMeasurement]):
+    def __init__(self, event_type: str, satellites: SatelliteTable):
+        """
+        :param event_type: event identifier
+        :param satellites: satellite table of the GPS module (updated in place: not a copy)
+        """
         super().__init__(event_type)
-        self.satellite_list = satellite_list  # type: List[SatelliteMeasurement]
+        self.satellites = satellites  # type: SatelliteTable
 
 
 class DummyGPS(AsyncEventSource):
-    def __init__(self, port, nursery, data=None, notification_callbacks=None, error_callbacks=None):
+    def __init__(self, port, nursery, data=None, connection=None, baud_rate: int = None, update_rate: float = None,
+                 protocol: str = PROTOCOL_NMEA, notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
-        self._data = data if data is not None else {}
+        self._data = data if data is not None else TelemetryStore(GPS.DATA_FIELDS)
         self._is_running = False
 
     def check_connection(self):
@@ -190,7 +165,7 @@ class DummyGPS(AsyncEventSource):
         self._is_running = True
         while self._is_running:
             await trio.sleep(1)
-            await self.raise_event(LocationEventArgs(GPS.LOCATION_EVENT, self._data))
+            await self.raise_event(LocationEventArgs(GPS.LOCATION_EVENT, self._data.snapshot()))
 
     def stop_notification_loop(self):
         self._is_running = False
@@ -210,7 +185,7 @@ if __name__ == "__main__":
         if type(param) is LocationEventArgs:
             print(f"New Location: {param.data}")
         elif type(param) is VisibleSatellitesEventArgs:
-            print(f"New satellite list (length {len(param.satellite_list)}): {param.satellite_list}")
+            print(f"New satellite list: {param.satellites} PRNs: {param.satellites.prns}")
 
     async def error_listener(source, param):
         print(f"New Error: {param}")
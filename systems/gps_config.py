@@ -0,0 +1,351 @@
+import struct
+import time
+from systems.telemetry import TelemetryStore
+
+# Protocols used by the GPS module to report the navigation solution
+PROTOCOL_NMEA = "NMEA"  # GGA/RMC/GSV sentences (see NMEAParser)
+PROTOCOL_UBX = "UBX"  # u-blox binary NAV-PVT messages (GSV sentences are still used for the satellite list)
+
+# UBX message (class, id) pairs
+UBX_ACK_NAK = (0x05, 0x00)
+UBX_ACK_ACK = (0x05, 0x01)
+UBX_CFG_PRT = (0x06, 0x00)
+UBX_CFG_MSG = (0x06, 0x01)
+UBX_CFG_RATE = (0x06, 0x08)
+UBX_NAV_PVT = (0x01, 0x07)
+# Standard NMEA sentences (class 0xF0), as configured through CFG-MSG
+NMEA_MESSAGE_IDS = {'GGA': 0x00, 'GLL': 0x01, 'GSA': 0x02, 'GSV': 0x03, 'RMC': 0x04, 'VTG': 0x05, 'ZDA': 0x08}
+_NMEA_CLASS = 0xF0
+_CFG_CLASS = 0x06
+
+# Flags returned by UBXParser.feed
+MESSAGE_NAV_PVT = 1
+MESSAGE_ACK = 2
+
+_SYNC = b'\xb5\x62'
+_HEADER = struct.Struct('<BBH')  # Class, id, payload length
+_NAV_PVT = struct.Struct('<IHBBBBBBIiBBBBiiiiIIiiiiiIIH')
+_CFG_PRT = struct.Struct('<BBHIIHHHH')
+_CFG_RATE = struct.Struct('<HHH')
+
+
+def ubx_checksum(data: bytes):
+    """
+    8-bit Fletcher checksum of a UBX message (from the class byte to the end of the payload)
+    :return: (CK_A, CK_B)
+    """
+    ck_a = 0
+    ck_b = 0
+    for byte in data:
+        ck_a = (ck_a + byte) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+
+def ubx_message(message: tuple, payload: bytes = b'') -> bytes:
+    """
+    Builds a complete UBX frame
+    :param message: (class, id) pair (e.g. UBX_CFG_RATE)
+    """
+    body = _HEADER.pack(message[0], message[1], len(payload)) + payload
+    return _SYNC + body + bytes(ubx_checksum(body))
+
+
+def cfg_prt(baud_rate: int, in_protocols: int = 0x03, out_protocols: int = 0x03, port: int = 1) -> bytes:
+    """
+    CFG-PRT for a UART port: 8N1 at baud_rate. Protocol masks: 0x01 UBX, 0x02 NMEA
+    """
+    return ubx_message(UBX_CFG_PRT, _CFG_PRT.pack(port, 0, 0, 0x000008D0, baud_rate, in_protocols, out_protocols,
+                                                  0, 0))
+
+
+def cfg_rate(rate_hz: float) -> bytes:
+    """
+    CFG-RATE: navigation solutions per second (measurement period rounded to ms)
+    """
+    return ubx_message(UBX_CFG_RATE, _CFG_RATE.pack(int(round(1000 / rate_hz)), 1, 1))
+
+
+def cfg_msg(message: tuple, rate: int) -> bytes:
+    """
+    CFG-MSG: output rate of a message on the current port (0: disabled, N: once every N navigation solutions)
+    """
+    return ubx_message(UBX_CFG_MSG, bytes((message[0], message[1], rate)))
+
+
+class NavPVT:
+    """
+    Decoded UBX NAV-PVT message (only the fields used by the rover)
+    """
+    __slots__ = ('itow', 'fix_type', 'fix_ok', 'num_satellites', 'latitude', 'longitude', 'altitude', 'ground_speed',
+                 'course', 'horizontal_accuracy')
+
+    def __init__(self, payload: bytes):
+        fields = _NAV_PVT.unpack_from(payload)
+        self.itow = fields[0]  # GPS time of week (ms)
+        self.fix_type = fields[10]  # 0: no fix, 1: dead reckoning, 2: 2D, 3: 3D, 4: GNSS + dead reckoning, 5: time
+        self.fix_ok = bool(fields[11] & 0x01)  # gnssFixOK: the fix is within the DOP and accuracy masks
+        self.num_satellites = fields[13]  # Satellites used in the solution
+        self.longitude = fields[14] * 1e-7  # Degrees
+        self.latitude = fields[15] * 1e-7  # Degrees
+        self.altitude = fields[17] / 1000  # Meters over the mean sea level
+        self.horizontal_accuracy = fields[18] / 1000  # Meters
+        self.ground_speed = fields[23] / 1000  # m/s
+        self.course = fields[24] * 1e-5  # Degrees (heading of motion)
+
+
+class UBXParser:
+    """
+    Incremental UBX frame decoder. Since UBX and NMEA data share the same serial stream, bytes that are not part of
+    a UBX frame are returned, to be fed to an NMEAParser (NMEA is plain ASCII, so it never contains the 0xB5 sync
+    byte).
+    Decoded NAV-PVT messages are written into the telemetry store (if provided): latitude, longitude, altitude,
+    gps_fix, ground_speed and course.
+    """
+    MAX_PAYLOAD_LENGTH = 512
+
+    def __init__(self, data: TelemetryStore = None):
+        self._data = data
+        self._buffer = bytearray()
+        self.nav_pvt = None  # type: NavPVT  # Latest NAV-PVT message
+        self.last_ack = None  # ((class, id), acknowledged) of the latest ACK-ACK/ACK-NAK
+        self.frame_count = 0
+        self.checksum_errors = 0
+
+    def feed(self, chunk: bytes):
+        """
+        :return: (flags, other_bytes). flags: MESSAGE_NAV_PVT | MESSAGE_ACK of the messages decoded in this chunk.
+                 other_bytes: received bytes that are not part of UBX frames
+        """
+        buffer = self._buffer
+        buffer += chunk
+        flags = 0
+        other = bytearray()
+        while True:
+            start = buffer.find(_SYNC)
+            if start < 0:
+                # Keep a trailing first sync byte (the second one may arrive in the next chunk)
+                keep = 1 if buffer.endswith(_SYNC[:1]) else 0
+                other += buffer[:len(buffer) - keep]
+                del buffer[:len(buffer) - keep]
+                break
+            other += buffer[:start]
+            del buffer[:start]
+            if len(buffer) < 6:
+                break
+            message_class, message_id, length = _HEADER.unpack_from(buffer, 2)
+            if length > self.MAX_PAYLOAD_LENGTH:  # Not a real frame: skip the sync bytes
+                del buffer[:2]
+                continue
+            if len(buffer) < 8 + length:
+                break
+            body = bytes(buffer[2:6 + length])
+            if bytes(ubx_checksum(body)) != buffer[6 + length:8 + length]:
+                self.checksum_errors += 1
+                del buffer[:2]
+                continue
+            del buffer[:8 + length]
+            self.frame_count += 1
+            flags |= self._decode((message_class, message_id), body[4:])
+        return flags, bytes(other)
+
+    def _decode(self, message: tuple, payload: bytes) -> int:
+        if message == UBX_NAV_PVT and len(payload) >= _NAV_PVT.size:
+            pvt = NavPVT(payload)
+            self.nav_pvt = pvt
+            if self._data is not None:
+                has_fix = pvt.fix_ok and 2 <= pvt.fix_type <= 4
+                self._data.update({
+                    'latitude': pvt.latitude if has_fix else None,
+                    'longitude': pvt.longitude if has_fix else None,
+                    'altitude': pvt.altitude if has_fix else None,
+                    'gps_fix': pvt.fix_type if has_fix else 0,
+                    'ground_speed': pvt.ground_speed if has_fix else None,
+                    'course': pvt.course if has_fix else None
+                })
+            return MESSAGE_NAV_PVT
+        if message in (UBX_ACK_ACK, UBX_ACK_NAK) and len(payload) >= 2:
+            self.last_ack = ((payload[0], payload[1]), message == UBX_ACK_ACK)
+            return MESSAGE_ACK
+        return 0
+
+
+class GPSConfigurator:
+    """
+    Configures a u-blox GPS module through UBX CFG messages: UART baud rate, navigation rate, output sentences
+    and protocol. Blocking: meant to be used before starting the GPS notification loop.
+    Settings are not saved in the module (they are lost on power-off), so they are applied on every start.
+    """
+    ACK_TIMEOUT = 1  # s
+
+    def __init__(self, connection):
+        """
+        :param connection: serial.Serial (or compatible) connection to the module
+        """
+        self._connection = connection
+        self._parser = UBXParser()
+
+    def send(self, frame: bytes, wait_ack: bool = True) -> bool:
+        """
+        Sends a UBX frame
+        :return: True if acknowledged (or if no acknowledge was requested), False if rejected or timed out
+        """
+        self._connection.write(frame)
+        if not wait_ack:
+            return True
+        message = (frame[2], frame[3])
+        deadline = time.monotonic() + self.ACK_TIMEOUT
+        while time.monotonic() < deadline:
+            flags, _ = self._parser.feed(self._connection.read(self._connection.in_waiting or 1))
+            if flags & MESSAGE_ACK and self._parser.last_ack[0] == message:
+                return self._parser.last_ack[1]
+        return False
+
+    def set_baud_rate(self, baud_rate: int, protocol: str = PROTOCOL_NMEA):
+        """
+        Changes the module UART baud rate (and output protocols), then the local port baud rate.
+        Not acknowledged: the acknowledge is sent at the new baud rate
+        """
+        out_protocols = 0x03 if protocol == PROTOCOL_UBX else 0x02
+        self.send(cfg_prt(baud_rate, out_protocols=out_protocols), wait_ack=False)
+        self._connection.flush()
+        time.sleep(0.1)  # Let the module finish sending at the previous baud rate
+        self._connection.baudrate = baud_rate
+        self._connection.reset_input_buffer()
+
+    def set_update_rate(self, rate_hz: float) -> bool:
+        return self.send(cfg_rate(rate_hz))
+
+    def set_message_rate(self, message: tuple, rate: int) -> bool:
+        return self.send(cfg_msg(message, rate))
+
+    def set_nmea_rates(self, rates: dict) -> bool:
+        """
+        :param rates: sentence name -> rate (see cfg_msg). Sentences not included are disabled
+        """
+        acknowledged = True
+        for sentence, message_id in NMEA_MESSAGE_IDS.items():
+            acknowledged &= self.set_message_rate((_NMEA_CLASS, message_id), rates.get(sentence, 0))
+        return acknowledged
+
+    def configure(self, baud_rate: int = None, update_rate: float = None, protocol: str = PROTOCOL_NMEA,
+                  satellites_period: int = 5) -> bool:
+        """
+        Applies a complete configuration
+        :param baud_rate: new UART baud rate (None: unchanged). Needed for update rates over ~2Hz
+        :param update_rate: navigation solutions per second (None: unchanged)
+        :param protocol: PROTOCOL_NMEA (GGA + RMC) or PROTOCOL_UBX (NAV-PVT)
+        :param satellites_period: GSV sentences are sent once every satellites_period solutions
+        :return: whether every (acknowledged) setting was accepted
+        """
+        if baud_rate is not None and baud_rate != self._connection.baudrate:
+            self.set_baud_rate(baud_rate, protocol)
+        acknowledged = True
+        if update_rate is not None:
+            acknowledged &= self.set_update_rate(update_rate)
+        if protocol == PROTOCOL_UBX:
+            acknowledged &= self.set_nmea_rates({'GSV': satellites_period})
+            acknowledged &= self.set_message_rate(UBX_NAV_PVT, 1)
+        else:
+            acknowledged &= self.set_nmea_rates({'GGA': 1, 'RMC': 1, 'GSV': satellites_period})
+        return acknowledged
+
+
+class DummySerial:
+    """
+    Fake serial port replaying captured bytes (e.g. a GPS recording), compatible with the serial.Serial methods
+    used by the GPS module. Written bytes are stored in "written".
+    UBX configuration frames are acknowledged (ACK-ACK) if auto_ack is True.
+    """
+    def __init__(self, data: bytes = b'', chunk_size: int = 64, loop: bool = False, auto_ack: bool = True,
+                 baudrate: int = 9600, timeout: float = None):
+        """
+        :param data: bytes to be replayed
+        :param chunk_size: max. number of bytes available on each read (simulates the UART buffer)
+        :param loop: whether to restart the replay once finished (otherwise, reads return b'')
+        """
+        self._data = bytes(data)
+        self._position = 0
+        self._pending = bytearray()  # Responses to written frames, read before the replayed data
+        self._chunk_size = chunk_size
+        self._loop = loop
+        self._auto_ack = auto_ack
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.written = bytearray()
+        self.is_open = True
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs):
+        with open(path, "rb") as file:
+            return cls(file.read(), **kwargs)
+
+    @property
+    def in_waiting(self) -> int:
+        if self._pending:
+            return len(self._pending)
+        if self._position >= len(self._data) and self._loop:
+            self._position = 0
+        return min(self._chunk_size, len(self._data) - self._position)
+
+    def read(self, size: int = 1) -> bytes:
+        if self._pending:
+            chunk = bytes(self._pending[:size])
+            del self._pending[:size]
+            return chunk
+        if self._position >= len(self._data) and self._loop:
+            self._position = 0
+        chunk = self._data[self._position:self._position + size]
+        self._position += len(chunk)
+        return chunk
+
+    def readline(self) -> bytes:
+        end = self._data.find(b'\n', self._position)
+        end = end + 1 if end >= 0 else len(self._data)
+        return self.read(end - self._position)
+
+    def write(self, data: bytes) -> int:
+        self.written += data
+        if self._auto_ack and data[:2] == _SYNC and len(data) >= 4 and data[2] == _CFG_CLASS:
+            self._pending += ubx_message(UBX_ACK_ACK, bytes((data[2], data[3])))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def flushInput(self):
+        self._pending.clear()
+
+    def reset_input_buffer(self):
+        self._pending.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+if __name__ == "__main__":
+    from systems.nmea import NMEAParser
+
+    # Mixed NMEA + NAV-PVT stream, replayed through a fake serial port
+    nmea = b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n"
+    payload = bytearray(92)
+    _NAV_PVT.pack_into(payload, 0, 1000, 2024, 1, 1, 12, 0, 0, 0x07, 0, 0, 3, 0x01, 0, 9, 115166667, 481173000,
+                       600000, 545400, 1500, 2500, 0, 0, 0, 1250, 8440000, 0, 0, 150)
+    stream = nmea + ubx_message(UBX_NAV_PVT, bytes(payload)) + nmea
+    connection = DummySerial(stream * 100, chunk_size=37)
+    configurator = GPSConfigurator(connection)
+    print(f"Configuration accepted: {configurator.configure(update_rate=10, protocol=PROTOCOL_UBX)}")
+    print(f"Sent {len(connection.written)} configuration bytes")
+
+    data = TelemetryStore(['latitude', 'longitude', 'altitude', 'gps_fix', 'ground_speed', 'course',
+                           'num_satellites'])
+    ubx = UBXParser(data)
+    nmea_parser = NMEAParser()
+    chunk = connection.read(connection.in_waiting)
+    while chunk:
+        flags, other = ubx.feed(chunk)
+        nmea_parser.feed(other)
+        chunk = connection.read(connection.in_waiting)
+    print(f"UBX frames: {ubx.frame_count} ({ubx.checksum_errors} errors). NMEA sentences: "
+          f"{nmea_parser.sentence_count} ({nmea_parser.checksum_errors} errors)")
+    print(data.snapshot())
@@ -0,0 +1,201 @@
+from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.traction_system import TractionSystem
+import trio
+
+IMU_YAW_SIGN = -1  # IMU yaw grows clockwise -> counter-clockwise heading is -yaw
+
+
+def wrap_angle(angle):
+    """
+    Wraps an angle (degrees) onto the [-180, 180) range
+    """
+    return (angle + 180) % 360 - 180
+
+
+class PIDController:
+    """
+    Minimal PID controller with output saturation and integral anti-windup
+    """
+    def __init__(self, kp: float, ki: float = 0, kd: float = 0, output_limit: float = 1, integral_limit: float = None):
+        """
+        :param kp: proportional gain
+        :param ki: integral gain
+        :param kd: derivative gain
+        :param output_limit: output is saturated to [-output_limit, output_limit]
+        :param integral_limit: accumulated error is saturated to [-integral_limit, integral_limit] (None: no limit)
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limit = output_limit
+        self.integral_limit = integral_limit
+        self._integral = 0
+        self._last_error = None
+
+    def reset(self):
+        self._integral = 0
+        self._last_error = None
+
+    def update(self, error: float, dt: float) -> float:
+        """
+        Computes a new output
+        :param error: current error (setpoint - measurement)
+        :param dt: time since the last update, in seconds
+        :return: saturated controller output
+        """
+        self._integral += error * dt
+        if self.integral_limit is not None:
+            self._integral = max(-self.integral_limit, min(self._integral, self.integral_limit))
+        derivative = (error - self._last_error) / dt if self._last_error is not None and dt > 0 else 0
+        self._last_error = error
+        output = self.kp * error + self.ki * self._integral + self.kd * derivative
+        return max(-self.output_limit, min(output, self.output_limit))
+
+
+class HeadingController(AsyncEventSource):
+    """
+    Closed-loop heading control: turns the rover to a commanded angle (relative to its current heading) using
+    the IMU yaw, optionally while moving forwards. The target is held until a new one is commanded or
+    the controller is released.
+    Angles follow the traction system convention: positive angles are counter-clockwise.
+    """
+    HEADING_REACHED_EVENT = "HEADING_REACHED_EVENT"
+    # --- Needs calibration ---
+    _KP = 1/45  # Full turn rate for errors >= 45deg
+    _KI = 0.005
+    _KD = 0.002
+    _INTEGRAL_LIMIT = 60  # deg*s
+    _MIN_TURN_RATE = 0.35  # Minimum turn rate that actually moves the rover (motor dead-band)
+    _YAW_SIGN = IMU_YAW_SIGN
+    # -------------------------
+    _TOLERANCE_DEG = 3  # Error below which the heading is considered reached
+    _SETTLE_SAMPLES = 5  # Consecutive samples within tolerance before raising HEADING_REACHED_EVENT
+
+    def __init__(self, tractor: TractionSystem, sensors, nursery, rate: float = 50,
+                 notification_callbacks=None, error_callbacks=None):
+        """
+        :param tractor: traction system to be controlled
+        :param sensors: SenseHatWrapper (or compatible), providing the "yaw" property
+        :param nursery: Trio nursery
+        :param rate: control rate in Hz
+        """
+        super().__init__(nursery, notification_callbacks, error_callbacks)
+        self._tractor = tractor  # type: TractionSystem
+        self._sensors = sensors
+        self._period = 1 / rate
+        self._pid = PIDController(self._KP, self._KI, self._KD, output_limit=1, integral_limit=self._INTEGRAL_LIMIT)
+        self._target = None  # Absolute target heading (degrees, IMU frame, counter-clockwise)
+        self._linear = 0
+        self._settled_count = 0
+        self._is_running = False
+
+    @property
+    def heading(self):
+        """
+        Current heading (degrees, counter-clockwise, relative to the start-up orientation)
+        """
+        return wrap_angle(self._YAW_SIGN * self._sensors.yaw)
+
+    @property
+    def is_active(self):
+        return self._target is not None
+
+    @property
+    def error(self):
+        """
+        Remaining angle to the target heading (None if released)
+        """
+        if self._target is None:
+            return None
+        return wrap_angle(self._target - self.heading)
+
+    def turn_to(self, relative_angle: float, linear: float = 0):
+        """
+        Commands a new target heading
+        :param relative_angle: degrees, relative to the current heading (positive: counter-clockwise)
+        :param linear: forward speed (-1 to 1) kept while turning, following TractionSystem.drive
+        """
+        new_target = wrap_angle(self.heading + relative_angle)
+        if self._target is None:
+            self._pid.reset()
+        self._target = new_target
+        self._linear = linear
+        self._settled_count = 0
+
+    def release(self):
+        """
+        Stops controlling the heading. The traction system is not commanded anymore (nor stopped)
+        """
+        self._target = None
+        self._pid.reset()
+
+    async def a_run_control_loop(self):
+        if self._is_running:
+            return
+        self._is_running = True
+        last_time = trio.current_time()
+        while self._is_running:
+            await trio.sleep(self._period)
+            now = trio.current_time()
+            dt = now - last_time
+            last_time = now
+            if self._target is None:
+                continue
+            error = wrap_angle(self._target - self.heading)
+            if abs(error) <= self._TOLERANCE_DEG:
+                angular = 0
+                self._pid.reset()
+                self._settled_count += 1
+                if self._settled_count == self._SETTLE_SAMPLES:
+                    await self.raise_event(HeadingEventArgs(self.HEADING_REACHED_EVENT, self._target, error))
+            else:
+                angular = self._pid.update(error, dt)
+                if abs(angular) < self._MIN_TURN_RATE:
+                    angular = self._MIN_TURN_RATE if angular > 0 else -self._MIN_TURN_RATE
+                self._settled_count = 0
+            if self._tractor.velocity != (self._linear, angular):
+                self._tractor.drive(self._linear, angular)
+
+    def stop_control_loop(self):
+        self._is_running = False
+        self.release()
+
+
+class HeadingEventArgs(BaseEventArgs):
+    def __init__(self, event_type: str, target: float, error: float):
+        """
+        :param event_type: event identifier
+        :param target: target heading (degrees)
+        :param error: remaining error when the event was raised (degrees)
+        """
+        super().__init__(event_type)
+        self.target = target  # type: float
+        self.error = error  # type: float
+
+
+if __name__ == "__main__":
+    from systems.sensors import SenseHatWrapper
+    from systems.pwm import PWM_BACKEND_PIGPIO
+
+    async def heading_listener(source, param: HeadingEventArgs):
+        print(f"Heading reached: {param.target} (error {param.error})")
+
+    async def parent():
+        async with trio.open_nursery() as nursery:
+            tractor = TractionSystem(forward_r=17, backward_r=18, enable_r=27, forward_l=5, backward_l=6,
+                                     enable_l=13, enable_global=12, pwm_backend=PWM_BACKEND_PIGPIO)
+            tractor.toggle_enable(True)
+            sensors = SenseHatWrapper(nursery)
+            sensors.start_imu_sampling()
+            controller = HeadingController(tractor, sensors, nursery, notification_callbacks=[heading_listener])
+            nursery.start_soon(controller.a_run_control_loop)
+            for angle in [90, -90, 180, -45]:
+                await trio.sleep(1)
+                print(f"Turning {angle}deg from {controller.heading}")
+                controller.turn_to(angle)
+                await trio.sleep(4)
+            controller.stop_control_loop()
+            tractor.idle()
+            sensors.stop_imu_sampling()
+
+    trio.run(parent)
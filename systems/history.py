@@ -0,0 +1,291 @@
+import math
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-size FIFO of timestamped samples backed by NumPy arrays. Every sample is written twice (storage is twice
+    the capacity), so the stored samples are always available as a contiguous, ordered view: reading never copies
+    nor reorders memory.
+    Each sample has a timestamp and "width" values (width=1: scalar samples).
+    """
+    def __init__(self, capacity: int, width: int = 1):
+        """
+        :param capacity: max. number of stored samples. Older samples are overwritten
+        :param width: number of values per sample
+        """
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be at least 1")
+        self._capacity = capacity
+        self._width = width
+        self._timestamps = np.zeros(2 * capacity)
+        self._values = np.zeros((2 * capacity, width))
+        self._head = 0  # Next write position, in [0, capacity)
+        self._count = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, timestamp: float):
+        """
+        Stores a new sample
+        :param value: scalar (width=1) or sequence of "width" values
+        :param timestamp: sample time (must not decrease between samples)
+        """
+        head = self._head
+        mirror = head + self._capacity
+        self._timestamps[head] = self._timestamps[mirror] = timestamp
+        self._values[head] = self._values[mirror] = value
+        self._head = head + 1 if head + 1 < self._capacity else 0
+        if self._count < self._capacity:
+            self._count += 1
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    @property
+    def _span(self):
+        end = self._head + self._capacity
+        return slice(end - self._count, end)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """
+        Read-only view of the stored timestamps, oldest first
+        """
+        view = self._timestamps[self._span]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        Read-only view of the stored values, oldest first (1-D if width=1, otherwise one row per sample)
+        """
+        view = self._values[self._span]
+        if self._width == 1:
+            view = view[:, 0]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def last(self):
+        """
+        (timestamp, value) of the newest sample, or None if the buffer is empty
+        """
+        if self._count == 0:
+            return None
+        position = self._head + self._capacity - 1
+        value = self._values[position, 0] if self._width == 1 else self._values[position].copy()
+        return self._timestamps[position], value
+
+    def window(self, duration: float = None, now: float = None):
+        """
+        Samples taken during the last "duration" seconds
+        :param duration: window length (None: every stored sample)
+        :param now: end of the window (timestamp of the newest sample by default)
+        :return: (timestamps, values) read-only views
+        """
+        timestamps = self.timestamps
+        values = self.values
+        if duration is None or self._count == 0:
+            return timestamps, values
+        now = now if now is not None else timestamps[-1]
+        start = np.searchsorted(timestamps, now - duration, side='left')
+        return timestamps[start:], values[start:]
+
+    def mean(self, duration: float = None, now: float = None):
+        _, values = self.window(duration, now)
+        return float(values.mean()) if len(values) else None
+
+    def min(self, duration: float = None, now: float = None):
+        _, values = self.window(duration, now)
+        return float(values.min()) if len(values) else None
+
+    def max(self, duration: float = None, now: float = None):
+        _, values = self.window(duration, now)
+        return float(values.max()) if len(values) else None
+
+    def trend(self, duration: float = None, now: float = None):
+        """
+        Least-squares slope of the values over the window, in units per second (None if there are less than
+        two samples or they all share the same timestamp)
+        """
+        timestamps, values = self.window(duration, now)
+        if len(values) < 2:
+            return None
+        t = timestamps - timestamps.mean()
+        denominator = float(np.dot(t, t))
+        if denominator == 0:
+            return None
+        return float(np.dot(t, values - values.mean())) / denominator
+
+
+class FieldHistory:
+    """
+    History of a single numeric field, stored at several resolutions:
+        - raw: every sample
+        - one tier per (period, capacity) pair: per-period aggregates (mean, min, max, sample count)
+    Memory is fixed on construction. Window queries use the finest resolution that covers the whole window.
+    """
+    # Columns of the tier buffers
+    MEAN = 0
+    MIN = 1
+    MAX = 2
+    COUNT = 3
+
+    def __init__(self, raw_capacity: int = 600, tiers=((1, 600), (60, 1440))):
+        """
+        :param raw_capacity: number of raw samples kept
+        :param tiers: (period in seconds, number of periods kept) pairs, from the finest to the coarsest
+        """
+        self.raw = RingBuffer(raw_capacity)  # type: RingBuffer
+        self._periods = tuple(period for period, _ in tiers)
+        self.tiers = tuple(RingBuffer(capacity, width=4) for _, capacity in tiers)
+        # Aggregate of the period in progress, per tier: [period start, sum, min, max, count]
+        self._pending = [[None, 0.0, math.inf, -math.inf, 0] for _ in tiers]
+
+    def record(self, value: float, timestamp: float):
+        self.raw.append(value, timestamp)
+        for period, tier, pending in zip(self._periods, self.tiers, self._pending):
+            start = timestamp - timestamp % period
+            if pending[0] != start:
+                if pending[4]:
+                    tier.append((pending[1] / pending[4], pending[2], pending[3], pending[4]), pending[0])
+                pending[0], pending[1], pending[2], pending[3], pending[4] = start, 0.0, math.inf, -math.inf, 0
+            pending[1] += value
+            pending[2] = min(pending[2], value)
+            pending[3] = max(pending[3], value)
+            pending[4] += 1
+
+    def tier(self, period: float) -> RingBuffer:
+        """
+        Aggregated buffer of the given period (columns MEAN, MIN, MAX, COUNT)
+        """
+        return self.tiers[self._periods.index(period)]
+
+    @property
+    def last(self):
+        return self.raw.last
+
+    def _select(self, duration, now):
+        # Finest buffer whose oldest sample is older than the start of the window
+        if duration is None or len(self.raw) == 0:
+            return None
+        now = now if now is not None else self.raw.last[0]
+        start = now - duration
+        oldest = self.raw.timestamps[0]
+        if oldest <= start:
+            return None
+        best = None
+        for tier in self.tiers:
+            if len(tier) and tier.timestamps[0] < oldest:
+                best, oldest = tier, tier.timestamps[0]
+                if oldest <= start:
+                    break
+        return best
+
+    def stats(self, duration: float = None, now: float = None):
+        """
+        :param duration: window length in seconds (None: every raw sample)
+        :param now: end of the window (newest sample by default)
+        :return: (min, max, mean) over the window, or (None, None, None) if it holds no samples
+        """
+        tier = self._select(duration, now)
+        if tier is None:
+            return self.raw.min(duration, now), self.raw.max(duration, now), self.raw.mean(duration, now)
+        now = now if now is not None else self.raw.last[0]
+        timestamps, rows = tier.window(duration, now)
+        rows = rows[timestamps <= now]  # Windows ending in the past
+        # Aggregated periods plus the raw samples not aggregated yet (period in progress), within (now - duration, now]
+        raw_timestamps, raw_values = self.raw.window()
+        in_progress = tier.timestamps[-1] + self._periods[self.tiers.index(tier)]
+        pending = raw_values[(raw_timestamps >= in_progress) & (raw_timestamps > now - duration)
+                             & (raw_timestamps <= now)]
+        total = float(np.dot(rows[:, self.MEAN], rows[:, self.COUNT])) + float(pending.sum())
+        count = float(rows[:, self.COUNT].sum()) + len(pending)
+        if count == 0:
+            return None, None, None
+        minimum = min(float(rows[:, self.MIN].min()) if len(rows) else math.inf,
+                      float(pending.min()) if len(pending) else math.inf)
+        maximum = max(float(rows[:, self.MAX].max()) if len(rows) else -math.inf,
+                      float(pending.max()) if len(pending) else -math.inf)
+        return minimum, maximum, total / count
+
+    def mean(self, duration: float = None, now: float = None):
+        return self.stats(duration, now)[2]
+
+    def min(self, duration: float = None, now: float = None):
+        return self.stats(duration, now)[0]
+
+    def max(self, duration: float = None, now: float = None):
+        return self.stats(duration, now)[1]
+
+    def trend(self, duration: float = None, now: float = None):
+        """
+        Slope of the field (units per second) over the window, from the finest buffer covering it
+        """
+        tier = self._select(duration, now)
+        if tier is None:
+            return self.raw.trend(duration, now)
+        timestamps, rows = tier.window(duration, now if now is not None else self.raw.last[0])
+        if len(rows) < 2:
+            return None
+        t = timestamps - timestamps.mean()
+        denominator = float(np.dot(t, t))
+        if denominator == 0:
+            return None
+        return float(np.dot(t, rows[:, self.MEAN] - rows[:, self.MEAN].mean())) / denominator
+
+
+class TelemetryHistory:
+    """
+    Fixed-memory history of the numeric telemetry fields. Meant to be attached to a TelemetryStore as a sink
+    (store.add_sink(history.record)), so every stored value is also recorded here.
+    """
+    def __init__(self, fields, raw_capacity: int = 600, tiers=((1, 600), (60, 1440))):
+        """
+        :param fields: names of the fields to be recorded (any other field is ignored)
+        :param raw_capacity: raw samples kept per field
+        :param tiers: (period in seconds, number of periods kept) pairs, see FieldHistory
+        """
+        self._fields = {name: FieldHistory(raw_capacity, tiers) for name in fields}
+
+    @property
+    def fields(self):
+        return tuple(self._fields)
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    def __getitem__(self, name) -> FieldHistory:
+        return self._fields[name]
+
+    def record(self, name, value, timestamp: float):
+        """
+        Records a new value. Values of unknown fields and non-numeric values (None, strings...) are ignored
+        """
+        field = self._fields.get(name)
+        if field is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        field.record(value, timestamp)
+
+
+if __name__ == "__main__":
+    import time
+
+    history = TelemetryHistory(['motor_current'])
+    start = time.perf_counter()
+    for i in range(100000):
+        history.record('motor_current', math.sin(i / 100), i * 0.01)
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed / 100000 * 1e6:.2f}us per sample")
+    current = history['motor_current']
+    print(f"Last 10s (min, max, mean): {current.stats(10)}")
+    print(f"Last 5min (min, max, mean): {current.stats(300)}")
+    print(f"Trend over the last 2s: {current.trend(2)}/s")
@@ -0,0 +1,264 @@
+import math
+import numpy as np
+import trio
+from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.heading import wrap_angle, IMU_YAW_SIGN
+from systems.telemetry import TelemetryStore
+from systems.traction_system import TractionSystem
+
+EARTH_RADIUS = 6371000  # m
+
+
+class PoseEstimator:
+    """
+    Extended Kalman filter for the rover pose [x, y, theta] on a local tangent plane:
+        x: meters east of the origin, y: meters north of the origin,
+        theta: heading in radians, counter-clockwise from east.
+    Prediction (every step): unicycle model driven by the forward speed and the heading change (IMU yaw delta).
+    Corrections: GPS positions (once the first fix sets the origin) and GPS course over ground (only while moving,
+    since it is meaningless when stopped).
+    Steps only depend on their inputs (no clocks), so replaying the same inputs gives the same poses.
+    """
+    def __init__(self, speed_std: float = 0.1, yaw_rate_std: float = math.radians(5),
+                 gps_position_std: float = 2.5, course_std: float = math.radians(10), min_course_speed: float = 0.3):
+        """
+        :param speed_std: forward speed uncertainty (m/s)
+        :param yaw_rate_std: heading change uncertainty (rad/s)
+        :param gps_position_std: GPS position uncertainty (m)
+        :param course_std: GPS course uncertainty (rad)
+        :param min_course_speed: min. ground speed (m/s) for the GPS course to be used
+        """
+        self.state = np.zeros(3)
+        self.covariance = np.diag([1e6, 1e6, math.pi ** 2])  # Unknown position and heading
+        self._speed_var = speed_std ** 2
+        self._yaw_rate_var = yaw_rate_std ** 2
+        self._gps_noise = np.eye(2) * gps_position_std ** 2
+        self._course_var = course_std ** 2
+        self._min_course_speed = min_course_speed
+        self._jacobian = np.eye(3)
+        self._process_noise = np.zeros((3, 3))
+        self._gps_observation = np.array([[1.0, 0, 0], [0, 1.0, 0]])
+        self.origin = None  # (latitude, longitude) of the local plane origin (first GPS fix)
+        self._meters_per_degree_lon = None
+
+    @property
+    def heading(self) -> float:
+        return self.state[2]
+
+    def predict(self, dt: float, speed: float, heading_change: float):
+        """
+        :param dt: time step (s)
+        :param speed: forward speed (m/s)
+        :param heading_change: counter-clockwise heading change during the step (rad)
+        """
+        x, y, theta = self.state
+        middle = theta + heading_change / 2  # Mid-point heading: exact for constant turn rates
+        cos_theta = math.cos(middle)
+        sin_theta = math.sin(middle)
+        self.state[0] = x + speed * dt * cos_theta
+        self.state[1] = y + speed * dt * sin_theta
+        self.state[2] = _wrap(theta + heading_change)
+        jacobian = self._jacobian
+        jacobian[0, 2] = -speed * dt * sin_theta
+        jacobian[1, 2] = speed * dt * cos_theta
+        # Speed noise acts along the heading, yaw rate noise on the heading
+        noise = self._process_noise
+        speed_var = self._speed_var * dt * dt
+        noise[0, 0] = speed_var * cos_theta * cos_theta
+        noise[0, 1] = noise[1, 0] = speed_var * cos_theta * sin_theta
+        noise[1, 1] = speed_var * sin_theta * sin_theta
+        noise[2, 2] = self._yaw_rate_var * dt * dt
+        self.covariance = jacobian @ self.covariance @ jacobian.T + noise
+
+    def to_local(self, latitude: float, longitude: float):
+        """
+        (latitude, longitude) -> (x, y) meters on the local plane. The first call sets the origin
+        """
+        if self.origin is None:
+            self.origin = (latitude, longitude)
+            self._meters_per_degree_lon = math.radians(EARTH_RADIUS) * math.cos(math.radians(latitude))
+        return ((longitude - self.origin[1]) * self._meters_per_degree_lon,
+                (latitude - self.origin[0]) * math.radians(EARTH_RADIUS))
+
+    def to_global(self, x: float, y: float):
+        """
+        (x, y) meters on the local plane -> (latitude, longitude). None before the first GPS fix
+        """
+        if self.origin is None:
+            return None
+        return (self.origin[0] + y / math.radians(EARTH_RADIUS),
+                self.origin[1] + x / self._meters_per_degree_lon)
+
+    def update_gps(self, latitude: float, longitude: float):
+        if self.origin is None:
+            # First fix: the dead-reckoned position so far is relative to an unknown point. Restart from the fix
+            self.to_local(latitude, longitude)
+            self.state[0] = self.state[1] = 0
+            self.covariance[0:2, :] = 0
+            self.covariance[:, 0:2] = 0
+            self.covariance[0:2, 0:2] = self._gps_noise
+            return
+        measurement = np.array(self.to_local(latitude, longitude))
+        observation = self._gps_observation
+        innovation = measurement - self.state[0:2]
+        innovation_covariance = observation @ self.covariance @ observation.T + self._gps_noise
+        gain = self.covariance @ observation.T @ np.linalg.inv(innovation_covariance)
+        self.state += gain @ innovation
+        self.state[2] = _wrap(self.state[2])
+        self.covariance = (np.eye(3) - gain @ observation) @ self.covariance
+
+    def update_course(self, course: float, ground_speed: float):
+        """
+        :param course: GPS course over ground (degrees, clockwise from north)
+        :param ground_speed: GPS ground speed (m/s)
+        """
+        if ground_speed is None or ground_speed < self._min_course_speed:
+            return
+        measured = math.radians(90 - course)
+        innovation = _wrap(measured - self.state[2])
+        innovation_var = self.covariance[2, 2] + self._course_var
+        gain = self.covariance[:, 2] / innovation_var
+        self.state += gain * innovation
+        self.state[2] = _wrap(self.state[2])
+        self.covariance = self.covariance - np.outer(gain, self.covariance[2, :])
+
+
+class Localization(AsyncEventSource):
+    """
+    Runs a PoseEstimator at a fixed rate, fed with:
+        - the forward speed commanded to the traction system (0 while the driver is disabled),
+        - the IMU yaw (heading changes),
+        - new GPS fixes and course over ground, taken from the telemetry store as soon as they are written.
+    The time step is fixed (not measured), so results only depend on the sequence of inputs.
+    Smoothed poses are published (POSE_EVENT and "pose_x", "pose_y", "pose_heading" store fields) at publish_rate.
+    """
+    POSE_EVENT = "POSE_EVENT"
+
+    def __init__(self, tractor: TractionSystem, sensors, data: TelemetryStore, nursery, max_speed: float,
+                 rate: float = 50, publish_rate: float = 25, estimator: PoseEstimator = None,
+                 notification_callbacks=None, error_callbacks=None):
+        """
+        :param tractor: traction system (commanded velocity)
+        :param sensors: SenseHatWrapper (or compatible), providing the "yaw" property
+        :param data: telemetry store with the GPS fields (and the pose fields, which are updated)
+        :param nursery: Trio nursery
+        :param max_speed: rover forward speed (m/s) for a commanded linear velocity of 1
+        :param rate: filter rate (Hz)
+        :param publish_rate: pose publication rate (Hz). Rounded to a whole number of filter steps
+        :param estimator: filter to be used (a default PoseEstimator otherwise)
+        """
+        super().__init__(nursery, notification_callbacks, error_callbacks)
+        self._tractor = tractor  # type: TractionSystem
+        self._sensors = sensors
+        self._data = data  # type: TelemetryStore
+        self._max_speed = max_speed
+        self._period = 1 / rate
+        self._publish_every = max(1, round(rate / publish_rate))
+        self.estimator = estimator if estimator is not None else PoseEstimator()  # type: PoseEstimator
+        self._gps_version = 0
+        self._course_version = 0
+        self._last_heading = None  # Latest IMU heading (degrees, counter-clockwise)
+        self._is_running = False
+
+    def step(self):
+        """
+        Runs one filter step with the latest inputs
+        """
+        estimator = self.estimator
+        imu_heading = IMU_YAW_SIGN * self._sensors.yaw
+        heading_change = 0 if self._last_heading is None else wrap_angle(imu_heading - self._last_heading)
+        self._last_heading = imu_heading
+        speed = self._tractor.velocity[0] * self._max_speed if self._tractor.is_enabled else 0
+        estimator.predict(self._period, speed, math.radians(heading_change))
+
+        data = self._data
+        version = data.version_of('latitude')
+        if version != self._gps_version:
+            self._gps_version = version
+            latitude = data['latitude']
+            longitude = data['longitude']
+            if latitude is not None and longitude is not None:
+                estimator.update_gps(latitude, longitude)
+        version = data.version_of('course')
+        if version != self._course_version:
+            self._course_version = version
+            if data['course'] is not None:
+                estimator.update_course(data['course'], data['ground_speed'])
+
+    @property
+    def pose(self):
+        """
+        (x, y, heading): meters east and north of the first GPS fix, and degrees counter-clockwise from east
+        """
+        x, y, theta = self.estimator.state
+        return x, y, math.degrees(theta)
+
+    async def a_run_notification_loop(self):
+        if self._is_running:
+            return
+        self._is_running = True
+        counter = 0
+        next_step = trio.current_time()
+        while self._is_running:
+            next_step += self._period
+            await trio.sleep_until(next_step)
+            self.step()
+            counter += 1
+            if counter % self._publish_every == 0:
+                x, y, heading = self.pose
+                self._data.update({'pose_x': x, 'pose_y': y, 'pose_heading': heading})
+                position = self.estimator.to_global(x, y)
+                await self.raise_event(PoseEventArgs(self.POSE_EVENT, x, y, heading, position,
+                                                     self.estimator.covariance.copy()))
+
+    def stop_notification_loop(self):
+        self._is_running = False
+
+
+class PoseEventArgs(BaseEventArgs):
+    def __init__(self, event_type: str, x: float, y: float, heading: float, position, covariance: np.ndarray):
+        """
+        :param event_type: event identifier
+        :param x: meters east of the origin (first GPS fix)
+        :param y: meters north of the origin
+        :param heading: degrees, counter-clockwise from east
+        :param position: (latitude, longitude), None before the first GPS fix
+        :param covariance: 3x3 covariance of [x, y, heading (rad)]
+        """
+        super().__init__(event_type)
+        self.x = x  # type: float
+        self.y = y  # type: float
+        self.heading = heading  # type: float
+        self.position = position
+        self.covariance = covariance  # type: np.ndarray
+
+
+def _wrap(angle: float) -> float:
+    # Radians onto [-pi, pi)
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+if __name__ == "__main__":
+    # Replay: straight line east at 0.5m/s with noisy 1Hz GPS fixes. Two runs must give identical poses
+    def replay():
+        rng = np.random.default_rng(0)
+        estimator = PoseEstimator()
+        latitude, longitude = 40.0, -3.0
+        meters_per_degree_lon = math.radians(EARTH_RADIUS) * math.cos(math.radians(latitude))
+        poses = []
+        for step in range(50 * 60):
+            estimator.predict(1 / 50, 0.5, 0)
+            if step % 50 == 0:
+                true_x = 0.5 * step / 50
+                noisy_x = true_x + rng.normal(0, 2.5)
+                noisy_y = rng.normal(0, 2.5)
+                estimator.update_gps(latitude + noisy_y / math.radians(EARTH_RADIUS),
+                                     longitude + noisy_x / meters_per_degree_lon)
+                estimator.update_course(90, 0.5)
+            poses.append(tuple(estimator.state))
+        return poses
+
+    first = replay()
+    print(f"Deterministic: {first == replay()}")
+    x, y, theta = first[-1]
+    print(f"After 60s: x={x:.2f}m (true 29.98m), y={y:.2f}m (true 0m), heading={math.degrees(theta):.1f}deg")
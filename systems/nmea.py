@@ -0,0 +1,237 @@
+from systems.telemetry import TelemetryStore
+
+# Sentence flags returned by NMEAParser.feed (OR-ed together)
+SENTENCE_GGA = 1
+SENTENCE_RMC = 2
+SENTENCE_GSV = 4
+SATELLITES_COMPLETE = 8  # Last GSV sentence of a group received: the satellite list is complete
+
+_KNOTS_TO_MS = 0.514444
+_MAX_FIELDS = 24
+
+
+def nmea_checksum(body: bytes) -> int:
+    """
+    XOR of every byte of the sentence body (between "$" and "*"), folding the whole body as a single integer
+    instead of looping over its bytes
+    """
+    value = int.from_bytes(body, 'little')
+    width = len(body)
+    while width > 1:
+        half = (width + 1) // 2
+        value = (value >> (half * 8)) ^ (value & ((1 << (half * 8)) - 1))
+        width = half
+    return value
+
+
+class NMEAParser:
+    """
+    Incremental NMEA 0183 parser, fed with raw bytes as they arrive (chunks do not need to be aligned with
+    sentences). Sentences are framed and validated (checksum) directly on bytes, and only the fields of the
+    supported sentences (GGA, RMC, GSV, from any talker) are converted, straight into numbers: no string decoding,
+    no intermediate message objects.
+    Latest values are kept as attributes and, if a TelemetryStore is provided, written into it:
+        GGA -> latitude, longitude, altitude, gps_fix
+        RMC -> ground_speed (m/s), course (degrees)
+        GSV -> num_satellites (satellites in view, once per complete GSV group)
+    """
+    MAX_SENTENCE_LENGTH = 120  # NMEA limits sentences to 82 bytes, some receivers do not
+
+    def __init__(self, data: TelemetryStore = None, satellite_callback=None):
+        """
+        :param data: telemetry store to be updated (None: only the attributes are updated)
+        :param satellite_callback: callable(prn, elevation, azimuth, snr), called for every satellite of every GSV
+                                   sentence. Values are int (None if the field is empty)
+        """
+        self._data = data
+        self._satellite_callback = satellite_callback
+        self._buffer = bytearray()
+        self._commas = [0] * _MAX_FIELDS  # Comma positions of the sentence being parsed
+        self._field_count = 0
+        # GGA
+        self.utc_time = None  # Seconds since midnight (UTC)
+        self.latitude = None  # Degrees (positive: north)
+        self.longitude = None  # Degrees (positive: east)
+        self.altitude = None  # Meters over the mean sea level
+        self.fix_quality = 0  # 0: no fix, 1: GPS, 2: DGPS...
+        self.satellites_used = 0
+        self.hdop = None
+        # RMC
+        self.is_valid = False  # RMC status
+        self.ground_speed = None  # m/s
+        self.course = None  # Degrees (true north)
+        # GSV
+        self.satellites_in_view = 0
+        # Statistics
+        self.sentence_count = 0
+        self.checksum_errors = 0
+        self.dropped_sentences = 0  # Truncated or too long
+
+    def feed(self, chunk: bytes) -> int:
+        """
+        Processes newly received bytes
+        :return: flags of the sentences parsed in this chunk (SENTENCE_GGA | SENTENCE_RMC...)
+        """
+        buffer = self._buffer
+        buffer += chunk
+        parsed = 0
+        start = buffer.find(b'$')
+        while start >= 0:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+            next_start = buffer.find(b'$', start + 1, end)
+            if next_start >= 0:  # Truncated sentence, directly followed by another one
+                self.dropped_sentences += 1
+                start = next_start
+                continue
+            parsed |= self._parse_sentence(bytes(buffer[start + 1:end]))
+            start = buffer.find(b'$', end)
+        if start < 0:
+            buffer.clear()
+        else:
+            del buffer[:start]
+            if len(buffer) > self.MAX_SENTENCE_LENGTH:  # No end of line: garbage, or a sentence too long
+                self.dropped_sentences += 1
+                next_start = buffer.find(b'$', 1)
+                del buffer[:next_start if next_start > 0 else len(buffer)]
+        return parsed
+
+    def _parse_sentence(self, sentence: bytes) -> int:
+        star = sentence.rfind(b'*')
+        if star < 0:
+            self.checksum_errors += 1
+            return 0
+        body = sentence[:star]
+        try:
+            checksum = int(sentence[star + 1:star + 3], 16)
+        except ValueError:
+            checksum = -1
+        if checksum != nmea_checksum(body):
+            self.checksum_errors += 1
+            return 0
+        self.sentence_count += 1
+        self._index_fields(body)
+        sentence_type = body[2:5]
+        try:
+            if sentence_type == b'GGA':
+                return self._parse_gga(body)
+            elif sentence_type == b'RMC':
+                return self._parse_rmc(body)
+            elif sentence_type == b'GSV':
+                return self._parse_gsv(body)
+        except ValueError:  # Malformed field
+            self.dropped_sentences += 1
+        return 0
+
+    def _index_fields(self, body: bytes):
+        commas = self._commas
+        count = 0
+        position = body.find(b',')
+        while position >= 0 and count < _MAX_FIELDS:
+            commas[count] = position
+            count += 1
+            position = body.find(b',', position + 1)
+        if count < _MAX_FIELDS:
+            commas[count] = len(body)  # Virtual comma after the last field
+        self._field_count = count
+
+    def _field(self, body: bytes, index: int):
+        # Field "index" (1: first field after the sentence type) as bytes, None if empty or missing
+        if index > self._field_count:
+            return None
+        start = self._commas[index - 1] + 1
+        end = self._commas[index] if index < _MAX_FIELDS else len(body)
+        return body[start:end] if end > start else None
+
+    def _float(self, body: bytes, index: int):
+        field = self._field(body, index)
+        return float(field) if field is not None else None
+
+    def _int(self, body: bytes, index: int):
+        field = self._field(body, index)
+        return int(field) if field is not None else None
+
+    def _coordinate(self, body: bytes, index: int):
+        # (d)ddmm.mmmm + hemisphere -> signed degrees
+        value = self._float(body, index)
+        hemisphere = self._field(body, index + 1)
+        if value is None or hemisphere is None:
+            return None
+        degrees = int(value / 100)
+        degrees += (value - degrees * 100) / 60
+        return -degrees if hemisphere in (b'S', b'W') else degrees
+
+    def _time(self, body: bytes, index: int):
+        value = self._float(body, index)
+        if value is None:
+            return None
+        hours = int(value / 10000)
+        minutes = int(value / 100) % 100
+        return hours * 3600 + minutes * 60 + value % 100
+
+    def _parse_gga(self, body: bytes) -> int:
+        self.utc_time = self._time(body, 1)
+        self.fix_quality = self._int(body, 6) or 0
+        self.satellites_used = self._int(body, 7) or 0
+        self.hdop = self._float(body, 8)
+        if self.fix_quality > 0:
+            self.latitude = self._coordinate(body, 2)
+            self.longitude = self._coordinate(body, 4)
+            self.altitude = self._float(body, 9)
+        else:
+            self.latitude = self.longitude = self.altitude = None
+        if self._data is not None:
+            self._data.update({'latitude': self.latitude, 'longitude': self.longitude, 'altitude': self.altitude,
+                               'gps_fix': self.fix_quality})
+        return SENTENCE_GGA
+
+    def _parse_rmc(self, body: bytes) -> int:
+        self.is_valid = self._field(body, 2) == b'A'
+        if self.is_valid:
+            speed = self._float(body, 7)
+            self.ground_speed = speed * _KNOTS_TO_MS if speed is not None else None
+            self.course = self._float(body, 8)
+        else:
+            self.ground_speed = self.course = None
+        if self._data is not None:
+            self._data.update({'ground_speed': self.ground_speed, 'course': self.course})
+        return SENTENCE_RMC
+
+    def _parse_gsv(self, body: bytes) -> int:
+        total = self._int(body, 1)
+        number = self._int(body, 2)
+        in_view = self._int(body, 3)
+        if self._satellite_callback is not None:
+            index = 4
+            while index <= self._field_count and index + 3 < _MAX_FIELDS:
+                prn = self._int(body, index)
+                if prn is not None:
+                    self._satellite_callback(prn, self._int(body, index + 1), self._int(body, index + 2),
+                                             self._int(body, index + 3))
+                index += 4
+        if number != total:
+            return SENTENCE_GSV
+        self.satellites_in_view = in_view or 0
+        if self._data is not None:
+            self._data['num_satellites'] = self.satellites_in_view
+        return SENTENCE_GSV | SATELLITES_COMPLETE
+
+
+if __name__ == "__main__":
+    import time
+
+    SENTENCES = (b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n"
+                 b"$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A\r\n"
+                 b"$GPGSV,2,1,08,01,40,083,46,02,17,308,41,12,07,344,39,14,22,228,45*75\r\n"
+                 b"$GPGSV,2,2,08,15,12,050,32,17,53,105,41,22,08,257,,24,60,173,40*7A\r\n")
+    parser = NMEAParser(satellite_callback=lambda prn, elevation, azimuth, snr: None)
+    repetitions = 20000
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for offset in range(0, len(SENTENCES), 64):  # Chunks not aligned with the sentences
+            parser.feed(SENTENCES[offset:offset + 64])
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed / (4 * repetitions) * 1e6:.2f}us per sentence. Errors: {parser.checksum_errors}")
+    print(f"Lat {parser.latitude}, long {parser.longitude}, alt {parser.altitude}, fix {parser.fix_quality}, "
+          f"speed {parser.ground_speed}m/s, course {parser.course}, in view {parser.satellites_in_view}")
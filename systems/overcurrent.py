@@ -0,0 +1,145 @@
+import threading
+import time
+import trio
+from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.ads1015 import ADS1015
+from systems.current_measure import CurrentMeasure
+from systems.traction_system import TractionSystem
+
+
+class OvercurrentGuard(AsyncEventSource):
+    """
+    Fast overcurrent protection, independent of the Trio event loop: a dedicated thread samples the motor current
+    channel at a high rate and trips the traction system (cuts the driver power supply) as soon as the current
+    stays over the limit for a few consecutive samples. The Trio side is notified afterwards (OVERCURRENT_EVENT).
+    The driver stays disabled until TractionSystem.reset_trip is called.
+
+    The ALERT/READY pin of the ADS1015 is already used as conversion-ready signal for the radio channel, so the
+    comparator mode is not available: samples are single-shot reads of the current channel, sharing the converter
+    (and its lock) with every other reader. Trade-off of that sharing:
+        - Every sample interrupts the continuous conversions of the radio channel. Completion is polled through the
+          OS bit (READY pulses cannot be told apart), and RadioDetection gets its last valid value until the radio
+          channel has been converted again, so it never reads a current sample as a phase voltage.
+        - Every sample holds the converter lock for about 6 I2C transactions plus one conversion (~2-3ms at
+          100kHz), blocking the radio reads of the Trio thread meanwhile. The default 100Hz keeps that around 25% of
+          the bus; higher rates trip faster but starve the phase detector.
+    """
+    OVERCURRENT_EVENT = "OVERCURRENT_EVENT"
+
+    def __init__(self, tractor: TractionSystem, adc: ADS1015, channel: int, nursery, threshold: float,
+                 rate: float = 100, trip_samples: int = 3, notification_callbacks=None, error_callbacks=None):
+        """
+        :param tractor: traction system to be tripped
+        :param adc: A/D converter with the current sensor
+        :param channel: A/D channel of the current sensor
+        :param nursery: Trio nursery
+        :param threshold: current limit in A
+        :param rate: sampling rate in Hz
+        :param trip_samples: consecutive samples over the limit needed to trip (filters single-sample glitches)
+        """
+        super().__init__(nursery, notification_callbacks, error_callbacks)
+        self._tractor = tractor  # type: TractionSystem
+        self._adc = adc  # type: ADS1015
+        self._channel = channel
+        self._threshold = threshold
+        self._period = 1 / rate
+        self._trip_samples = trip_samples
+        self._trio_token = None
+        self._thread = None
+        self._is_running = False
+        self.trip_count = 0
+        self.last_trip_current = None  # A, sample that tripped the protection
+        self.last_trip_time = None  # time.monotonic() of the last trip
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    async def a_run_notification_loop(self):
+        """
+        Starts the sampling thread. Returns immediately
+        """
+        if self._is_running:
+            return
+        self._is_running = True
+        self._trio_token = trio.lowlevel.current_trio_token()
+        self._thread = threading.Thread(target=self._sampling_loop, name="OvercurrentGuard", daemon=True)
+        self._thread.start()
+
+    def stop_notification_loop(self):
+        self._is_running = False
+
+    def _sampling_loop(self):
+        over_limit = 0
+        next_sample = time.monotonic()
+        while self._is_running:
+            current = CurrentMeasure.voltage_to_current(self._adc.read_single_shot(channel=self._channel))
+            if current > self._threshold:
+                over_limit += 1
+                if over_limit >= self._trip_samples and not self._tractor.is_tripped:
+                    self._tractor.trip()
+                    self._on_trip(current)
+            else:
+                over_limit = 0
+            next_sample += self._period
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:  # Running late (e.g. bus contention): do not try to catch up
+                next_sample = time.monotonic()
+
+    def _on_trip(self, current: float):
+        # Runs in the sampling thread, once the driver has been cut off
+        self.trip_count += 1
+        self.last_trip_current = current
+        self.last_trip_time = time.monotonic()
+        args = OvercurrentEventArgs(self.OVERCURRENT_EVENT, current, self.last_trip_time)
+        try:
+            self._trio_token.run_sync_soon(self.nursery.start_soon, self.raise_event, args)
+        except trio.RunFinishedError:
+            pass
+
+
+class OvercurrentEventArgs(BaseEventArgs):
+    def __init__(self, event_type: str, current: float, trip_time: float):
+        """
+        :param event_type: event identifier
+        :param current: current (A) of the sample that tripped the protection
+        :param trip_time: time.monotonic() when the driver was cut off
+        """
+        super().__init__(event_type)
+        self.current = current  # type: float
+        self.trip_time = trip_time  # type: float
+
+
+if __name__ == "__main__":
+    # Simulated stall: no hardware needed
+    from systems.ads1015 import DummyADS1015
+    from systems.pwm import PWM_BACKEND_DUMMY
+
+    CURRENT_CHANNEL = 1
+    adc = DummyADS1015(channel=0)
+    adc.set_voltage(CURRENT_CHANNEL, 2.5)  # 0A
+
+    async def overcurrent_listener(source, param: OvercurrentEventArgs):
+        print(f"Tripped at {param.current:.2f}A. Notified {(time.monotonic() - param.trip_time) * 1000:.2f}ms later")
+
+    async def parent():
+        async with trio.open_nursery() as nursery:
+            tractor = TractionSystem(forward_r=17, backward_r=18, enable_r=27, forward_l=5, backward_l=6,
+                                     enable_l=13, enable_global=12, pwm_backend=PWM_BACKEND_DUMMY)
+            tractor.toggle_enable(True)
+            tractor.forward()
+            guard = OvercurrentGuard(tractor, adc, CURRENT_CHANNEL, nursery, threshold=2,
+                                     notification_callbacks=[overcurrent_listener])
+            await guard.a_run_notification_loop()
+            await trio.sleep(0.5)
+            stall_time = time.monotonic()
+            adc.set_voltage(CURRENT_CHANNEL, 2.5 + 3 * 0.187)  # 3A
+            while tractor.is_enabled:
+                await trio.sleep(0.001)
+            print(f"Driver disabled {(guard.last_trip_time - stall_time) * 1000:.2f}ms after the stall")
+            await trio.sleep(0.5)
+            guard.stop_notification_loop()
+
+    trio.run(parent)
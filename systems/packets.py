@@ -0,0 +1,130 @@
+from collections import deque
+
+
+class Packet:
+    """
+    Packet received by the CC1101, with the status bytes appended by the radio (PKTCTRL1.APPEND_STATUS)
+    """
+    __slots__ = ('payload', 'rssi', 'lqi', 'crc_ok', 'timestamp', 'address')
+
+    def __init__(self, payload: bytes, rssi: float, lqi: int, crc_ok: bool, timestamp: float, address: int = None):
+        """
+        :param payload: packet payload (without the length byte)
+        :param rssi: RSSI (dBm) measured while receiving the packet
+        :param lqi: link quality indicator (0-127, lower is better)
+        :param crc_ok: whether the CRC of the packet was right
+        :param timestamp: time.monotonic() at the end of the packet
+        :param address: destination address byte (None if address checking is disabled)
+        """
+        self.payload = payload  # type: bytes
+        self.rssi = rssi  # type: float
+        self.lqi = lqi  # type: int
+        self.crc_ok = crc_ok  # type: bool
+        self.timestamp = timestamp  # type: float
+        self.address = address
+
+    @property
+    def text(self) -> str:
+        """
+        Payload as text, without the terminator sent by the beacons
+        """
+        payload = self.payload[:-1] if self.payload.endswith(b'\x00') else self.payload
+        return payload.decode('ascii', errors='replace')
+
+    def __repr__(self):
+        return f"Packet({self.payload!r}, {self.rssi}dBm, LQI {self.lqi}, CRC {'OK' if self.crc_ok else 'ERROR'})"
+
+
+class PacketBuffer:
+    """
+    Bounded FIFO of the latest received packets (oldest ones are discarded), iterable oldest first, with reception
+    statistics. Counters cover every packet ever appended, not only the stored ones
+    """
+    def __init__(self, capacity: int = 256):
+        """
+        :param capacity: max. number of stored packets
+        """
+        if capacity < 1:
+            raise ValueError("PacketBuffer capacity must be at least 1")
+        self._packets = deque(maxlen=capacity)
+        self.total_count = 0
+        self.crc_errors = 0
+        self.lost_count = 0  # Packets known to be lost before reaching the buffer (e.g. RX FIFO overflows)
+
+    @property
+    def capacity(self) -> int:
+        return self._packets.maxlen
+
+    def __len__(self):
+        return len(self._packets)
+
+    def __iter__(self):
+        return iter(self._packets)
+
+    def append(self, packet: Packet):
+        self._packets.append(packet)
+        self.total_count += 1
+        if not packet.crc_ok:
+            self.crc_errors += 1
+
+    def add_lost(self, count: int = 1):
+        self.lost_count += count
+
+    def clear(self):
+        self._packets.clear()
+
+    @property
+    def last(self):
+        """
+        Newest packet, None if the buffer is empty
+        """
+        return self._packets[-1] if self._packets else None
+
+    def since(self, timestamp: float, valid_only: bool = True):
+        """
+        Packets received after "timestamp", oldest first
+        :param timestamp: time.monotonic() value
+        :param valid_only: skip the packets with a wrong CRC
+        """
+        packets = []
+        for packet in reversed(self._packets):
+            if packet.timestamp <= timestamp:
+                break
+            if packet.crc_ok or not valid_only:
+                packets.append(packet)
+        packets.reverse()
+        return packets
+
+    def rate(self, duration: float, now: float) -> float:
+        """
+        Valid packets per second over the last "duration" seconds
+        """
+        return len(self.since(now - duration)) / duration
+
+    def loss_ratio(self, expected_rate: float, duration: float, now: float) -> float:
+        """
+        Fraction (0 to 1) of the packets missing (or corrupted) over the last "duration" seconds, for a transmitter
+        sending "expected_rate" packets per second
+        """
+        expected = expected_rate * duration
+        if expected <= 0:
+            return 0.0
+        return max(0.0, 1 - len(self.since(now - duration)) / expected)
+
+    @property
+    def crc_error_ratio(self) -> float:
+        """
+        Fraction of the received packets with a wrong CRC
+        """
+        return self.crc_errors / self.total_count if self.total_count else 0.0
+
+    def rssi_mean(self, since: float):
+        """
+        Mean RSSI (dBm) of the valid packets received after "since", None if there are none
+        """
+        packets = self.since(since)
+        return sum(packet.rssi for packet in packets) / len(packets) if packets else None
+
+    def __repr__(self):
+        return (f"PacketBuffer({len(self)}/{self.capacity} stored, {self.total_count} received, "
+                f"{self.crc_errors} CRC errors, {self.lost_count} lost)")
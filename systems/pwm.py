@@ -0,0 +1,168 @@
+from collections import deque
+from gpiozero import PWMOutputDevice
+
+# Available backends for the PWM outputs
+PWM_BACKEND_SOFTWARE = "SOFTWARE"  # gpiozero default pin factory (usually software-timed PWM)
+PWM_BACKEND_PIGPIO = "PIGPIO"  # pigpio daemon: hardware PWM where possible, DMA-timed PWM otherwise
+PWM_BACKEND_DUMMY = "DUMMY"  # No hardware access, for testing
+
+
+class SoftwarePWM:
+    """
+    PWM output through gpiozero's default pin factory. This is the behaviour the traction
+    system always had: simple, but timed by a CPU thread (jitters under load).
+    """
+    DEFAULT_FREQUENCY = 100
+
+    def __init__(self, pin, frequency=None, pin_factory=None):
+        frequency = frequency if frequency is not None else self.DEFAULT_FREQUENCY
+        self._device = PWMOutputDevice(pin, frequency=frequency, pin_factory=pin_factory)
+
+    @property
+    def value(self):
+        return self._device.value
+
+    @value.setter
+    def value(self, value):
+        self._device.value = value
+
+    @property
+    def frequency(self):
+        return self._device.frequency
+
+    @property
+    def is_hardware(self):
+        return False
+
+    def close(self):
+        self._device.close()
+
+
+class PigpioPWM:
+    """
+    PWM output generated by the pigpio daemon (pigpiod must be running), which costs no CPU time in this process.
+    Pins connected to the PWM peripheral (GPIO 12, 13, 18 and 19) use true hardware PWM at the requested frequency.
+    Any other pin falls back to pigpio's DMA-timed PWM, whose frequency is rounded to the closest one available
+    (8kHz max. with the default daemon sample rate).
+
+    WARNING: GPIO 12/18 share the PWM0 channel, and GPIO 13/19 share PWM1. The PWM peripheral is also used by the
+    analog audio output.
+    """
+    HARDWARE_PWM_PINS = (12, 13, 18, 19)
+    DEFAULT_FREQUENCY = 10000
+    _HARDWARE_DUTY_RANGE = 1000000  # Fixed by pigpio's hardware_PWM
+    _DMA_DUTY_RANGE = 10000
+    _connection = None  # Shared connection to the pigpio daemon
+
+    def __init__(self, pin, frequency=None):
+        import pigpio  # Only needed (and installed) when this backend is used
+        if PigpioPWM._connection is None:
+            connection = pigpio.pi()
+            if not connection.connected:
+                raise RuntimeError("Could not connect to the pigpio daemon (is pigpiod running?)")
+            PigpioPWM._connection = connection
+        self._pi = PigpioPWM._connection
+        self._pin = pin
+        self._value = 0
+        self._is_hardware = pin in self.HARDWARE_PWM_PINS
+        frequency = frequency if frequency is not None else self.DEFAULT_FREQUENCY
+        if self._is_hardware:
+            self._frequency = frequency
+            self._pi.hardware_PWM(pin, frequency, 0)
+        else:
+            self._pi.set_mode(pin, pigpio.OUTPUT)
+            self._frequency = self._pi.set_PWM_frequency(pin, frequency)
+            self._pi.set_PWM_range(pin, self._DMA_DUTY_RANGE)
+            self._pi.set_PWM_dutycycle(pin, 0)
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if not 0 <= value <= 1:
+            raise ValueError("PWM duty cycle must be between 0 and 1")
+        if self._is_hardware:
+            self._pi.hardware_PWM(self._pin, self._frequency, int(value * self._HARDWARE_DUTY_RANGE))
+        else:
+            self._pi.set_PWM_dutycycle(self._pin, int(value * self._DMA_DUTY_RANGE))
+        self._value = value
+
+    @property
+    def frequency(self):
+        return self._frequency
+
+    @property
+    def is_hardware(self):
+        return self._is_hardware
+
+    def close(self):
+        self.value = 0
+
+
+class DummyPWM:
+    """
+    PWM output that only stores the requested values. The latest written duty cycles are kept in "history"
+    """
+    DEFAULT_FREQUENCY = 100
+    DEFAULT_HISTORY_LENGTH = 1000
+
+    def __init__(self, pin, frequency=None, history_length=None):
+        """
+        :param history_length: written duty cycles kept in "history" (DEFAULT_HISTORY_LENGTH if None)
+        """
+        self.pin = pin
+        self.frequency = frequency if frequency is not None else self.DEFAULT_FREQUENCY
+        self.history = deque(maxlen=history_length if history_length is not None else self.DEFAULT_HISTORY_LENGTH)
+        self._value = 0
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if not 0 <= value <= 1:
+            raise ValueError("PWM duty cycle must be between 0 and 1")
+        self._value = value
+        self.history.append(value)
+
+    @property
+    def is_hardware(self):
+        return False
+
+    def close(self):
+        self._value = 0
+
+
+def create_pwm(pin, backend=PWM_BACKEND_SOFTWARE, frequency=None, pin_factory=None):
+    """
+    Builds a PWM output for the selected backend. All of them expose "value" (duty cycle, 0 to 1),
+    "frequency", "is_hardware" and "close()"
+
+    :param pin: GPIO pin (BCM numbering)
+    :param backend: one of PWM_BACKEND_SOFTWARE, PWM_BACKEND_PIGPIO or PWM_BACKEND_DUMMY
+    :param frequency: PWM frequency in Hz. If None, the backend default is used
+    :param pin_factory: gpiozero pin factory (only used by the software backend)
+    """
+    if backend == PWM_BACKEND_SOFTWARE:
+        return SoftwarePWM(pin, frequency, pin_factory=pin_factory)
+    elif backend == PWM_BACKEND_PIGPIO:
+        return PigpioPWM(pin, frequency)
+    elif backend == PWM_BACKEND_DUMMY:
+        return DummyPWM(pin, frequency)
+    raise ValueError(f"Unknown PWM backend: {backend}")
+
+
+if __name__ == "__main__":
+    import time
+    MOTOR_L_ENABLE_PIN = 13
+
+    pwm = create_pwm(MOTOR_L_ENABLE_PIN, PWM_BACKEND_PIGPIO, 20000)
+    print(f"Hardware PWM: {pwm.is_hardware}. Frequency: {pwm.frequency}Hz")
+    for duty in [0, 0.25, 0.5, 0.75, 1, 0]:
+        pwm.value = duty
+        print(f"Duty: {duty}")
+        time.sleep(2)
+    pwm.close()
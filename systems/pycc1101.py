@@ -1,4 +1,3 @@
-import spidev
 import time
 
 
@@ -109,50 +108,191 @@ class TICC1101(object):
     RCCTRL1_STATUS = 0xFC  # Last RC Oscillator Calibration Result
     RCCTRL0_STATUS = 0xFD  # Last RC Oscillator Calibration Result
 
-    def __init__(self, bus=0, device=0, speed=50000, debug=True):
+    # CC1101 SPI clock limit for burst accesses without delays between bytes (10MHz for single accesses only).
+    # spidev cannot insert those delays, so this is the limit for every access
+    MAX_SPI_SPEED = 6500000
+
+    # Register shadow cache: configuration registers (IOCFG2 to TEST0) only change when written, so their values
+    # are kept in memory and not read back through SPI. Status registers and FIFOs are never cached
+    CONFIG_REGISTERS = 0x2F
+    # Lose their values in SLEEP state: the cache keeps the configured ones, rewritten by wakeUp
+    SLEEP_LOST_REGISTERS = range(FSTEST, TEST0 + 1)
+
+    # Wake-on-Radio (WORCTRL.WOR_RES = 0): Event0 period in units of 750 / XOSC_FREQ (~28.8us, max. ~1.89s),
+    # RX timeout (MCSM2.RX_TIME 0-6) as a fraction of that period: 1 / 2 ** (RX_TIME + 3)
+    XOSC_FREQ = 26000000  # Hz
+    WOR_MAX_EVENT0 = 0xFFFF
+    WOR_MAX_RX_TIME = 6
+
+    # PKTCTRL0.LENGTH_CONFIG[1:0] -> packet mode
+    PACKET_MODES = ("PKT_LEN_FIXED", "PKT_LEN_VARIABLE", "PKT_LEN_INFINITE", None)
+
+    # Default values extracted from Smart RF Studio 7, in register order (from IOCFG2 to TEST0)
+    DEFAULT_REGISTERS = (
+        0x2E,  # IOCFG2 - Panstamp
+        0x2E,  # IOCFG1 - Panstamp
+        0x06,  # IOCFG0 - Panstamp
+        0x07,  # FIFOTHR - Panstamp
+        0xFA,  # SYNC1 - sync word "FAFA"
+        0xFA,  # SYNC0
+        0x3D,  # PKTLEN
+        0x06,  # PKTCTRL1 - Panstamp
+        0x05,  # PKTCTRL0 - Panstamp
+        0xFF,  # ADDR
+        0x00,  # CHANNR
+        0x08,  # FSCTRL1 - Panstamp
+        0x00,  # FSCTRL0 - Panstamp
+        0x10,  # FREQ2 - 433MHz
+        0xA7,  # FREQ1
+        0x62,  # FREQ0
+        0xCA,  # MDMCFG4 - Panstamp
+        0x83,  # MDMCFG3 - Panstamp
+        0x93,  # MDMCFG2 - Panstamp
+        0x22,  # MDMCFG1
+        0xF8,  # MDMCFG0
+        0x35,  # DEVIATN - Panstamp
+        0x07,  # MCSM2
+        0x20,  # MCSM1 - Panstamp
+        0x18,  # MCSM0
+        0x16,  # FOCCFG
+        0x6C,  # BSCFG
+        0x43,  # AGCCTRL2 - Panstamp
+        0x40,  # AGCCTRL1
+        0x91,  # AGCCTRL0
+        0x87,  # WOREVT1
+        0x6B,  # WOREVT0
+        0xFB,  # WORCTRL
+        0x56,  # FREND1
+        0x10,  # FREND0
+        0xE9,  # FSCAL3
+        0x2A,  # FSCAL2
+        0x00,  # FSCAL1
+        0x1F,  # FSCAL0
+        0x41,  # RCCTRL1
+        0x00,  # RCCTRL0
+        0x59,  # FSTEST
+        0x7F,  # PTEST
+        0x3F,  # AGCTEST
+        0x81,  # TEST2
+        0x35,  # TEST1
+        0x09,  # TEST0
+    )
+
+    def __init__(self, bus=0, device=0, speed=50000, debug=True, performance_mode=False, spi=None):
+        """
+        :param bus: SPI bus
+        :param device: SPI device (chip select)
+        :param speed: SPI clock in Hz (ignored in performance mode)
+        :param debug: print the driver log (see setLogHandler). Ignored in performance mode
+        :param performance_mode: SPI clock at MAX_SPI_SPEED and no logging
+        :param spi: already open spidev.SpiDev (or compatible, e.g. DummySpiDev) to be used instead of bus/device
+        """
+        self._registers = [None] * self.CONFIG_REGISTERS  # Shadow cache (None: unknown value)
+        self._log = None
+        self.spi_transfers = 0  # SPI transactions issued (register accesses, bursts and strobes)
+        self._rxMCSM2 = None  # MCSM2 restored when leaving Wake-on-Radio (RX_TIME set by configureWakeOnRadio)
+        if performance_mode:
+            speed = self.MAX_SPI_SPEED
+            debug = False
         try:
             self.debug = debug
-            self._spi = spidev.SpiDev()
-            self._spi.open(bus, device)
-            self._spi.max_speed_hz = speed
+            if spi is None:
+                import spidev  # Only needed (and installed) with the real radio
+                spi = spidev.SpiDev()
+                spi.open(bus, device)
+            self._spi = spi
+            self.setSpiSpeed(speed)
 
         except Exception as e:
             print(e)
 
+    @property
+    def debug(self):
+        return self._log is not None
+
+    @debug.setter
+    def debug(self, value):
+        self.setLogHandler(self._printLog if value else None)
+
+    def setLogHandler(self, handler):
+        """
+        Structured driver log. Disabled (no cost: messages are not even built) with None
+        :param handler: callable(event: str, fields: dict), or None
+        """
+        self._log = handler
+
+    @staticmethod
+    def _printLog(event, fields):
+        print("{} | {}".format(event, ", ".join("{} = {}".format(key, value) for key, value in fields.items())))
+
+    def setSpiSpeed(self, speed):
+        """
+        :param speed: SPI clock in Hz, limited to MAX_SPI_SPEED
+        """
+        self._spi.max_speed_hz = min(int(speed), self.MAX_SPI_SPEED)
+
+    def getSpiSpeed(self):
+        return self._spi.max_speed_hz
+
     @staticmethod
     def _usDelay(useconds):
         time.sleep(useconds / 1000000.0)
 
     def _writeSingleByte(self, address, byte_data):
+        if address < self.CONFIG_REGISTERS:
+            self._registers[address] = byte_data
+        self.spi_transfers += 1
         return self._spi.xfer([self.WRITE_SINGLE_BYTE | address, byte_data])
 
     def _readSingleByte(self, address):
+        self.spi_transfers += 1
         return self._spi.xfer([self.READ_SINGLE_BYTE | address, 0x00])[1]
 
-    def _readBurst(self, start_address, length):
-        buff = []
-        ret = []
+    def _readRegister(self, address):
+        # Configuration register value, from the shadow cache (read through SPI only the first time)
+        value = self._registers[address]
+        if value is None:
+            value = self._registers[address] = self._readSingleByte(address)
+        return value
+
+    def _updateRegister(self, address, mask, bits):
+        # Read-modify-write of the "mask" bits of a configuration register (the read comes from the cache)
+        self._writeSingleByte(address, (self._readRegister(address) & ~mask & 0xFF) | (bits & mask))
 
-        for x in range(length + 1):
-            addr = (start_address + (x * 8)) | self.READ_BURST
-            buff.append(addr)
+    def refreshRegisterCache(self):
+        """
+        Reads the whole configuration register file (one burst transfer) into the shadow cache
+        """
+        self._registers = list(self._readBurst(0x00, self.CONFIG_REGISTERS))
 
-        ret = self._spi.xfer(buff)[1:]
+    def invalidateRegisterCache(self):
+        self._registers = [None] * self.CONFIG_REGISTERS
 
-        if self.debug:
-            print("_readBurst | start_address = {:x}, length = {:x}".format(start_address, length))
+    def _readBurst(self, start_address, length):
+        self.spi_transfers += 1
+        ret = self._spi.xfer([start_address | self.READ_BURST] + [0x00] * length)[1:]
+
+        if self._log is not None:
+            self._log("_readBurst", {"start_address": hex(start_address), "length": length})
 
         return ret
 
     def _writeBurst(self, address, data):
+        if address < self.CONFIG_REGISTERS:
+            end = min(address + len(data), self.CONFIG_REGISTERS)
+            self._registers[address:end] = data[:end - address]
         data.insert(0, (self.WRITE_BURST | address))
+        self.spi_transfers += 1
 
         return self._spi.xfer(data)
 
     def reset(self):
+        self.invalidateRegisterCache()
+        self._rxMCSM2 = None
         return self._strobe(self.SRES)
 
     def _strobe(self, address):
+        self.spi_transfers += 1
         return self._spi.xfer([address, 0x00])
 
     def selfTest(self):
@@ -169,10 +309,9 @@ class TICC1101(object):
         assert part_number == 0x00
         assert component_version == 0x14
 
-        if self.debug:
-            print("Part Number: {:x}".format(part_number))
-            print("Component Version: {:x}".format(component_version))
-            print("Self test OK")
+        if self._log is not None:
+            self._log("selfTest", {"part_number": hex(part_number), "component_version": hex(component_version),
+                                   "result": "OK"})
 
     def sidle(self):
         self._strobe(self.SIDLE)
@@ -184,9 +323,67 @@ class TICC1101(object):
         self._usDelay(100)
 
     def powerDown(self):
+        """
+        Enters SLEEP. Left with wakeUp
+        """
         self.sidle()
+        self._cacheSleepLostRegisters()
         self._strobe(self.SPWD)
 
+    def configureWakeOnRadio(self, period, rx_time=3):
+        """
+        Wake-on-Radio timing: the radio sleeps and enters RX every "period" seconds, for a fraction
+        1 / 2 ** (rx_time + 3) of the period (longer if a sync word is found). Started with startWakeOnRadio
+        :param period: Event0 period (s), up to ~1.89s
+        :param rx_time: MCSM2.RX_TIME (0: 12.5% to 6: 0.195% RX duty cycle)
+        :return: actual period (s)
+        """
+        if not 0 <= rx_time <= self.WOR_MAX_RX_TIME:
+            raise ValueError("rx_time must be between 0 and {}".format(self.WOR_MAX_RX_TIME))
+        event0 = max(1, min(self.WOR_MAX_EVENT0, round(period * self.XOSC_FREQ / 750)))
+        self._writeBurst(self.WOREVT1, [event0 >> 8, event0 & 0xFF])
+        self._writeSingleByte(self.WORCTRL, 0x78)  # RC oscillator on, EVENT1 = 48 clocks, RC_CAL, WOR_RES = 0
+        if self._rxMCSM2 is None:  # Not reconfigured while in Wake-on-Radio
+            self._rxMCSM2 = self._readRegister(self.MCSM2)
+        self._updateRegister(self.MCSM2, 0x1F, rx_time)  # RX_TIME_RSSI and RX_TIME_QUAL off
+        if self._log is not None:
+            self._log("configureWakeOnRadio", {"event0": event0, "rx_time": rx_time})
+        return event0 * 750 / self.XOSC_FREQ
+
+    def getWakeOnRadioDutyCycle(self):
+        """
+        :return: configured RX duty cycle (0 to 1) in Wake-on-Radio
+        """
+        rx_time = self._readRegister(self.MCSM2) & 0x07
+        return 1 / 2 ** (rx_time + 3) if rx_time <= self.WOR_MAX_RX_TIME else 1.0
+
+    def startWakeOnRadio(self):
+        """
+        Enters Wake-on-Radio (configureWakeOnRadio). Packets are still received (GDO0 events), but the radio stays in
+        RX after them (MCSM1.RXOFF_MODE): call it again to go back to sleep. Left with wakeUp
+        """
+        self.sidle()
+        self._cacheSleepLostRegisters()
+        self._strobe(self.SWORRST)
+        self._strobe(self.SWOR)
+
+    def wakeUp(self):
+        """
+        Leaves SLEEP (powerDown) or Wake-on-Radio: goes to IDLE, rewrites the registers lost in SLEEP with their
+        configured values (one burst) and, after Wake-on-Radio, restores MCSM2 (no RX timeout in normal RX)
+        """
+        self.sidle()
+        self._writeBurst(self.FSTEST, [self._readRegister(address) for address in self.SLEEP_LOST_REGISTERS])
+        if self._rxMCSM2 is not None:
+            self._writeSingleByte(self.MCSM2, self._rxMCSM2)
+            self._rxMCSM2 = None
+
+    def _cacheSleepLostRegisters(self):
+        # Called while awake: unknown values are read before they are lost (otherwise, cached values are kept, as
+        # when Wake-on-Radio is re-entered after a packet)
+        for address in self.SLEEP_LOST_REGISTERS:
+            self._readRegister(address)
+
     def setCarrierFrequency(self, freq=433):
         # Register values extracted from SmartRF Studio 7
         if freq == 433:
@@ -282,97 +479,36 @@ class TICC1101(object):
         return bits
 
     def setDefaultValues(self, version=1):
-
-        # Default values extracted from Smart RF Studio 7
-
-        self._writeSingleByte(self.IOCFG2, 0x2E)    # Panstamp
-        self._writeSingleByte(self.IOCFG1, 0x2E)    # Panstamp
-        self._writeSingleByte(self.IOCFG0, 0x06)    # Panstamp
-        self._writeSingleByte(self.FIFOTHR, 0x07)   # Panstamp
-        self._writeSingleByte(self.PKTLEN, 0x3D)
-        self._writeSingleByte(self.PKTCTRL1, 0x06)  # Panstamp
-        self._writeSingleByte(self.PKTCTRL0, 0x05)  # Panstamp
-
-        self.setSyncWord()
-        self._writeSingleByte(self.ADDR, 0xFF)
-        #self.configureAddressFiltering()
-        self.setChannel()
-
-        self._writeSingleByte(self.FSCTRL1, 0x08)   # Panstamp
-        self._writeSingleByte(self.FSCTRL0, 0x00)   # Panstamp
-
-        self.setCarrierFrequency()
-
-        self._writeSingleByte(self.MDMCFG4, 0xCA)   # Panstamp
-        self._writeSingleByte(self.MDMCFG3, 0x83)   # Panstamp
-        self._writeSingleByte(self.MDMCFG2, 0x93)   # Panstamp
-        self._writeSingleByte(self.MDMCFG1, 0x22)
-        self._writeSingleByte(self.MDMCFG0, 0xF8)
-
-        self._writeSingleByte(self.DEVIATN, 0x35)   # Panstamp
-        self._writeSingleByte(self.MCSM2, 0x07)
-        self._writeSingleByte(self.MCSM1, 0x20)     # Panstamp
-        self._writeSingleByte(self.MCSM0, 0x18)
-        self._writeSingleByte(self.FOCCFG, 0x16)
-        self._writeSingleByte(self.BSCFG, 0x6C)
-        self._writeSingleByte(self.AGCCTRL2, 0x43)  # Panstamp
-        self._writeSingleByte(self.AGCCTRL1, 0x40)
-        self._writeSingleByte(self.AGCCTRL0, 0x91)
-        self._writeSingleByte(self.WOREVT1, 0x87)
-        self._writeSingleByte(self.WOREVT0, 0x6B)
-        self._writeSingleByte(self.WORCTRL, 0xFB)
-        self._writeSingleByte(self.FREND1, 0x56)
-        self._writeSingleByte(self.FREND0, 0x10)
-        self._writeSingleByte(self.FSCAL3, 0xE9)
-        self._writeSingleByte(self.FSCAL2, 0x2A)
-        self._writeSingleByte(self.FSCAL1, 0x00)
-        self._writeSingleByte(self.FSCAL0, 0x1F)
-        self._writeSingleByte(self.RCCTRL1, 0x41)
-        self._writeSingleByte(self.RCCTRL0, 0x00)
-        self._writeSingleByte(self.FSTEST, 0x59)
-        self._writeSingleByte(self.PTEST, 0x7F)
-        self._writeSingleByte(self.AGCTEST, 0x3F)
-        self._writeSingleByte(self.TEST2, 0x81)
-        self._writeSingleByte(self.TEST1, 0x35)
-        self._writeSingleByte(self.TEST0, 0x09)
+        # Whole configuration register file in a single burst transfer
+        self._writeBurst(self.IOCFG2, list(self.DEFAULT_REGISTERS))
         self._writeSingleByte(0x3E, 0xC0)           # Power 10dBm
 
     def setSyncMode(self, syncmode):
-        regVal = list(self.getRegisterConfiguration("MDMCFG2"))
-
         if syncmode > 7:
             raise Exception("Invalid SYNC mode")
 
-        regVal[5:] = bin(syncmode)[2:].zfill(3)
-
-        regVal = int("".join(regVal), 2)
-        self._writeSingleByte(self.MDMCFG2, regVal)
+        self._updateRegister(self.MDMCFG2, 0x07, syncmode)  # SYNC_MODE[2:0]
 
     def setModulation(self, modulation):
-        regVal = list(self.getRegisterConfiguration("MDMCFG2"))
-
         if modulation == "2-FSK":
-            modVal = "000"
+            modVal = 0b000
 
         elif modulation == "GFSK":
-            modVal = "001"
+            modVal = 0b001
 
         elif modulation == "ASK" or modulation == "OOK":
-            modVal = "011"
+            modVal = 0b011
 
         elif modulation == "4-FSK":
-            modVal = "100"
+            modVal = 0b100
 
         elif modulation == "MSK":
-            modVal = "111"
+            modVal = 0b111
 
         else:
             raise Exception("Modulation type NOT SUPPORTED!")
 
-        regVal[1:4] = modVal
-
-        regVal = int("".join(regVal), 2)
-        self._writeSingleByte(self.MDMCFG2, regVal)
+        self._updateRegister(self.MDMCFG2, 0x70, modVal << 4)  # MOD_FORMAT[2:0]
 
     def _flushRXFifo(self):
         self._strobe(self.SFRX)
@@ -400,119 +536,137 @@ class TICC1101(object):
         return (self._readSingleByte(self.MARCSTATE) & 0x1F)
 
     def getPacketConfigurationMode(self):
-        pktCtrlVal = self.getRegisterConfiguration("PKTCTRL0", False)
-
-        if pktCtrlVal[6:] == "00": # Packet len is fixed
-            return "PKT_LEN_FIXED"
+        return self.PACKET_MODES[self._readRegister(self.PKTCTRL0) & 0x03]  # LENGTH_CONFIG[1:0]
 
-        elif pktCtrlVal[6:] == "01": # Packet len is variable
-            return "PKT_LEN_VARIABLE"
+    def _isAddressCheckEnabled(self):
+        return (self._readRegister(self.PKTCTRL1) & 0x03) != 0  # ADR_CHK[1:0]
 
-        elif pktCtrlVal[6:] == "10":  # Infinite packet len mode
-            return "PKT_LEN_INFINITE"
+    def _isAppendStatusEnabled(self):
+        return (self._readRegister(self.PKTCTRL1) & 0x04) != 0  # APPEND_STATUS
 
     def setPacketMode(self, mode="PKT_LEN_VARIABLE"):
-        regVal = list(self.getRegisterConfiguration("PKTCTRL0", False))
-
-        if mode == "PKT_LEN_FIXED":
-            val = "00"
-
-        elif mode == "PKT_LEN_VARIABLE":
-            val = "01"
-
-        elif mode == "PKT_LEN_INFINITE":
-            val = "10"
-
-        else:
+        if mode not in self.PACKET_MODES[:3]:
             raise Exception("Packet mode NOT SUPPORTED!")
 
-        regVal[6:] = val
-        regVal = int("".join(regVal), 2)
-        self._writeSingleByte(self.PKTCTRL0, regVal)
+        self._updateRegister(self.PKTCTRL0, 0x03, self.PACKET_MODES.index(mode))
 
     def setFilteringAddress(self, address=0x0E):
         self._writeSingleByte(self.ADDR, address)
 
     def configureAddressFiltering(self, value="DISABLED"):
-        regVal = list(self.getRegisterConfiguration("PKTCTRL1", False))
-
         if value == "DISABLED":
-            val = "00"
+            val = 0b00
 
         elif value == "ENABLED_NO_BROADCAST":
-            val = "01"
+            val = 0b01
 
         elif value == "ENABLED_00_BROADCAST":
-            val = "10"
+            val = 0b10
 
         elif value == "ENABLED_00_255_BROADCAST":
-            val = "11"
+            val = 0b11
 
         else:
             raise Exception("Address filtering configuration NOT SUPPORTED!")
 
-        regVal[6:] = val
-
-        regVal = int("".join(regVal), 2)
-        self._writeSingleByte(self.PKTCTRL1, regVal)
-
-    def sendData(self, dataBytes):
-        self._setRXState()
-        marcstate = self._getMRStateMachineState()
-        dataToSend = []
-
-        while ((marcstate & 0x1F) != 0x0D):
-            if self.debug:
-                print("marcstate = %x".format(marcstate))
-                print("waiting for marcstate == 0x0D")
-
-            if marcstate == 0x11:
-                self._flushRXFifo()
-
-            marcstate = self._getMRStateMachineState()
+        self._updateRegister(self.PKTCTRL1, 0x03, val)  # ADR_CHK[1:0]
 
+    def _buildPacket(self, dataBytes):
+        # TX FIFO contents (length/address bytes + payload + padding) for the current packet configuration.
+        # None if the data cannot be sent
         if len(dataBytes) == 0:
-            if self.debug:
-                print("sendData | No data to send")
-            return False
+            if self._log is not None:
+                self._log("_buildPacket", {"error": "No data to send"})
+            return None
 
+        dataToSend = []
         sending_mode = self.getPacketConfigurationMode()
         data_len = len(dataBytes)
 
         if sending_mode == "PKT_LEN_FIXED":
-            if data_len > self._readSingleByte(self.PKTLEN):
-                if self.debug:
-                    print("Len of data exceeds the configured packet len")
-                return False
+            if data_len > self._readRegister(self.PKTLEN):
+                if self._log is not None:
+                    self._log("_buildPacket", {"error": "Len of data exceeds the configured packet len",
+                                               "data_len": data_len})
+                return None
 
-            if self.getRegisterConfiguration("PKTCTRL1", False)[6:] != "00":
-                dataToSend.append(self._readSingleByte(self.ADDR))
+            if self._isAddressCheckEnabled():
+                dataToSend.append(self._readRegister(self.ADDR))
 
             dataToSend.extend(dataBytes)
-            dataToSend.extend([0] * (self._readSingleByte(self.PKTLEN) - len(dataToSend)))
+            dataToSend.extend([0] * (self._readRegister(self.PKTLEN) - len(dataToSend)))
 
-            if self.debug:
-                print("Sending a fixed len packet")
-                print("data len = %d".format((data_len)))
+            if self._log is not None:
+                self._log("_buildPacket", {"mode": sending_mode, "data_len": data_len})
 
         elif sending_mode == "PKT_LEN_VARIABLE":
             dataToSend.append(data_len)
 
-            if self.getRegisterConfiguration("PKTCTRL1", False)[6:] != "00":
-                dataToSend.append(self._readSingleByte(self.ADDR))
+            if self._isAddressCheckEnabled():
+                dataToSend.append(self._readRegister(self.ADDR))
                 dataToSend[0] += 1
 
             dataToSend.extend(dataBytes)
 
-            if self.debug:
-                print("Sending a variable len packet")
-                print("Length of the packet is: %d".format(data_len))
+            if self._log is not None:
+                self._log("_buildPacket", {"mode": sending_mode, "data_len": data_len})
 
         elif sending_mode == "PKT_LEN_INFINITE":
             # ToDo
             raise Exception("MODE NOT IMPLEMENTED")
 
-        print("{}".format(dataToSend))
+        if self._log is not None:
+            self._log("_buildPacket", {"data": list(dataToSend)})
+        return dataToSend
+
+    def startTransmission(self, dataBytes):
+        """
+        Non-blocking transmission: loads the TX FIFO and strobes STX (if CCA is enabled, the radio only enters TX
+        once the channel is clear). The caller polls getTxStatus until the packet is gone
+        :return: False if the data cannot be sent
+        """
+        dataToSend = self._buildPacket(dataBytes)
+        if dataToSend is None:
+            return False
+        if self._readSingleByte(self.TXBYTES):  # Leftovers from a failed transmission
+            self.sidle()  # SFTX is only accepted in IDLE
+            self._flushTXFifo()
+        self._writeBurst(self.TXFIFO, dataToSend)
+        self._setTXState()
+        return True
+
+    def getTxStatus(self):
+        """
+        :return: (MARCSTATE, bytes left in the TX FIFO, TX FIFO underflow)
+        """
+        tx_bytes = self._readSingleByte(self.TXBYTES)
+        return self._getMRStateMachineState(), tx_bytes & 0x7F, bool(tx_bytes & 0x80)
+
+    def abortTransmission(self):
+        """
+        Exits TX, flushes the TX FIFO and goes back to RX
+        """
+        self.sidle()
+        self._flushTXFifo()
+        self._setRXState()
+
+    def sendData(self, dataBytes):
+        self._setRXState()
+        marcstate = self._getMRStateMachineState()
+
+        while ((marcstate & 0x1F) != 0x0D):
+            if self._log is not None:
+                self._log("sendData", {"marcstate": hex(marcstate), "waiting_for": hex(0x0D)})
+
+            if marcstate == 0x11:
+                self._flushRXFifo()
+
+            marcstate = self._getMRStateMachineState()
+
+        dataToSend = self._buildPacket(dataBytes)
+        if dataToSend is None:
+            return False
+
         self._writeBurst(self.TXFIFO, dataToSend)
         self._usDelay(2000)
         self._setTXState()
@@ -523,9 +677,8 @@ class TICC1101(object):
             self._flushTXFifo()
             self._setRXState()
 
-            if self.debug:
-                print("senData | FAIL")
-                print("sendData | MARCSTATE: %x".format(self._readSingleByte(self.MARCSTATE)))
+            if self._log is not None:
+                self._log("sendData", {"error": "FAIL", "marcstate": hex(self._readSingleByte(self.MARCSTATE))})
 
             return False
 
@@ -533,24 +686,23 @@ class TICC1101(object):
         while remaining_bytes != 0:
             self._usDelay(1000)
             remaining_bytes = self._readSingleByte(self.TXBYTES) & 0x7F
-            if self.debug:
-                print("Waiting until all bytes are transmited, remaining bytes: %d".format(remaining_bytes))
+            if self._log is not None:
+                self._log("sendData", {"remaining_bytes": remaining_bytes})
 
 
         if (self._readSingleByte(self.TXBYTES) & 0x7F) == 0:
-            if self.debug:
-                print("Packet sent!")
+            if self._log is not None:
+                self._log("sendData", {"result": "Packet sent!"})
 
             return True
 
         else:
-            if self.debug:
-                print("{}".format(self._readSingleByte(self.TXBYTES) & 0x7F))
-                print("sendData | MARCSTATE: %x".format(self._getMRStateMachineState()))
-                self.sidle()
-                self._flushTXFifo()
-                time.sleep(5)
-                self._setRXState()
+            if self._log is not None:
+                self._log("sendData", {"error": "FAIL", "remaining_bytes": self._readSingleByte(self.TXBYTES) & 0x7F,
+                                       "marcstate": hex(self._getMRStateMachineState())})
+            self.sidle()
+            self._flushTXFifo()
+            self._setRXState()
 
             return False
 
@@ -565,6 +717,16 @@ class TICC1101(object):
         return 0x3F - lqi_raw
 
     def recvData(self):
+        packet = self.recvPacket()
+        return packet[0] if packet else packet
+
+    def recvPacket(self):
+        """
+        Reads one packet from the RX FIFO, with its appended status bytes (if PKTCTRL1.APPEND_STATUS is set)
+        :return: (data, rssi in dBm, raw LQI (0-127), CRC OK, address) - rssi and LQI are None without status bytes,
+                 address (destination address byte, removed from data) is None without address check.
+                 None if the RX FIFO is empty or has overflowed, False if the packet length is invalid
+        """
         rx_bytes_val = self._readSingleByte(self.RXBYTES)
 
         # if rx_bytes_val has something and Underflow bit is not 1
@@ -572,44 +734,232 @@ class TICC1101(object):
             sending_mode = self.getPacketConfigurationMode()
 
             if sending_mode == "PKT_LEN_FIXED":
-                data_len = self._readSingleByte(self.PKTLEN)
+                data_len = self._readRegister(self.PKTLEN)
 
             elif sending_mode == "PKT_LEN_VARIABLE":
-                max_len = self._readSingleByte(self.PKTLEN)
+                max_len = self._readRegister(self.PKTLEN)
                 data_len = self._readSingleByte(self.RXFIFO)
 
                 if data_len > max_len:
-                    # if self.debug:
-                        # print("Len of data exceeds the configured maximum packet len")
+                    if self._log is not None:
+                        self._log("recvPacket", {"error": "Len of data exceeds the configured maximum packet len",
+                                                 "data_len": data_len})
                     return False
 
-                #if self.debug:
-                #    print("Receiving a variable len packet")
-                #    print("max len: {}".format(max_len))
-                #    print("Packet length: {}".format(data_len))
-
             elif sending_mode == "PKT_LEN_INFINITE":
                 # ToDo
                 raise Exception("MODE NOT IMPLEMENTED")
 
-            data = self._readBurst(self.RXFIFO, data_len)
-            #valPktCtrl1 = self.getRegisterConfiguration("PKTCTRL1", False)
-
-            #if valPktCtrl1[5] == "1":  # PKTCTRL1[5] == APPEND_STATUS
-                # When enabled, two status bytes will be appended to the payload of the
-                # packet. The status bytes contain RSSI and LQI values, as well as CRC OK.
-
-            #    rssi = self._readSingleByte(self.RXFIFO)
-            #    val = self._readSingleByte(self.RXFIFO)
-            #    lqi = val & 0x7f
-
-            #if self.debug and valPktCtrl1[5] == "1":
-            #    print("Packet information is enabled")
-            #    print("RSSI (Rx FIFO): {} dBm".format(self._getRSSI(rssi)))
-            #    print("LQI: {}".format(self._getLQI(lqi)))
-
-            # print(''.join([chr(code) for code in data]))
-            rssi = self._readSingleByte(self.RXFIFO)
-            print("RSSI (Rx FIFO): {} dBm".format(self._getRSSI(rssi)))
-            self._flushRXFifo()
-            return data
+            # When enabled, two status bytes are appended to the payload of the packet: RSSI, and CRC_OK + LQI.
+            # Read in the same burst as the payload
+            if self._isAppendStatusEnabled():
+                data = self._readBurst(self.RXFIFO, data_len + 2)
+                status = data[-1]
+                rssi, lqi, crc_ok = self._getRSSI(data[-2]), status & 0x7F, bool(status & 0x80)
+                del data[-2:]
+            else:
+                data = self._readBurst(self.RXFIFO, data_len)
+                rssi, lqi, crc_ok = None, None, True
+
+            address = None
+            if self._isAddressCheckEnabled() and data:
+                address = data.pop(0)
+            return data, rssi, lqi, crc_ok, address
+
+
+class DummySpiDev:
+    """
+    spidev.SpiDev replacement simulating a CC1101 (no hardware needed): configuration registers, PATABLE, RX/TX
+    FIFOs, status registers, command strobes and the main radio state machine (simplified: transitions are
+    immediate). Packets are injected into the RX FIFO with inject_packet (also received in Wake-on-Radio, as if they
+    arrived during an RX window), transmitted ones are kept in "transmitted".
+    Transfers and bytes are counted (throughput and bus time estimations)
+    """
+    FIFO_SIZE = 64
+    # MARCSTATE values
+    STATE_SLEEP = 0x00
+    STATE_IDLE = 0x01
+    STATE_FSTXON = 0x12
+    STATE_RX = 0x0D
+    STATE_RXFIFO_OVERFLOW = 0x11
+    STATE_TX = 0x13
+    SLEEP_RESET_VALUES = (0x59, 0x7F, 0x3F, 0x88, 0x31, 0x0B)  # FSTEST to TEST0 after SLEEP (chip reset values)
+
+    def __init__(self):
+        self.max_speed_hz = 500000
+        self.mode = 0
+        self.registers = list(TICC1101.DEFAULT_REGISTERS)
+        self.patable = [0x00] * 8
+        self.rx_fifo = bytearray()
+        self.tx_fifo = bytearray()
+        self.state = self.STATE_IDLE
+        self.rssi = -100  # dBm, channel RSSI (RSSI status register)
+        self.transmitted = []  # Transmitted TX FIFO contents (bytes)
+        self.transfers = 0
+        self.bytes_transferred = 0
+        self._tx_pending = False  # STX received: MARCSTATE reads TX once, then the TXOFF_MODE state
+        self.wake_on_radio = False  # SWOR received (left with SIDLE)
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def inject_packet(self, payload, rssi=-60, lqi=20, crc_ok=True, address=None):
+        """
+        Simulates the reception of a packet (only while in RX), formatted according to the current configuration
+        :param payload: packet payload (bytes or list of ints)
+        :param rssi: dBm
+        :param lqi: 0-127
+        :param crc_ok: CRC check result
+        :param address: destination address byte, sent if address checking is enabled (ADDR register by default).
+                        Packets not passing the address check are ignored
+        """
+        if self.wake_on_radio and self.state == self.STATE_SLEEP:
+            self.state = self.STATE_RX
+        if self.state != self.STATE_RX:
+            return
+        packet = bytearray()
+        address_check = self.registers[TICC1101.PKTCTRL1] & 0x03
+        if address_check:
+            address = self.registers[TICC1101.ADDR] if address is None else address
+            accepted = (address == self.registers[TICC1101.ADDR] or (address_check >= 2 and address == 0x00)
+                        or (address_check == 3 and address == 0xFF))
+            if not accepted:
+                return
+            payload = bytes([address]) + bytes(payload)
+        if self.registers[TICC1101.PKTCTRL0] & 0x03 == 0x01:  # Variable length
+            packet.append(len(payload))
+        packet += bytes(payload)
+        if self.registers[TICC1101.PKTCTRL1] & 0x04:  # APPEND_STATUS
+            rssi_raw = int((rssi + 74) * 2) & 0xFF
+            packet += bytes([rssi_raw, (0x80 if crc_ok else 0x00) | (lqi & 0x7F)])
+        if len(self.rx_fifo) + len(packet) > self.FIFO_SIZE:
+            self.state = self.STATE_RXFIFO_OVERFLOW
+            packet = packet[:self.FIFO_SIZE - len(self.rx_fifo)]
+        self.rx_fifo += packet
+        if self.state == self.STATE_RX and self.registers[TICC1101.MCSM1] & 0x0C != 0x0C:  # RXOFF_MODE != RX
+            self.state = self.STATE_IDLE
+
+    def xfer(self, data):
+        self.transfers += 1
+        self.bytes_transferred += len(data)
+        header = data[0]
+        is_read = header & TICC1101.READ_SINGLE_BYTE
+        is_burst = header & TICC1101.WRITE_BURST
+        address = header & 0x3F
+        response = [0x00]  # Chip status byte (not simulated)
+        if address < TICC1101.CONFIG_REGISTERS:
+            count = len(data) - 1 if is_burst else 1
+            if is_read:
+                response += [self.registers[(address + i) % TICC1101.CONFIG_REGISTERS] for i in range(count)]
+            else:
+                for i, value in enumerate(data[1:1 + count]):
+                    self.registers[(address + i) % TICC1101.CONFIG_REGISTERS] = value
+                response += [0] * (len(data) - 1)
+        elif address < TICC1101.PATABLE:
+            if is_read and is_burst:  # Status register
+                response.append(self._statusRegister(header))
+            else:
+                self._commandStrobe(address)
+                response += [0] * (len(data) - 1)
+        elif address == TICC1101.PATABLE:
+            if is_read:
+                response += self.patable[:len(data) - 1]
+            else:
+                self.patable[:len(data) - 1] = data[1:]
+                response += [0] * (len(data) - 1)
+        else:  # FIFOs
+            if is_read:
+                count = len(data) - 1
+                response += list(self.rx_fifo[:count]) + [0] * max(0, count - len(self.rx_fifo))
+                del self.rx_fifo[:count]
+            else:
+                self.tx_fifo += bytes(data[1:])
+        return response
+
+    xfer2 = xfer
+
+    def _statusRegister(self, address):
+        if address == TICC1101.PARTNUM:
+            return 0x00
+        elif address == TICC1101.VERSION:
+            return 0x14
+        elif address == TICC1101.RSSI:
+            return int((self.rssi + 74) * 2) & 0xFF
+        elif address == TICC1101.MARCSTATE:
+            if self._tx_pending:
+                self._tx_pending = False
+                state = self.state
+                self.state = (self.STATE_IDLE, self.STATE_FSTXON, self.STATE_TX,
+                              self.STATE_RX)[self.registers[TICC1101.MCSM1] & 0x03]  # TXOFF_MODE
+                return state
+            if (self.state == self.STATE_RX and not self.wake_on_radio and not self.rx_fifo
+                    and self.registers[TICC1101.MCSM2] & 0x07 != 0x07):
+                self.state = self.STATE_IDLE  # MCSM2.RX_TIME: sync word search timed out
+            return self.state
+        elif address == TICC1101.TXBYTES:
+            return len(self.tx_fifo)
+        elif address == TICC1101.RXBYTES:
+            return len(self.rx_fifo) | (0x80 if self.state == self.STATE_RXFIFO_OVERFLOW else 0x00)
+        return 0x00
+
+    def _commandStrobe(self, address):
+        if address == TICC1101.SRES:
+            self.registers = list(TICC1101.DEFAULT_REGISTERS)
+            self.rx_fifo.clear()
+            self.tx_fifo.clear()
+            self.state = self.STATE_IDLE
+            self.wake_on_radio = False
+        elif address == TICC1101.SIDLE:
+            self.state = self.STATE_IDLE
+            self.wake_on_radio = False
+        elif address == TICC1101.SRX:
+            self.state = self.STATE_RX
+        elif address == TICC1101.STX:
+            if self.tx_fifo:  # One packet is sent, any bytes after it stay in the TX FIFO
+                if self.registers[TICC1101.PKTCTRL0] & 0x03 == 0x01:  # Variable length
+                    length = 1 + self.tx_fifo[0]
+                else:
+                    length = self.registers[TICC1101.PKTLEN]
+                self.transmitted.append(bytes(self.tx_fifo[:length]))
+                del self.tx_fifo[:length]
+            self.state = self.STATE_TX
+            self._tx_pending = True
+        elif address == TICC1101.SFRX:
+            self.rx_fifo.clear()
+            if self.state == self.STATE_RXFIFO_OVERFLOW:
+                self.state = self.STATE_IDLE
+        elif address == TICC1101.SFTX:
+            self.tx_fifo.clear()
+        elif address in (TICC1101.SPWD, TICC1101.SWOR):
+            self.state = self.STATE_SLEEP
+            self.wake_on_radio = address == TICC1101.SWOR
+            self.registers[TICC1101.FSTEST:TICC1101.TEST0 + 1] = self.SLEEP_RESET_VALUES
+
+
+if __name__ == "__main__":
+    # Simulated radio (no hardware needed): Wake-on-Radio round trip, then back to continuous RX
+    spi = DummySpiDev()
+    radio = TICC1101(debug=False, performance_mode=True, spi=spi)
+    radio.reset()
+    radio.setDefaultValues()
+    radio._writeSingleByte(radio.TEST2, 0x88)  # Configured (non-default) value, must survive the sleep
+    configured = list(spi.registers)
+    radio._setRXState()
+
+    period = radio.configureWakeOnRadio(0.5, 3)
+    radio.startWakeOnRadio()
+    print(f"Wake-on-Radio: period {period * 1000:.1f}ms, RX duty cycle {radio.getWakeOnRadioDutyCycle():.2%}, "
+          f"state {hex(spi.state)}")
+    spi.inject_packet(b"WAKE")
+    print(f"Packet received in Wake-on-Radio: {radio.recvPacket()}")
+    radio.startWakeOnRadio()  # Back to sleep after the packet
+
+    radio.wakeUp()
+    radio._setRXState()
+    lost = [hex(address) for address, value in enumerate(configured) if spi.registers[address] != value
+            and address not in (radio.WOREVT1, radio.WOREVT0, radio.WORCTRL)]
+    print(f"Registers differing from the configuration after wakeUp: {lost or 'none'}")
+    print(f"Continuous RX after Wake-on-Radio: {'OK' if radio._getMRStateMachineState() == spi.STATE_RX else 'FAILED'}")
@@ -2,6 +2,7 @@ from systems.event_source import AsyncEventSource
 from systems.ads1015 import ADS1015
 from gpiozero import DigitalInputDevice
 from systems.event_source import BaseEventArgs
+from systems.history import RingBuffer
 import smbus
 import trio
 
@@ -23,11 +24,14 @@ class RadioDetection(AsyncEventSource):
     _VOLTAGE_REFERENCE = 1.75     # 1.8V is the ideal value. 1.75V is closer to reality @ 874MHz
     # Values > _VOLTAGE_REFERENCE_THRESHOLD are assumed to represent the reference voltage, not a phase difference
     _VOLTAGE_REFERENCE_THRESHOLD = _VOLTAGE_REFERENCE - (_VOLTAGE_REFERENCE - _MAX_EXPECTED_VOLTAGE)/2
+    # Spans used to normalize the deviation from _VOLTAGE_CENTER onto [-1, 1]
+    _VOLTAGE_L_SPAN = _MAX_EXPECTED_VOLTAGE - _VOLTAGE_CENTER
+    _VOLTAGE_R_SPAN = _VOLTAGE_CENTER
     # _CONFIDENCE_THRESHOLD_TURN = 0.12
     _CONFIDENCE_THRESHOLD_TURN = 0.12
     _CONFIDENCE_THRESHOLD_FORWARD = 0.05
 
-    _FIFO_STACK_LENGTH = 5
+    _AVERAGE_SAMPLES = 5
 
     def __init__(self, adc: ADS1015, nursery: trio.Nursery, notification_callbacks=None, error_callbacks=None):
         """
@@ -40,7 +44,7 @@ class RadioDetection(AsyncEventSource):
         self._adc_polling_period = 1/self._adc_polling_rate
         self._adc = adc  # type: ADS1015
         self._is_running = False
-        self._fifo_stack = [0]*self._FIFO_STACK_LENGTH
+        self._samples = RingBuffer(self._AVERAGE_SAMPLES)  # type: RingBuffer
         super().__init__(nursery, notification_callbacks, error_callbacks)
 
     async def a_run_notification_loop(self):
@@ -51,11 +55,11 @@ class RadioDetection(AsyncEventSource):
         while self._is_running:
             await trio.sleep(self._adc_polling_period)
             voltage = self._adc.read_continuous()
-            self._fifo_stack[1:len(self._fifo_stack)] = self._fifo_stack[0:len(self._fifo_stack)-1]
-            self._fifo_stack[0] = voltage
-            if counter % self._FIFO_STACK_LENGTH == 0:
+            self._samples.append(voltage, trio.current_time())
+            if counter % self._AVERAGE_SAMPLES == 0:
                 angle, confidence = self.get_angle_sign()
-                await self.raise_event(BeaconDirectionEventArgs(self.TURN_DIRECTION_EVENT, angle, confidence))
+                offset = self.get_angle_offset()
+                await self.raise_event(BeaconDirectionEventArgs(self.TURN_DIRECTION_EVENT, angle, confidence, offset))
             counter += 1
 
     def stop_notification_loop(self):
@@ -71,7 +75,9 @@ class RadioDetection(AsyncEventSource):
         """
         # Assumption: 90deg phase line placed after LEFT antenna
         # Therefore: Voltage > _VOLTAGE_CENTER  ->  Need to turn "left" (counter-clockwise)
-        voltage = sum(self._fifo_stack) / len(self._fifo_stack)
+        voltage = self._samples.mean()
+        if voltage is None:  # No samples yet
+            return None, False
         print(f"Voltage: {voltage}")
         #return voltage, True  # For debugging only
 
@@ -87,6 +93,21 @@ class RadioDetection(AsyncEventSource):
             confidence = min(voltage - self._VOLTAGE_R_THRESHOLD, self._VOLTAGE_L_THRESHOLD - voltage) > self._CONFIDENCE_THRESHOLD_FORWARD
             return 0, confidence
 
+    def get_angle_offset(self):
+        """
+        Continuous version of get_angle_sign: normalized deviation from the "straight ahead" voltage.
+        Returns None if no proper beacon signal is detected
+        :return: value between -1 (beacon fully clockwise) and +1 (beacon fully counter-clockwise)
+        """
+        voltage = self._samples.mean()
+        if voltage is None or voltage > self._MAX_EXPECTED_VOLTAGE:
+            return None
+        if voltage > self._VOLTAGE_CENTER:
+            offset = (voltage - self._VOLTAGE_CENTER) / self._VOLTAGE_L_SPAN
+        else:
+            offset = (voltage - self._VOLTAGE_CENTER) / self._VOLTAGE_R_SPAN
+        return max(-1, min(offset, 1))
+
 
 class DummyRadioDetection(AsyncEventSource):
     def __init__(self, adc: ADS1015, nursery: trio.Nursery, notification_callbacks=None, error_callbacks=None):
@@ -99,7 +120,7 @@ class DummyRadioDetection(AsyncEventSource):
         self._is_running = True
         while self._is_running:
             await trio.sleep(0.5)
-            await self.raise_event(BeaconDirectionEventArgs(RadioDetection.TURN_DIRECTION_EVENT, 0, True))
+            await self.raise_event(BeaconDirectionEventArgs(RadioDetection.TURN_DIRECTION_EVENT, 0, True, 0))
 
     def stop_notification_loop(self):
         self._is_running = False
@@ -107,17 +128,22 @@ class DummyRadioDetection(AsyncEventSource):
     def get_angle_sign(self):
         return 0, True
 
+    def get_angle_offset(self):
+        return 0
+
 
 class BeaconDirectionEventArgs(BaseEventArgs):
-    def __init__(self, event_type: str, angle_sign: float, is_confident: bool):
+    def __init__(self, event_type: str, angle_sign: float, is_confident: bool, offset: float = None):
         """
         :param event_type: event identifier
         :param angle_sign: +1, -1, 0 or None
         :param confidence: Ideally, between 0 and 1
+        :param offset: normalized angle offset, between -1 and +1 (None if no beacon is detected)
         """
         super().__init__(event_type)
         self.angle_sign = angle_sign  # type: float
         self.is_confident = is_confident  # type: bool
+        self.offset = offset  # type: float
 
 
 if __name__ == "__main__":
@@ -128,7 +154,7 @@ if __name__ == "__main__":
     COUNTER = 0
 
     async def process_data(source, param):
-        print(f"## {param.angle_sign} ##\t## {param.is_confident}")
+        print(f"## {param.angle_sign} ##\t## {param.is_confident} ##\t## {param.offset}")
 
 
     async def parent():
@@ -1,9 +1,14 @@
 from systems.event_source import AsyncEventSource, BaseEventArgs
 from systems.pycc1101 import TICC1101
+from systems.telemetry import TelemetryStore, TelemetrySnapshot
+from systems.history import RingBuffer
+from systems.packets import Packet, PacketBuffer
+from systems.transmitter import Transmitter
+from systems.beacons import BeaconRegistry
+from systems.rssi_filter import RSSIFilter
 from gpiozero import DigitalInputDevice
-from threading import Lock
 import trio
-import datetime
+import time
 
 '''
     Pinout Connection:
@@ -51,19 +56,79 @@ STATE_DICT = {
 
 
 class ReceptorSystem(AsyncEventSource):
+    """
+    CC1101 receiver: RSSI polling, and packet reception driven by the GDO0 line.
+    GDO0 is deasserted at the end of every received packet. The gpiozero callback thread only timestamps that edge
+    and hands it over to the Trio loop (no SPI access there), where a drain task reads one packet per notification
+    (SPI in a worker thread, serialized with the RSSI polls) and raises a PACKET_EVENT for each of them.
+    The radio stays in RX after a packet (MCSM1.RXOFF_MODE), so it does not miss the following ones while the
+    previous one is being read.
+    Received packets are kept in a PacketBuffer, with their RSSI, LQI and CRC status. The periodic RSSI value comes
+    from the packets received during the period; the RSSI register is only polled when there were none.
+    Every transmitter is tracked in a BeaconRegistry (beacons, keyed by the ID in their packets). The periodic "rssi"
+    value follows the target beacon ("beacon" field: selected beacon, or strongest one), so the control system
+    follows a single transmitter among many. It is estimated by an RSSIFilter fed with every packet of the target
+    (and with the RSSI register polls while no beacon is heard), and published with its confidence
+    ("rssi_confidence").
+    Packets are sent through "transmitter" (asynchronous TX queue sharing the SPI lock). After every packet the radio
+    returns to RX by itself (MCSM1.TXOFF_MODE).
+    The RSSI event period depends on the polling profile (set_polling_profile), chosen from the operating mode. In the
+    WOR profile the CC1101 is put in Wake-on-Radio (it sleeps, listening for packets a fraction of the time) and the
+    RSSI register is never polled, since every SPI access would wake it up: only packets update the RSSI. The
+    receiver duty cycle and the SPI transactions are counted (rx_duty_cycle, spi_transfers).
+    """
     CARRIER_FREQ = 868
     SPI_BUS = 0
     SPI_MOSI_PIN = 10
     SPI_MISO_PIN = 9
     SPI_SCLK_PIN = 11
+    SPI_PERFORMANCE_MODE = True  # SPI at TICC1101.MAX_SPI_SPEED, no driver logging
 
     RSSI_EVENT = "RSSI_EVENT"
+    PACKET_EVENT = "PACKET_EVENT"
+    RSSI_HISTORY_LENGTH = 120  # RSSI samples kept (1 min at the 0.5s period of the NORMAL profile)
+    # Packet notifications waiting to be drained. The 64 byte RX FIFO holds at most 16 (minimum size) packets, so
+    # the FIFO overflows long before this queue does
+    PACKET_QUEUE_SIZE = 32
+    PACKET_BUFFER_SIZE = 256
+    # RSSI polling profiles (set_polling_profile) and their RSSI event periods (s)
+    POLLING_FAST = "FAST"  # Following a beacon
+    POLLING_NORMAL = "NORMAL"  # Searching for a beacon
+    POLLING_SLOW = "SLOW"  # RSSI not used (idle, manual control...)
+    POLLING_WOR = "WOR"  # Battery saver: radio in Wake-on-Radio
+    POLLING_PERIODS = {POLLING_FAST: 0.1, POLLING_NORMAL: 0.5, POLLING_SLOW: 2, POLLING_WOR: 5}
+    # Wake-on-Radio: RX window every WOR_PERIOD seconds, 1 / 2 ** (WOR_RX_TIME + 3) of it long (1.6%). The beacons
+    # must send often (or with long preambles) to be heard
+    WOR_PERIOD = 1  # s
+    WOR_RX_TIME = 3
+    BEACON_STALE_TIME = 5  # s without packets before a beacon is forgotten
+    # Own address for the CC1101 address check (packets sent to other addresses are discarded by the radio, 0x00 and
+    # 0xFF are broadcast addresses). None: address check disabled
+    ADDRESS = None
+    MCSM1_VALUE = 0x2F  # CCA_MODE: clear unless currently receiving a packet, RXOFF_MODE: stay in RX, TXOFF_MODE: RX
 
     def __init__(self, interrupt_pin, device_num: int, nursery, data=None, notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
-        self._data = data if data is not None else {'rssi': None, 'message': None}
-        self._last_message = None
-        self._last_message_lock = Lock()
+        self._data = data if data is not None else TelemetryStore(['rssi', 'rssi_confidence', 'message', 'beacon'])  # type: TelemetryStore
+        self._spi_lock = trio.Lock()  # Serializes the radio accesses from the Trio side (polls, RX drain and TX)
+        self._trio_token = None
+        self._packet_send_channel, self._packet_receive_channel = trio.open_memory_channel(self.PACKET_QUEUE_SIZE)
+        self._is_draining = False
+        self._packets = PacketBuffer(self.PACKET_BUFFER_SIZE)  # type: PacketBuffer
+        self.beacons = BeaconRegistry(self.BEACON_STALE_TIME)  # type: BeaconRegistry
+        self.rssi_filter = RSSIFilter()  # type: RSSIFilter
+        self._filter_target = None  # ID of the beacon followed by the filter
+        self.dropped_notifications = 0
+        self.rx_errors = 0  # FIFO overflows and invalid packet lengths (FIFO flushed)
+        self._rssi_history = RingBuffer(self.RSSI_HISTORY_LENGTH)  # type: RingBuffer
+        self._polling_profile = self.POLLING_NORMAL
+        self._profile_changed = trio.Event()
+        self._wor_active = False
+        self._rx_duty = 1.0  # Current receiver duty cycle (1 in RX, WOR RX fraction in Wake-on-Radio)
+        self._rx_on_time = 0.0  # s, receiver on-time since the loop started
+        self._rx_start = None  # time.monotonic() at the start of the loop
+        self._rx_mark = None  # time.monotonic() of the last on-time update
+        self.rssi_polls = 0  # RSSI register reads
         self._interrupt = DigitalInputDevice(interrupt_pin)
         if device_num == 0:
             ce_pin = 8
@@ -79,8 +144,10 @@ class ReceptorSystem(AsyncEventSource):
             "SCLK":     self.SPI_SCLK_PIN, # SPI clock (D23)
             "CE":       ce_pin   # Chip Enable (D24) (SPI numb.0 = CE0(D24) or CE1 = (D26))
         }
-        self._radio = TICC1101(bus=spi_conf.get("bus"), device=spi_conf.get("device"))
+        self._radio = TICC1101(bus=spi_conf.get("bus"), device=spi_conf.get("device"),
+                               performance_mode=self.SPI_PERFORMANCE_MODE)
         self._setup_device()
+        self.transmitter = Transmitter(self._radio, nursery, self._spi_lock)  # type: Transmitter
         self._is_running = False
 
 
@@ -92,32 +159,168 @@ class ReceptorSystem(AsyncEventSource):
         self._radio.setCarrierFrequency(self.CARRIER_FREQ)  # setting carrier frequency... (433 MHz or 868 MHz)
         self._radio.setChannel(0x1F)
         self._radio._writeSingleByte(self._radio.PKTCTRL1, 0x04)  # disable Address Check
+        if self.ADDRESS is not None:
+            self._radio.setFilteringAddress(self.ADDRESS)
+            self._radio.configureAddressFiltering("ENABLED_00_255_BROADCAST")
+        self._radio._writeSingleByte(self._radio.MCSM1, self.MCSM1_VALUE)  # back to RX after every packet
         self._radio.sidle()  # enter the transceiver into IDLE mode
         self._radio._setRXState()
 
+    @property
+    def rssi_history(self) -> RingBuffer:
+        """
+        Latest RSSI samples (dBm), timestamped with trio.current_time()
+        """
+        return self._rssi_history
+
+    def get_rssi_trend(self, duration: float = None):
+        """
+        RSSI slope in dBm/s over the last "duration" seconds (positive: getting closer to the beacon).
+        None if there are not enough samples
+        """
+        return self._rssi_history.trend(duration)
+
+    @property
+    def packets(self) -> PacketBuffer:
+        """
+        Latest received packets, with reception statistics
+        """
+        return self._packets
+
+    def select_beacon(self, beacon_id=None):
+        """
+        Beacon to be tracked ("rssi" field). None: the strongest one
+        """
+        self.beacons.select(beacon_id)
+        self._update_filter_target()
+
+    @property
+    def polling_profile(self) -> str:
+        return self._polling_profile
+
+    def set_polling_profile(self, profile: str):
+        """
+        Changes the RSSI polling profile (POLLING_*), applied at once by the notification loop
+        """
+        if profile not in self.POLLING_PERIODS:
+            raise ValueError(f"Unknown polling profile: {profile}")
+        if profile != self._polling_profile:
+            self._polling_profile = profile
+            self._profile_changed.set()
+
+    @property
+    def rx_duty_cycle(self) -> float:
+        """
+        Fraction of the time (0 to 1) with the receiver on since the notification loop started
+        """
+        if self._rx_start is None:
+            return 0.0
+        now = time.monotonic()
+        elapsed = now - self._rx_start
+        on_time = self._rx_on_time + (now - self._rx_mark) * self._rx_duty
+        return on_time / elapsed if elapsed > 0 else self._rx_duty
+
+    @property
+    def spi_transfers(self) -> int:
+        """
+        SPI transactions with the radio (RSSI polls, packet reads, transmissions and configuration)
+        """
+        return self._radio.spi_transfers
+
+    def _set_rx_duty(self, duty: float):
+        now = time.monotonic()
+        self._rx_on_time += (now - self._rx_mark) * self._rx_duty
+        self._rx_mark = now
+        self._rx_duty = duty
+
+    def _start_wake_on_radio(self):
+        # Worker thread, SPI lock held
+        self._radio.configureWakeOnRadio(self.WOR_PERIOD, self.WOR_RX_TIME)
+        self._radio.startWakeOnRadio()
+        return self._radio.getWakeOnRadioDutyCycle()
+
+    def _stop_wake_on_radio(self):
+        # Worker thread, SPI lock held. The registers lost in SLEEP and MCSM2 (no RX timeout) are restored before RX
+        self._radio.wakeUp()
+        self._radio._setRXState()
+
+    async def _a_apply_polling_profile(self):
+        wor = self._polling_profile == self.POLLING_WOR
+        if wor == self._wor_active:
+            return
+        async with self._spi_lock:
+            if wor:
+                self._set_rx_duty(await trio.to_thread.run_sync(self._start_wake_on_radio))
+            else:
+                await trio.to_thread.run_sync(self._stop_wake_on_radio)
+                self._set_rx_duty(1.0)
+            self._wor_active = wor
+
+    def _update_filter_target(self):
+        # The RSSI filter only makes sense for a single transmitter: restart it when the target changes. A selected
+        # beacon keeps its filter while it is not heard (it is still the same transmitter when it comes back)
+        target = self.beacons.target
+        target_id = target.id if target is not None else self.beacons.selected_id
+        if target_id != self._filter_target:
+            self._filter_target = target_id
+            self.rssi_filter.reset()
+        return target
+
     def get_radio_state(self):
         code = (self._radio._getMRStateMachineState() and 0x1F)
         return STATE_DICT.get(code)
 
     def on_interrupt(self):
-        print("GOT AN INTERRUPT!!")
-        received_data = self._radio.recvData()  # receiving data...
-        if type(received_data) != type([]):  # Sometimes recvData does not return a list...
-            received_data = []
-        self._radio.sidle()  # enters the transceiver into IDLE mode
-        self._radio._setRXState()  # enters the transceiver into RX mode
-        # print("Operation mode: {}".format(radio_state(radio)))
-        local_message = ''.join([chr(code) for code in received_data])
-        local_message = local_message[0:len(local_message)-1] if len(local_message)>0 else ""
+        # gpiozero callback thread: end of a packet. Only timestamps it and notifies the Trio loop
+        timestamp = time.monotonic()
+        try:
+            self._trio_token.run_sync_soon(self._notify_packet, timestamp)
+        except trio.RunFinishedError:
+            pass
 
+    def _notify_packet(self, timestamp: float):
+        # Trio thread
+        try:
+            self._packet_send_channel.send_nowait(timestamp)
+        except trio.WouldBlock:
+            self.dropped_notifications += 1
 
-        local_message = f"{datetime.datetime.now().strftime('%c')} -- {local_message}"
-        print(f"### RECIBIDO: {local_message}")
+    def _read_packet(self, timestamp: float):
+        """
+        Reads one packet from the RX FIFO (runs in a worker thread). On FIFO overflow or an invalid length, the
+        FIFO is flushed and reception restarted
+        :param timestamp: time.monotonic() at the end of the packet
+        :return: Packet, None if there is no valid packet
+        """
+        radio = self._radio
+        rx_bytes = radio._readSingleByte(radio.RXBYTES)
+        if rx_bytes & 0x80 or rx_bytes & 0x7F:
+            received = radio.recvPacket() if not rx_bytes & 0x80 else None
+            if received:
+                data, rssi, lqi, crc_ok, address = received
+                return Packet(bytes(data), rssi, lqi, crc_ok, timestamp, address)
+            self.rx_errors += 1
+            self._packets.add_lost()
+            radio.sidle()
+            radio._flushRXFifo()
+            radio._setRXState()
+        return None
 
-        # These are the only necessary multithreading lines here
-        self._last_message_lock.acquire()
-        self._last_message = local_message
-        self._last_message_lock.release()
+    async def _a_drain_packets(self):
+        async for timestamp in self._packet_receive_channel:
+            async with self._spi_lock:
+                packet = await trio.to_thread.run_sync(self._read_packet, timestamp)
+                if self._wor_active:  # The radio stays in RX after the packet: back to Wake-on-Radio
+                    await trio.to_thread.run_sync(self._radio.startWakeOnRadio)
+            if packet is None:
+                continue
+            self._packets.append(packet)
+            beacon = self.beacons.record(packet)
+            if beacon is not None and beacon is self._update_filter_target():
+                self.rssi_filter.update(packet.rssi, packet.timestamp, self.rssi_filter.packet_noise)
+            if packet.crc_ok:
+                self._data['message'] = packet.text
+            await self.raise_event(PacketEventArgs(self.PACKET_EVENT, packet))
 
     def print_number_plate(self):
         print("CC1101_PARTNUM: {}".format(self._radio._readSingleByte(self._radio.PARTNUM)))  # Chip part number
@@ -135,37 +338,85 @@ class ReceptorSystem(AsyncEventSource):
         if self._is_running:
             return
         self._is_running = True
-        self._interrupt.when_activated = self.on_interrupt
+        self._trio_token = trio.lowlevel.current_trio_token()
+        if not self._is_draining:
+            self._is_draining = True
+            self.nursery.start_soon(self._a_drain_packets)
+        self.nursery.start_soon(self.transmitter.a_run_notification_loop)
+        self._interrupt.when_deactivated = self.on_interrupt
+        self._rx_start = self._rx_mark = time.monotonic()
+        self._rx_on_time = 0.0
         print("Starting")
         while self._is_running:
-            rssi = self._radio._getRSSI(self._radio.getRSSI())
-            self._data['rssi'] = rssi
-            # Only update message if it is not being overwritten EXACTLY at the same time (very rare...)
-            if self._last_message_lock.acquire(blocking=False):
-                self._data['message'] = self._last_message
-                self._last_message_lock.release()
-            await self.raise_event(ReceptorEventArgs(self.RSSI_EVENT, self._data))
-            await trio.sleep(0.5)
+            self._profile_changed = trio.Event()
+            await self._a_apply_polling_profile()
+            self.beacons.evict_stale()
+            target = self._update_filter_target()
+            now = time.monotonic()
+            if target is not None:
+                if self.rssi_filter.estimate is None:  # New target heard before the switch
+                    self.rssi_filter.update(target.smoothed_rssi, target.last_seen)
+                rssi, confidence = self.rssi_filter.estimate, self.rssi_filter.confidence(now)
+            elif self.beacons.selected_id is not None:  # Selected beacon not heard: any other signal is not its RSSI
+                rssi, confidence = None, 0.0
+            else:
+                if not self._wor_active:  # No beacons: current channel RSSI
+                    async with self._spi_lock:
+                        rssi = self._radio._getRSSI(self._radio.getRSSI())
+                    self.rssi_polls += 1
+                    self.rssi_filter.update(rssi, now, self.rssi_filter.register_noise)
+                rssi, confidence = self.rssi_filter.estimate, self.rssi_filter.confidence(now)
+            self._data.update({'rssi': rssi, 'rssi_confidence': confidence,
+                               'beacon': target.id if target is not None else None})
+            if rssi is not None:  # Nothing heard yet in Wake-on-Radio
+                self._rssi_history.append(rssi, trio.current_time())
+            await self.raise_event(ReceptorEventArgs(self.RSSI_EVENT, self._data.snapshot()))
+            with trio.move_on_after(self.POLLING_PERIODS[self._polling_profile]):
+                await self._profile_changed.wait()
 
     def stop_notification_loop(self):
         """
         Stops the update loop on the stored data. If it is not running, it does nothing.
         """
         self._is_running = False
-        self._interrupt.when_activated = None
+        self._interrupt.when_deactivated = None
+        self.transmitter.stop_notification_loop()
 
 
 class ReceptorEventArgs(BaseEventArgs):
-    def __init__(self, event_type: str, data: dict):
+    def __init__(self, event_type: str, data: TelemetrySnapshot):
         super().__init__(event_type)
-        self.data = data  # type: dict
+        self.data = data  # type: TelemetrySnapshot
+
+
+class PacketEventArgs(BaseEventArgs):
+    def __init__(self, event_type: str, packet: Packet):
+        """
+        :param event_type: event identifier
+        :param packet: received packet (timestamped at the end of the packet, GDO0 edge)
+        """
+        super().__init__(event_type)
+        self.packet = packet  # type: Packet
 
 
 class DummyReceptorSystem(AsyncEventSource):
+    RSSI_EVENT = ReceptorSystem.RSSI_EVENT
+    PACKET_EVENT = ReceptorSystem.PACKET_EVENT
+    POLLING_FAST = ReceptorSystem.POLLING_FAST
+    POLLING_NORMAL = ReceptorSystem.POLLING_NORMAL
+    POLLING_SLOW = ReceptorSystem.POLLING_SLOW
+    POLLING_WOR = ReceptorSystem.POLLING_WOR
+
     def __init__(self, interrupt_pin, device_num: int, nursery, data=None, notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
-        self._data = data if data is not None else {'rssi': -60}
+        self._data = data if data is not None else TelemetryStore(['rssi', 'rssi_confidence', 'message', 'beacon'])
         self._data['rssi'] = -90
+        self._data['rssi_confidence'] = 1.0
+        self._rssi_history = RingBuffer(ReceptorSystem.RSSI_HISTORY_LENGTH)  # type: RingBuffer
+        self._packets = PacketBuffer(ReceptorSystem.PACKET_BUFFER_SIZE)  # type: PacketBuffer
+        self.beacons = BeaconRegistry(ReceptorSystem.BEACON_STALE_TIME)  # type: BeaconRegistry
+        self._polling_profile = ReceptorSystem.POLLING_NORMAL
+        self.rssi_polls = 0
         self._is_running = False
 
     async def a_run_notification_loop(self):
@@ -174,11 +425,43 @@ class DummyReceptorSystem(AsyncEventSource):
         self._is_running = True
         while self._is_running:
             await trio.sleep(1)
-            await self.raise_event(ReceptorEventArgs(ReceptorSystem.RSSI_EVENT, self._data))
+            self._rssi_history.append(self._data['rssi'], trio.current_time())
+            await self.raise_event(ReceptorEventArgs(ReceptorSystem.RSSI_EVENT, self._data.snapshot()))
 
     def stop_notification_loop(self):
         self._is_running = False
 
+    @property
+    def rssi_history(self) -> RingBuffer:
+        return self._rssi_history
+
+    @property
+    def packets(self) -> PacketBuffer:
+        return self._packets
+
+    def get_rssi_trend(self, duration: float = None):
+        return self._rssi_history.trend(duration)
+
+    def select_beacon(self, beacon_id=None):
+        self.beacons.select(beacon_id)
+
+    @property
+    def polling_profile(self) -> str:
+        return self._polling_profile
+
+    def set_polling_profile(self, profile: str):
+        if profile not in ReceptorSystem.POLLING_PERIODS:
+            raise ValueError(f"Unknown polling profile: {profile}")
+        self._polling_profile = profile
+
+    @property
+    def rx_duty_cycle(self) -> float:
+        return 0.0
+
+    @property
+    def spi_transfers(self) -> int:
+        return 0
+
     def get_radio_state(self):
         return STATE_DICT.get(0)
 
@@ -199,8 +482,12 @@ if __name__ == "__main__":
             counter += 1
             await trio.sleep(1)
 
-    async def event_listener(source, param: ReceptorEventArgs):
-        print(f"New RSSI: {param.data}dBm")
+    async def event_listener(source, param):
+        if param.event_type == ReceptorSystem.PACKET_EVENT:
+            print(f"New packet: {param.packet}, {(time.monotonic() - param.packet.timestamp) * 1000:.2f}ms ago. "
+                  f"{source.packets}")
+        else:
+            print(f"New RSSI: {param.data}dBm")
 
     async def parent():
         async with trio.open_nursery() as nursery:
@@ -0,0 +1,147 @@
+import math
+
+# Zones returned by RSSIHysteresis, from the weakest to the strongest signal
+ZONE_LOST = 0
+ZONE_FAR = 1
+ZONE_CLOSE = 2
+ZONE_REACHED = 3
+
+
+class RSSIFilter:
+    """
+    Scalar Kalman filter for the RSSI of a transmitter (random walk model: the RSSI drifts while the rover or the
+    beacon move), updated with every available sample: packet RSSIs (accurate) and RSSI register polls (noisier).
+    Outliers (multipath fades/peaks) are rejected when the innovation is over "gate" standard deviations, unless
+    they keep coming ("max_rejections" in a row), which means that the signal has actually changed.
+    The confidence (0 to 1) falls as the uncertainty grows, i.e. when no samples arrive.
+    """
+    def __init__(self, process_noise: float = 4.0, packet_noise: float = 9.0, register_noise: float = 25.0,
+                 gate: float = 3.0, max_rejections: int = 3, confidence_std: float = 10.0):
+        """
+        :param process_noise: RSSI variance growth (dB^2/s)
+        :param packet_noise: variance of the packet RSSI samples (dB^2)
+        :param register_noise: variance of the RSSI register samples (dB^2)
+        :param gate: outlier threshold, in innovation standard deviations
+        :param max_rejections: consecutive outliers after which the filter is reset to the new value
+        :param confidence_std: estimate standard deviation (dB) with zero confidence
+        """
+        self.process_noise = process_noise
+        self.packet_noise = packet_noise
+        self.register_noise = register_noise
+        self._gate = gate
+        self._max_rejections = max_rejections
+        self._confidence_std = confidence_std
+        self.reset()
+
+    def reset(self):
+        self._estimate = None
+        self._variance = math.inf
+        self._timestamp = None
+        self._rejections = 0
+        self.rejected_count = 0
+
+    @property
+    def estimate(self):
+        """
+        Filtered RSSI (dBm), None before the first sample
+        """
+        return self._estimate
+
+    def variance(self, now: float) -> float:
+        """
+        Estimate variance (dB^2) at time "now"
+        """
+        if self._estimate is None:
+            return math.inf
+        return self._variance + self.process_noise * max(0.0, now - self._timestamp)
+
+    def confidence(self, now: float) -> float:
+        """
+        0 (no information) to 1 (exact estimate)
+        """
+        return max(0.0, 1 - math.sqrt(self.variance(now)) / self._confidence_std)
+
+    def update(self, rssi: float, timestamp: float, noise: float = None) -> bool:
+        """
+        :param rssi: RSSI sample (dBm)
+        :param timestamp: sample time (s)
+        :param noise: sample variance (packet_noise by default)
+        :return: False if the sample was rejected as an outlier
+        """
+        noise = noise if noise is not None else self.packet_noise
+        if self._estimate is None:
+            self._estimate, self._variance, self._timestamp = rssi, noise, timestamp
+            return True
+        variance = self.variance(timestamp)
+        innovation = rssi - self._estimate
+        innovation_variance = variance + noise
+        if innovation * innovation > self._gate * self._gate * innovation_variance:
+            self._rejections += 1
+            self.rejected_count += 1
+            if self._rejections < self._max_rejections:
+                return False
+            # Persistent "outliers": the signal has changed. Restart from this sample
+            self._rejections = 0
+            self._estimate, self._variance, self._timestamp = rssi, noise, timestamp
+            return True
+        self._rejections = 0
+        gain = variance / innovation_variance
+        self._estimate += gain * innovation
+        self._variance = (1 - gain) * variance
+        self._timestamp = max(self._timestamp, timestamp)
+        return True
+
+
+class RSSIHysteresis:
+    """
+    Classifies a (filtered) RSSI into zones (LOST < FAR < CLOSE < REACHED) separated by thresholds, with
+    hysteresis: the value must cross a threshold by "margin" dB to leave the current zone, and stay in the new zone
+    for "dwell_time" seconds before the change is accepted
+    """
+    def __init__(self, giveup_threshold: float, follow_threshold: float, stop_threshold: float,
+                 margin: float = 2.0, dwell_time: float = 1.0):
+        """
+        :param giveup_threshold: LOST below it (dBm)
+        :param follow_threshold: FAR below it (dBm)
+        :param stop_threshold: REACHED over it (dBm)
+        :param margin: hysteresis (dB)
+        :param dwell_time: time (s) in a new zone before switching to it
+        """
+        self._thresholds = (giveup_threshold, follow_threshold, stop_threshold)
+        self._margin = margin
+        self._dwell_time = dwell_time
+        self.zone = None
+        self._candidate = None
+        self._candidate_since = None
+
+    def _classify(self, rssi: float) -> int:
+        zone = self.zone
+        if zone is None:
+            return sum(rssi > threshold for threshold in self._thresholds)
+        # Moving up needs to be "margin" over the threshold, moving down "margin" under it
+        while zone < ZONE_REACHED and rssi > self._thresholds[zone] + self._margin:
+            zone += 1
+        while zone > ZONE_LOST and rssi < self._thresholds[zone - 1] - self._margin:
+            zone -= 1
+        return zone
+
+    def update(self, rssi: float, now: float) -> int:
+        """
+        :return: current zone (ZONE_*)
+        """
+        zone = self._classify(rssi)
+        if self.zone is None:
+            self.zone = zone
+        elif zone == self.zone:
+            self._candidate = None
+        elif zone != self._candidate:
+            self._candidate = zone
+            self._candidate_since = now
+        if self._candidate is not None and now - self._candidate_since >= self._dwell_time:
+            self.zone = self._candidate
+            self._candidate = None
+        return self.zone
+
+    def reset(self):
+        self.zone = None
+        self._candidate = None
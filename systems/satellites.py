@@ -0,0 +1,115 @@
+import time
+import numpy as np
+
+
+class SatelliteTable:
+    """
+    Satellites in view, kept in preallocated arrays indexed by PRN (elevation, azimuth, SNR, last time seen) and
+    updated in place from the GSV sentences.
+    A satellite is visible while it keeps being reported: at the end of every GSV group (see end_cycle), the ones
+    not reported for "stale_time" seconds are dropped. Fix-quality metrics are cached, and only recomputed once
+    the table has changed.
+    """
+    MAX_PRN = 256  # GPS 1-32, SBAS 33-64, GLONASS 65-96... (NMEA numbering)
+    SKY_SECTORS = 12  # Azimuth sectors (30deg) used for the sky coverage
+
+    def __init__(self, stale_time: float = 3, clock=time.monotonic):
+        """
+        :param stale_time: seconds without being reported before a satellite is considered gone
+        :param clock: time source, used when no timestamp is given
+        """
+        self.elevation = np.full(self.MAX_PRN, np.nan)  # Degrees
+        self.azimuth = np.full(self.MAX_PRN, np.nan)  # Degrees
+        self.snr = np.full(self.MAX_PRN, np.nan)  # dB-Hz (NaN: not tracked)
+        self.last_seen = np.full(self.MAX_PRN, -np.inf)
+        self.visible = np.zeros(self.MAX_PRN, dtype=bool)
+        self._stale_time = stale_time
+        self._clock = clock
+        self._version = 0  # Incremented on every change
+        self._metrics_version = -1
+        self._mean_snr = None
+        self._sky_coverage = 0.0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def update(self, prn: int, elevation, azimuth, snr, timestamp: float = None):
+        """
+        Stores one satellite report. Empty fields (None) are stored as NaN
+        """
+        if not 0 <= prn < self.MAX_PRN:
+            return
+        timestamp = timestamp if timestamp is not None else self._clock()
+        elevation = np.nan if elevation is None else elevation
+        azimuth = np.nan if azimuth is None else azimuth
+        snr = np.nan if snr is None else snr
+        self.last_seen[prn] = timestamp
+        # NaN != NaN: compare through the raw values to detect actual changes
+        if not self.visible[prn] or not (_same(self.elevation[prn], elevation) and _same(self.azimuth[prn], azimuth)
+                                         and _same(self.snr[prn], snr)):
+            self.elevation[prn] = elevation
+            self.azimuth[prn] = azimuth
+            self.snr[prn] = snr
+            self.visible[prn] = True
+            self._version += 1
+
+    def end_cycle(self, timestamp: float = None):
+        """
+        Called once a GSV group is complete: drops the satellites that have not been reported lately
+        """
+        timestamp = timestamp if timestamp is not None else self._clock()
+        stale = self.visible & (self.last_seen < timestamp - self._stale_time)
+        if stale.any():
+            self.visible[stale] = False
+            self._version += 1
+
+    @property
+    def count(self) -> int:
+        return int(np.count_nonzero(self.visible))
+
+    @property
+    def prns(self) -> np.ndarray:
+        return np.flatnonzero(self.visible)
+
+    @property
+    def tracked(self) -> np.ndarray:
+        """
+        Mask of the visible satellites with a valid SNR (actually being tracked)
+        """
+        return self.visible & ~np.isnan(self.snr)
+
+    @property
+    def mean_snr(self):
+        """
+        Mean SNR (dB-Hz) of the tracked satellites, None if there are none
+        """
+        self._update_metrics()
+        return self._mean_snr
+
+    @property
+    def sky_coverage(self) -> float:
+        """
+        Fraction (0 to 1) of the azimuth sectors holding at least one tracked satellite. Low values mean that the
+        satellites are clustered (e.g. half of the sky blocked), and so a poor geometry
+        """
+        self._update_metrics()
+        return self._sky_coverage
+
+    def _update_metrics(self):
+        if self._metrics_version == self._version:
+            return
+        tracked = self.tracked
+        snr = self.snr[tracked]
+        self._mean_snr = float(snr.mean()) if len(snr) else None
+        azimuth = self.azimuth[tracked & ~np.isnan(self.azimuth)]
+        sectors = np.unique((azimuth // (360 / self.SKY_SECTORS)).astype(int) % self.SKY_SECTORS)
+        self._sky_coverage = len(sectors) / self.SKY_SECTORS
+        self._metrics_version = self._version
+
+    def __repr__(self):
+        return f"SatelliteTable({self.count} visible, mean SNR {self.mean_snr}, sky coverage {self.sky_coverage:.2f})"
+
+
+def _same(a, b) -> bool:
+    return a == b or (a != a and b != b)
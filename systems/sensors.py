@@ -1,16 +1,38 @@
 from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.telemetry import TelemetryStore, TelemetrySnapshot
 from sense_hat import SenseHat
+from threading import Thread
 import trio
+import time
 
 
 class SenseHatWrapper(AsyncEventSource):
     """
-    Simple wrapper around sense hat sensor checks
+    Simple wrapper around sense hat sensor checks.
+    Every sense hat access (an I2C transaction through RTIMULib, several ms long) runs in a dedicated acquisition
+    thread, following a per-sensor schedule (SENSOR_RATES): the IMU is sampled fast, for heading control, and the
+    environment sensors slowly. Orientation values are kept as attributes (read directly by the heading controller),
+    environment readings are sent to the Trio loop through a memory channel, so the event loop never waits for
+    the sense hat.
     """
     SENSOR_EVENT = "SENSOR_EVENT"
     ROLL_BASE_DEGREES = 180
-
-    def __init__(self, nursery, data=None, notification_callbacks=None, error_callbacks=None):
+    IMU_SAMPLE_RATE = 100  # Hz, orientation sampling rate (heading control)
+    SENSOR_RATES = {  # Hz, acquisition rate of every sensor
+        'orientation': IMU_SAMPLE_RATE,
+        'temperature': 1,
+        'pressure': 1,
+        'humidity': 1,
+    }
+    EVENT_PERIOD = 1  # s, SENSOR_EVENT period
+    READINGS_BUFFER_SIZE = 16  # Environment readings waiting for the Trio loop. Newer ones are dropped when full
+
+    def __init__(self, nursery, data=None, sensor_rates=None, notification_callbacks=None, error_callbacks=None):
+        """
+        :param nursery: Trio nursery
+        :param data: telemetry store to be updated (temperature, pressure, humidity, slope)
+        :param sensor_rates: {sensor: rate in Hz} overriding SENSOR_RATES. A rate of 0 disables the sensor
+        """
         super().__init__(nursery, notification_callbacks, error_callbacks)
         try:
             self.sense_hat = SenseHat()
@@ -18,49 +40,162 @@ class SenseHatWrapper(AsyncEventSource):
         except:
             print("ERROR INITIALIZING SENSE HAT")
             raise
-        self._data = data if data is not None else {'temperature': None, 'pressure': None, 'humidity': None,
-                                                    'slope': None}
+        self._data = data if data is not None else TelemetryStore(['temperature', 'pressure', 'humidity',
+                                                                  'slope'])  # type: TelemetryStore
         self._running = False
+        self._sensor_rates = dict(self.SENSOR_RATES)
+        if sensor_rates is not None:
+            self._sensor_rates.update(sensor_rates)
+        self._readers = {
+            # get_orientation keeps the gyro+accel fusion configured above (accel/gyro properties would
+            # reconfigure the IMU)
+            'orientation': self._read_orientation,
+            'temperature': self.sense_hat.get_temperature,
+            'pressure': self.sense_hat.get_pressure,
+            'humidity': lambda: self.sense_hat.get_humidity() * 81/121,  # TODO: Check humidity correction
+        }
+        # Only the acquisition thread touches the sense hat (RTIMULib is not thread-safe)
+        self._acquisition_thread = None
+        self._acquisition_running = False
+        self._trio_token = None
+        self._send_channel, self._receive_channel = trio.open_memory_channel(self.READINGS_BUFFER_SIZE)
+        self.dropped_readings = 0  # Environment readings lost because the Trio loop did not keep up
+        self.overruns = 0  # Sensor reads started late (the previous ones took too long)
+        self._yaw = 0  # Latest orientation values (degrees). Written only by the acquisition thread
+        self._roll = self.ROLL_BASE_DEGREES
+        self._imu_timestamp = None
+
+    @property
+    def yaw(self):
+        """
+        Latest yaw (degrees, 0 to 360). Since the compass is disabled, it is relative to the start-up orientation
+        """
+        return self._yaw
+
+    @property
+    def imu_timestamp(self):
+        """
+        time.monotonic() value of the latest IMU sample (None if no sample has been taken yet)
+        """
+        return self._imu_timestamp
+
+    def start_imu_sampling(self, rate=None):
+        """
+        Starts the acquisition thread (IMU and environment sensors), if it is not already running.
+        Environment readings only reach the telemetry store if it is started from the Trio thread
+        :param rate: IMU sampling rate in Hz (SENSOR_RATES['orientation'] by default)
+        """
+        if self._acquisition_running:
+            return
+        if rate is not None:
+            self._sensor_rates['orientation'] = rate
+        try:
+            self._trio_token = trio.lowlevel.current_trio_token()
+        except RuntimeError:  # Outside Trio: orientation only
+            self._trio_token = None
+        self._acquisition_running = True
+        self._acquisition_thread = Thread(target=self._acquisition_loop, name="SenseHatAcquisition", daemon=True)
+        self._acquisition_thread.start()
+
+    def stop_imu_sampling(self):
+        self._acquisition_running = False
+
+    def _read_orientation(self):
+        orientation = self.sense_hat.get_orientation_degrees()
+        self._yaw = orientation['yaw']
+        self._roll = orientation['roll']
+        self._imu_timestamp = time.monotonic()
+
+    def _acquisition_loop(self):
+        # Every sensor has its own deadline. The earliest one is served, then rescheduled a period later
+        periods = {sensor: 1 / rate for sensor, rate in self._sensor_rates.items() if rate > 0}
+        now = time.monotonic()
+        deadlines = {sensor: now for sensor in periods}
+        while self._acquisition_running and deadlines:
+            sensor = min(deadlines, key=deadlines.get)
+            delay = deadlines[sensor] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            value = self._readers[sensor]()
+            if value is not None:
+                self._push_reading(sensor, value)
+            deadlines[sensor] += periods[sensor]
+            now = time.monotonic()
+            if deadlines[sensor] < now:  # Overrun: do not try to catch up
+                self.overruns += 1
+                deadlines[sensor] = now
+
+    def _push_reading(self, sensor, value):
+        # Runs in the acquisition thread: hands the reading over to the Trio loop, without waiting for it
+        if self._trio_token is None:
+            return
+        try:
+            self._trio_token.run_sync_soon(self._deliver_reading, sensor, value)
+        except trio.RunFinishedError:
+            self._acquisition_running = False
+
+    def _deliver_reading(self, sensor, value):
+        # Runs in the Trio thread
+        try:
+            self._send_channel.send_nowait((sensor, value))
+        except trio.WouldBlock:
+            self.dropped_readings += 1
 
     async def a_run_notification_loop(self):
         if self._running:
             return
         self._running = True
+        self.start_imu_sampling()
+        next_event = trio.current_time() + self.EVENT_PERIOD
         while self._running:
-            await trio.sleep(1)
-            self._data["temperature"] = self.sense_hat.get_temperature()
-            await trio.sleep(0)
-            self._data["pressure"] = self.sense_hat.get_pressure()
-            await trio.sleep(0)
-            self._data["humidity"] = self.sense_hat.get_humidity() * 81/121  # TODO: Check humidity correction
-            await trio.sleep(0)
-            raw_slope = self.sense_hat.accel['roll']
-            self._data["slope"] = -raw_slope + 180
-            await self.raise_event(SensorEventArgs(self.SENSOR_EVENT, self._data.copy()))
+            with trio.move_on_at(next_event):
+                async for sensor, value in self._receive_channel:
+                    self._data[sensor] = value
+            if not self._running:
+                break
+            next_event += self.EVENT_PERIOD
+            self._data["slope"] = -self._roll + self.ROLL_BASE_DEGREES
+            await self.raise_event(SensorEventArgs(self.SENSOR_EVENT, self._data.snapshot()))
 
     def stop_notification_loop(self):
         self._running = False
+        self.stop_imu_sampling()
 
 
 class SensorEventArgs(BaseEventArgs):
-    def __init__(self, event_type, data_dict: dict):
+    def __init__(self, event_type, data: TelemetrySnapshot):
         super().__init__(event_type)
-        self.data = data_dict  # type: dict
+        self.data = data  # type: TelemetrySnapshot
 
 
 class DummySenseHatWrapper(AsyncEventSource):
-    def __init__(self, nursery, data=None, notification_callbacks=None, error_callbacks=None):
+    def __init__(self, nursery, data=None, sensor_rates=None, notification_callbacks=None, error_callbacks=None):
         super().__init__(nursery, notification_callbacks, error_callbacks)
-        self._data = data if data is not None else {'temperature': None, 'pressure': None, 'humidity': None}
+        self._data = data if data is not None else TelemetryStore(['temperature', 'pressure', 'humidity',
+                                                                  'slope'])
         self._running = False
 
+    @property
+    def yaw(self):
+        return 0
+
+    @property
+    def imu_timestamp(self):
+        return time.monotonic()
+
+    def start_imu_sampling(self, rate=None):
+        pass
+
+    def stop_imu_sampling(self):
+        pass
+
     async def a_run_notification_loop(self):
         if self._running:
             return
         self._running = True
         while self._running:
             await trio.sleep(1)
-            await self.raise_event(SensorEventArgs(SenseHatWrapper.SENSOR_EVENT, self._data.copy()))
+            await self.raise_event(SensorEventArgs(SenseHatWrapper.SENSOR_EVENT, self._data.snapshot()))
 
     def stop_notification_loop(self):
         self._running = False
@@ -69,12 +204,12 @@ class DummySenseHatWrapper(AsyncEventSource):
 # Test Suite: Minimal working example
 if __name__ == "__main__":
     # Simple async timer to run "in parallel" to all GPS shenanigans
-    data = {}
+    data = TelemetryStore(['temperature', 'pressure', 'humidity', 'slope'])
 
     async def async_timer():
         counter = 0
         while True:
-            print(f"### {counter}s ### Main data dict is also updated: {data}")
+            print(f"### {counter}s ### Main data store is also updated: {data.snapshot()}")
             counter += 1
             await trio.sleep(1)
 
@@ -5,6 +5,7 @@ import string
 import socket
 from typing import List, Union
 from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.telemetry import TelemetryStore
 
 
 SESSION_ID_LENGTH = 30
@@ -23,7 +24,7 @@ class Server(AsyncEventSource):
         self._FULL_ADDRESS = f"http://{ip_address}:{port}/"
         self._ROVER_ID = rover_id
         self._ROVER_ADDRESS = find_ip_address()
-        self._data = sensor_data
+        self._data = sensor_data  # type: TelemetryStore
         self._continue_running = False
         # Event to prevent multiple simultaneous update loops:
         #   "a_run_update_loop" called before the existing one wakes up after "stop_update_loop"
@@ -101,7 +102,7 @@ class Server(AsyncEventSource):
 
     async def _update_session(self, client):
         try:
-            ans = await client.put(self._FULL_ADDRESS + "api/session/" + self._session_id + "/", json=self._data)
+            ans = await client.put(self._FULL_ADDRESS + "api/session/" + self._session_id + "/", json=self._data.snapshot().as_dict())
             # print(f"---> Sent session update. Status code: {ans.status_code}\n{self._data}")
             return ans.status_code
         except httpx.RemoteProtocolError as e:
@@ -109,8 +110,7 @@ class Server(AsyncEventSource):
 
     def _define_new_session(self):
         self._session_id = generate_session_id()
-        self._data['session_id'] = self._session_id
-        self._data['rover_id'] = self._ROVER_ID
+        self._data.update({'session_id': self._session_id, 'rover_id': self._ROVER_ID})
 
 
 class DummyServer(AsyncEventSource):
@@ -0,0 +1,240 @@
+import time
+import trio
+from collections import deque
+
+
+class State:
+    """
+    Node of a StateMachine. Created through StateMachine.add_state
+    """
+    __slots__ = ('name', 'parent', 'initial', 'on_entry', 'on_exit', 'timers', 'path', '_transitions', '_resolved')
+
+    def __init__(self, name, parent=None, on_entry=None, on_exit=None):
+        self.name = name  # type: str
+        self.parent = parent  # type: State
+        self.initial = None  # type: State  # Child entered when this state is targeted (composite states)
+        self.on_entry = on_entry
+        self.on_exit = on_exit
+        self.timers = []  # (delay, event) pairs, armed on entry and disarmed on exit
+        self.path = (parent.path if parent is not None else ()) + (self,)  # From the outermost state down to self
+        self._transitions = {}  # event -> [Transition] defined on this state
+        self._resolved = None  # event -> [Transition], including the ones inherited from the parents
+
+    def __repr__(self):
+        return f"State({self.name})"
+
+
+class Transition:
+    __slots__ = ('target', 'guard', 'action')
+
+    def __init__(self, target, guard=None, action=None):
+        self.target = target
+        self.guard = guard
+        self.action = action
+
+
+class StateMachine:
+    """
+    Table-driven hierarchical state machine.
+        - States may be nested. Events not handled by a state are handled by its parents.
+        - Entry/exit actions run from the outermost state down (entry) and from the innermost state up (exit).
+        - Transitions may have a guard (callable, no parameters) and an action (callable, no parameters).
+          The first transition whose guard passes is taken.
+        - Timers: when a state is entered, its timers are armed. If the state is still active when they expire,
+          their event is dispatched (see poll_timers).
+        - Events are integers (see add_event), and each state has a precomputed table of handled events, so
+          dispatching an event is a single dictionary lookup.
+    Two special targets exist: None (internal transition: only the action runs) and HISTORY (the outermost state
+    that was active before entering the current outermost state, which is re-entered through its initial state).
+    A transition that resolves to the current state (e.g. a self-transition, or one to the composite state whose
+    initial state is active) behaves as an internal one: nothing is exited, entered or logged, and timers keep
+    running. Events that confirm the current state can then be dispatched as often as needed (e.g. periodic RSSI
+    readings). Targeting an ancestor of the current state through which a different state is reached exits and
+    re-enters that ancestor.
+    """
+    HISTORY = object()
+
+    def __init__(self, on_transition=None, log_length=100, clock=time.monotonic):
+        """
+        :param on_transition: callable(source, event, target), called after every state change
+        :param log_length: length of the transition log (latest transitions)
+        :param clock: time source (seconds), used for the log and the timers. Replaceable for testing
+        """
+        self._states = []
+        self._event_names = []
+        self._state = None  # Current (innermost) state
+        self._history = {}  # Outermost state -> outermost state that was active before entering it
+        self._timers = []  # (deadline, event, state, entry stamp)
+        self._entry_count = 0
+        self._entry_stamps = {}  # Active state -> stamp of its latest entry (invalidates timers of exited states)
+        self._on_transition = on_transition
+        self._clock = clock
+        self.log = deque(maxlen=log_length)  # (time, source name, event name, target name)
+
+    # ---- Table definition ----------------
+    def add_event(self, name: str) -> int:
+        """
+        Registers a new event
+        :param name: event name (only used for the log)
+        :return: event identifier, to be used in add_transition and dispatch
+        """
+        self._event_names.append(name)
+        return len(self._event_names) - 1
+
+    def add_state(self, name: str, parent: State = None, initial: bool = False, on_entry=None, on_exit=None) -> State:
+        """
+        :param name: state name
+        :param parent: enclosing state (None for outermost states)
+        :param initial: whether this is the initial state of its parent
+        :param on_entry: callable (no parameters), run when entering the state
+        :param on_exit: callable (no parameters), run when exiting the state
+        """
+        state = State(name, parent, on_entry, on_exit)
+        if initial:
+            if parent is None:
+                raise ValueError("Only nested states can be initial states")
+            parent.initial = state
+        self._states.append(state)
+        self._invalidate()
+        return state
+
+    def add_transition(self, source: State, event: int, target, guard=None, action=None):
+        """
+        :param source: state in which the event is handled (also handled in its nested states)
+        :param event: event identifier (see add_event)
+        :param target: State, None (internal transition) or StateMachine.HISTORY
+        :param guard: callable returning whether the transition may be taken (None: always)
+        :param action: callable run during the transition, after the exit actions and before the entry actions
+        """
+        source._transitions.setdefault(event, []).append(Transition(target, guard, action))
+        self._invalidate()
+
+    def add_timer(self, state: State, delay: float, event: int):
+        """
+        Dispatches "event" after "delay" seconds in "state" (if it is not exited before)
+        """
+        state.timers.append((delay, event))
+
+    def _invalidate(self):
+        for state in self._states:
+            state._resolved = None
+
+    def _resolve(self, state: State):
+        # Flattened transition table: inner states override the events handled by their parents
+        table = {}
+        for node in state.path:
+            table.update(node._transitions)
+        state._resolved = table
+        return table
+
+    # ---- Runtime -------------------------
+    @property
+    def state(self) -> State:
+        """
+        Current (innermost) state
+        """
+        return self._state
+
+    def is_in(self, state: State) -> bool:
+        """
+        Whether "state" is the current state or one of its parents
+        """
+        return self._state is not None and state in self._state.path
+
+    def start(self, state: State):
+        """
+        Enters the initial state (running its entry actions)
+        """
+        self._state = None
+        self._go_to(state, None)
+
+    def dispatch(self, event: int) -> bool:
+        """
+        Processes one event
+        :return: True if the event was handled by the current state (or its parents)
+        """
+        state = self._state
+        table = state._resolved
+        if table is None:
+            table = self._resolve(state)
+        transitions = table.get(event)
+        if transitions is None:
+            return False
+        for transition in transitions:
+            if transition.guard is None or transition.guard():
+                target = transition.target
+                if target is None:
+                    if transition.action is not None:
+                        transition.action()
+                    return True
+                if target is self.HISTORY:
+                    target = self._history.get(state.path[0])
+                    if target is None:
+                        return False
+                self._go_to(target, event, transition.action)
+                return True
+        return False
+
+    def poll_timers(self, now: float = None):
+        """
+        Dispatches the events of the expired timers. Must be called periodically (see a_run_timer_loop)
+        :param now: current time (clock() by default)
+        """
+        if not self._timers:
+            return
+        now = now if now is not None else self._clock()
+        expired = [timer for timer in self._timers if timer[0] <= now]
+        if not expired:
+            return
+        self._timers = [timer for timer in self._timers if timer[0] > now]
+        for deadline, event, state, stamp in expired:
+            if self._entry_stamps.get(state) == stamp:  # The state has not been exited since the timer was armed
+                self.dispatch(event)
+
+    async def a_run_timer_loop(self, period: float = 0.05):
+        """
+        Periodically polls the timers. Asynchronous
+        """
+        while True:
+            await trio.sleep(period)
+            self.poll_timers()
+
+    def _go_to(self, target: State, event, action=None):
+        source = self._state
+        # Descend to the innermost initial state
+        leaf = target
+        while leaf.initial is not None:
+            leaf = leaf.initial
+        if leaf is source:  # Already there: internal transition (nothing is exited nor entered, timers keep running)
+            if action is not None:
+                action()
+            return
+        # Common ancestor: deepest state in both paths that is not the target itself. When the source is inside the
+        # target (and is not the leaf reached through it), the target is exited and re-entered
+        common = 0
+        if source is not None:
+            target_path = target.path
+            while (common < len(source.path) and common < len(target_path) - 1
+                   and source.path[common] is target_path[common]):
+                common += 1
+            for state in reversed(source.path[common:]):
+                if state.on_exit is not None:
+                    state.on_exit()
+                self._entry_stamps.pop(state, None)
+            if source.path[0] is not leaf.path[0]:
+                self._history[leaf.path[0]] = source.path[0]
+        if action is not None:
+            action()
+        now = self._clock()
+        self._state = leaf
+        for state in leaf.path[common:]:
+            self._entry_count += 1
+            self._entry_stamps[state] = self._entry_count
+            if state.on_entry is not None:
+                state.on_entry()
+            for delay, timer_event in state.timers:
+                self._timers.append((now + delay, timer_event, state, self._entry_count))
+        self.log.append((now, source.name if source is not None else None,
+                         self._event_names[event] if event is not None else None, leaf.name))
+        if self._on_transition is not None:
+            self._on_transition(source, event, leaf)
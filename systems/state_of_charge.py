@@ -0,0 +1,138 @@
+import time
+import numpy as np
+
+# Rested (open-circuit) voltage -> state of charge (%) of the battery, as read on the battery A/D channel.
+# Typical Li-ion discharge curve, scaled to the range previously used by BatteryMeasure (3.2V to 4.1V)
+DEFAULT_DISCHARGE_CURVE = (
+    (3.20, 0),
+    (3.45, 5),
+    (3.55, 10),
+    (3.62, 20),
+    (3.66, 30),
+    (3.70, 40),
+    (3.74, 50),
+    (3.79, 60),
+    (3.85, 70),
+    (3.92, 80),
+    (4.00, 90),
+    (4.10, 100),
+)
+
+
+class SoCEstimator:
+    """
+    Battery state of charge (SoC) estimator:
+        - Coulomb counting: the battery current is integrated (trapezoidal rule) at the rate it is measured.
+        - Voltage corrections: the charge counter drifts, so it is slowly pulled towards the SoC given by the
+          discharge curve for the open-circuit voltage. The open-circuit voltage is estimated as V + I*R (load
+          compensation), and corrections are much stronger once the battery has rested (low current for a while),
+          since load compensation is only approximate.
+    The first voltage measurement initializes the SoC from the discharge curve.
+    Current is positive while discharging. Timestamps must come from the same clock (time.monotonic by default).
+    """
+    def __init__(self, capacity_ah: float, internal_resistance: float = 0.1, quiescent_current: float = 0,
+                 discharge_curve=DEFAULT_DISCHARGE_CURVE, current_field: str = 'motor_current',
+                 rest_current: float = 0.1, rest_time: float = 60,
+                 rested_gain: float = 0.1, loaded_gain: float = 0.002, clock=time.monotonic):
+        """
+        :param capacity_ah: usable battery capacity, in Ah
+        :param internal_resistance: battery (and wiring) resistance in Ohm, for the load compensation
+        :param quiescent_current: current (A) drawn by everything not measured by the current sensor
+        :param discharge_curve: (rested voltage, SoC %) pairs, sorted by voltage
+        :param current_field: telemetry field holding the measured current (see record)
+        :param rest_current: measured current (A) below which the battery is considered to be resting
+        :param rest_time: seconds of resting current before the voltage is taken as the open-circuit voltage
+        :param rested_gain: fraction of the voltage/charge counter mismatch corrected on every rested measurement
+        :param loaded_gain: same as rested_gain, but for load-compensated measurements
+        :param clock: time source used when no timestamp is given
+        """
+        self._capacity_as = capacity_ah * 3600  # Ampere-seconds
+        self._resistance = internal_resistance
+        self._quiescent_current = quiescent_current
+        self._curve_voltages = np.array([voltage for voltage, _ in discharge_curve], dtype=float)
+        self._curve_socs = np.array([soc for _, soc in discharge_curve], dtype=float)
+        self._current_field = current_field
+        self._rest_current = rest_current
+        self._rest_time = rest_time
+        self._rested_gain = rested_gain
+        self._loaded_gain = loaded_gain
+        self._clock = clock
+        self._soc = None  # %
+        self._current = 0  # Latest measured current (A)
+        self._current_time = None  # Timestamp of the latest current measurement
+        self._rest_start = None  # Time since the current is below rest_current (None: under load)
+
+    @property
+    def soc(self):
+        """
+        State of charge (0 to 100 %), None until the first voltage measurement
+        """
+        return self._soc
+
+    @property
+    def is_rested(self) -> bool:
+        return self._rest_start is not None and self._clock() - self._rest_start >= self._rest_time
+
+    def voltage_to_soc(self, open_circuit_voltage: float) -> float:
+        """
+        SoC (%) given by the discharge curve (linear interpolation, saturated at the ends)
+        """
+        return float(np.interp(open_circuit_voltage, self._curve_voltages, self._curve_socs))
+
+    def update_current(self, current: float, timestamp: float = None):
+        """
+        Integrates a new current measurement
+        :param current: measured current in A (positive: discharging)
+        """
+        timestamp = timestamp if timestamp is not None else self._clock()
+        if self._current_time is not None and self._soc is not None:
+            dt = timestamp - self._current_time
+            mean_current = (self._current + current) / 2 + self._quiescent_current
+            self._soc = max(0.0, min(self._soc - mean_current * dt / self._capacity_as * 100, 100.0))
+        if abs(current) < self._rest_current:
+            if self._rest_start is None:
+                self._rest_start = timestamp
+        else:
+            self._rest_start = None
+        self._current = current
+        self._current_time = timestamp
+
+    def update_voltage(self, voltage: float, timestamp: float = None) -> float:
+        """
+        Corrects the charge counter with a new battery voltage measurement
+        :return: updated SoC (%)
+        """
+        timestamp = timestamp if timestamp is not None else self._clock()
+        is_rested = self._rest_start is not None and timestamp - self._rest_start >= self._rest_time
+        open_circuit_voltage = voltage + (self._current + self._quiescent_current) * self._resistance
+        voltage_soc = self.voltage_to_soc(open_circuit_voltage)
+        if self._soc is None:
+            self._soc = voltage_soc
+        else:
+            gain = self._rested_gain if is_rested else self._loaded_gain
+            self._soc += gain * (voltage_soc - self._soc)
+        return self._soc
+
+    def record(self, name, value, timestamp: float):
+        """
+        TelemetryStore sink: integrates the values written to the current field
+        """
+        if name == self._current_field and value is not None:
+            self.update_current(value, timestamp)
+
+
+if __name__ == "__main__":
+    # Simulated 30min discharge: 1.5A load pulses (with the voltage sagging under load) and rest periods
+    estimator = SoCEstimator(capacity_ah=2.0, internal_resistance=0.15)
+    t = 0
+    true_soc = 80.0
+    for step in range(1800):
+        current = 1.5 if (step // 120) % 2 == 0 else 0.05
+        true_soc -= current / (2.0 * 3600) * 100
+        rested_voltage = float(np.interp(true_soc, estimator._curve_socs, estimator._curve_voltages))
+        estimator.update_current(current, t)
+        estimator.update_voltage(rested_voltage - current * 0.15, t)
+        if step % 120 == 0:
+            naive = (rested_voltage - current * 0.15 - 3.2) / 0.9 * 100
+            print(f"t={t}s  true: {true_soc:.1f}%  estimated: {estimator.soc:.1f}%  voltage only: {naive:.1f}%")
+        t += 1
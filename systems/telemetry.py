@@ -0,0 +1,152 @@
+import time
+from collections.abc import Mapping
+from threading import Lock
+
+
+class TelemetrySnapshot(Mapping):
+    """
+    Immutable, consistent view of every telemetry field at one store version. Behaves as a read-only dict
+    (snapshot['rssi'], snapshot.get('rssi'), iteration over the field names...)
+    """
+    __slots__ = ('version', '_index', '_values', '_timestamps')
+
+    def __init__(self, version: int, index: dict, values: tuple, timestamps: tuple):
+        self.version = version  # type: int
+        self._index = index  # Field name -> position (shared with the store, never modified)
+        self._values = values
+        self._timestamps = timestamps
+
+    def __getitem__(self, name):
+        return self._values[self._index[name]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._values)
+
+    def timestamp(self, name):
+        """
+        time.monotonic() value of the last update of the field (None if it was never updated)
+        """
+        return self._timestamps[self._index[name]]
+
+    def as_dict(self) -> dict:
+        return dict(zip(self._index, self._values))
+
+    def __repr__(self):
+        return f"TelemetrySnapshot(v{self.version}, {self.as_dict()})"
+
+
+class TelemetryStore:
+    """
+    Shared store for the latest value of every telemetry field. Fields are fixed on construction and kept in
+    arrays, together with the time and store version of their last update.
+    Snapshots are built lazily and shared until the next write (copy-on-write), so taking a snapshot on every
+    event only costs a copy when something actually changed.
+    Writes and snapshots are thread-safe.
+    Sinks (see add_sink) are notified of every written value, e.g. to keep a history or a log of the fields.
+    """
+    def __init__(self, fields, clock=time.monotonic):
+        """
+        :param fields: iterable with the field names
+        :param clock: time source for the update timestamps
+        """
+        self._index = {name: position for position, name in enumerate(fields)}
+        count = len(self._index)
+        self._values = [None] * count
+        self._timestamps = [None] * count
+        self._versions = [0] * count
+        self._version = 0
+        self._snapshot = TelemetrySnapshot(0, self._index, tuple(self._values), tuple(self._timestamps))
+        self._clock = clock
+        self._lock = Lock()
+        self._sinks = []
+
+    @property
+    def fields(self):
+        return tuple(self._index)
+
+    @property
+    def version(self) -> int:
+        """
+        Store version, incremented on every write
+        """
+        return self._version
+
+    def add_sink(self, sink):
+        """
+        :param sink: callable(name, value, timestamp), called after every write of every field (from the writing
+                     thread, so it must be quick)
+        """
+        self._sinks.append(sink)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        return self._values[self._index[name]]
+
+    def __setitem__(self, name, value):
+        self.set(name, value)
+
+    def set(self, name, value, timestamp: float = None):
+        """
+        Updates one field
+        :param name: field name (KeyError if it is not part of the store)
+        :param value: new value
+        :param timestamp: time of the measurement (clock() by default)
+        """
+        position = self._index[name]
+        timestamp = timestamp if timestamp is not None else self._clock()
+        with self._lock:
+            self._version += 1
+            self._values[position] = value
+            self._timestamps[position] = timestamp
+            self._versions[position] = self._version
+        for sink in self._sinks:
+            sink(name, value, timestamp)
+
+    def update(self, values: dict, timestamp: float = None):
+        """
+        Updates several fields at once (a single new version, so no snapshot sees only some of them)
+        """
+        positions = [(self._index[name], value) for name, value in values.items()]
+        timestamp = timestamp if timestamp is not None else self._clock()
+        with self._lock:
+            self._version += 1
+            for position, value in positions:
+                self._values[position] = value
+                self._timestamps[position] = timestamp
+                self._versions[position] = self._version
+        for sink in self._sinks:
+            for name, value in values.items():
+                sink(name, value, timestamp)
+
+    def get(self, name, default=None):
+        position = self._index.get(name)
+        return self._values[position] if position is not None else default
+
+    def timestamp_of(self, name):
+        """
+        Time of the last update of the field (None if it was never updated)
+        """
+        return self._timestamps[self._index[name]]
+
+    def version_of(self, name) -> int:
+        """
+        Store version of the last update of the field (0 if it was never updated). Useful to detect new values
+        """
+        return self._versions[self._index[name]]
+
+    def snapshot(self) -> TelemetrySnapshot:
+        """
+        Immutable view of the current values. Reused until the next write
+        """
+        snapshot = self._snapshot
+        if snapshot.version == self._version:
+            return snapshot
+        with self._lock:
+            snapshot = TelemetrySnapshot(self._version, self._index, tuple(self._values), tuple(self._timestamps))
+            self._snapshot = snapshot
+        return snapshot
@@ -0,0 +1,389 @@
+import glob
+import json
+import mmap
+import os
+import re
+import time
+from threading import Lock
+import numpy as np
+import trio
+
+# Every stream is a sequence of fixed-width records: (timestamp, value), both little-endian float64
+RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('value', '<f8')])
+_MANIFEST_NAME = "session.json"
+_SEGMENT_SUFFIX = ".bin"
+_TEXT_SUFFIX = ".text"  # String values: one JSON line per record, referenced by byte offset
+
+
+def _stream_file_name(stream: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", stream)
+
+
+class _Stream:
+    """
+    Append-only stream of records, split in memory-mapped segments of fixed size. Appending never does file I/O:
+    segments are opened ahead and closed by the flush. Records that arrive while no segment is open (new stream, or
+    the next segment was not ready yet) wait in memory until the next flush
+    """
+    def __init__(self, directory, name, segment_records, max_segments):
+        self.name = name
+        self.file_name = _stream_file_name(name)
+        self._directory = directory
+        self._segment_records = segment_records
+        self._max_segments = max_segments
+        self._segment = -1  # Index of the current segment
+        self._opened = 0  # Segments opened so far (index of the next one)
+        self._file = None
+        self._map = None
+        self._records = None  # Numpy view of the mapped segment
+        self._position = 0  # Records written in the current segment
+        self._flushed = 0  # Records of the current segment already written back to the file
+        self._spare = None  # (index, file, map) of the next segment, opened ahead by the flush
+        self._full = []  # (index, file, map, flushed, position) of the full segments, closed by the flush
+        self._backlog = []  # (timestamp, value) records waiting for a segment
+        self._text_file = None  # Opened by the first write of string values
+        self._text_size = 0  # Bytes of string values, written or pending
+        self._pending_text = []  # Encoded string values not written yet
+
+    def _segment_path(self, segment):
+        return os.path.join(self._directory, f"{self.file_name}.{segment:04d}{_SEGMENT_SUFFIX}")
+
+    def _next_segment(self):
+        if self._map is not None:  # Full
+            self._records = None  # The map cannot be closed while a view of it exists
+            self._full.append((self._segment, self._file, self._map, self._flushed, self._position))
+            self._file = self._map = None
+        if self._spare is not None:
+            self._segment, self._file, self._map = self._spare
+            self._spare = None
+            self._records = np.frombuffer(self._map, dtype=RECORD_DTYPE)
+            self._position = 0
+            self._flushed = 0
+
+    def append(self, timestamp: float, value: float):
+        if self._map is None or self._position == self._segment_records:
+            self._next_segment()
+            if self._map is None:
+                self._backlog.append((timestamp, value))
+                return
+        self._records[self._position] = (timestamp, value)
+        self._position += 1
+
+    def take_full_segments(self):
+        full, self._full = self._full, []
+        return full
+
+    def reserve_segment(self):
+        """
+        :return: index of the next segment to be opened (open_segment), None if one is already open ahead
+        """
+        if self._spare is not None:
+            return None
+        self._opened += 1
+        return self._opened - 1
+
+    def open_segment(self, segment):
+        # File I/O: called by the flush without holding the logger lock. The segment is added with add_segment
+        size = self._segment_records * RECORD_DTYPE.itemsize
+        file = open(self._segment_path(segment), "w+b")
+        file.truncate(size)  # Sparse file: zero-filled without writing the whole segment
+        return segment, file, mmap.mmap(file.fileno(), size)
+
+    def add_segment(self, segment):
+        self._spare = segment
+        if self._map is None:  # Records waiting for it
+            backlog, self._backlog = self._backlog, []
+            for timestamp, value in backlog:
+                self.append(timestamp, value)
+
+    def close_segment(self, segment, last=False):
+        # File I/O: called by the flush without holding the logger lock (full segments are no longer written). Once a
+        # newer segment exists (not the last one), the oldest ones are removed to keep max_segments
+        index, file, segment_map, flushed, position = segment
+        start = (flushed * RECORD_DTYPE.itemsize) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = position * RECORD_DTYPE.itemsize
+        if end > start:
+            segment_map.flush(start, end - start)
+        segment_map.close()
+        file.truncate(end)  # Drop the unused records
+        file.close()
+        if not last and self._max_segments is not None and index + 1 >= self._max_segments:
+            os.remove(self._segment_path(index + 1 - self._max_segments))
+
+    def encode(self, text: str) -> int:
+        """
+        Stores a string value (written by the next flush to the append-only text file of the stream)
+        :return: byte offset of the value in the text file
+        """
+        line = (json.dumps(text) + "\n").encode()
+        offset = self._text_size
+        self._text_size += len(line)
+        self._pending_text.append(line)
+        return offset
+
+    def take_pending_text(self):
+        lines, self._pending_text = self._pending_text, []
+        return lines
+
+    def restore_pending_text(self, lines):
+        # Lines whose write failed, to be retried before the newer ones (their offsets are already taken)
+        self._pending_text[:0] = lines
+
+    def write_text(self, lines):
+        if not lines:
+            return
+        if self._text_file is None:
+            self._text_file = open(os.path.join(self._directory, self.file_name + _TEXT_SUFFIX), "ab")
+        self._text_file.write(b"".join(lines))
+        self._text_file.flush()
+
+    def dirty_range(self):
+        """
+        :return: (map, offset, length, (segment, position)) of the pages holding the new records, to be written
+                 back by the caller and then confirmed with mark_flushed. None if there are no new records
+        """
+        if self._map is None or self._flushed == self._position:
+            return None
+        start = (self._flushed * RECORD_DTYPE.itemsize) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = self._position * RECORD_DTYPE.itemsize
+        return self._map, start, end - start, (self._segment, self._position)
+
+    def mark_flushed(self, mark):
+        segment, position = mark
+        if segment == self._segment:  # Otherwise, full meanwhile: it is written back when it is closed
+            self._flushed = max(self._flushed, position)
+
+    def close(self):
+        while True:
+            for segment in self.take_full_segments():
+                self.close_segment(segment)
+            if not self._backlog:
+                break
+            self.add_segment(self.open_segment(self.reserve_segment()))
+        if self._map is not None:
+            self._records = None
+            self.close_segment((self._segment, self._file, self._map, self._flushed, self._position), last=True)
+            self._file = self._map = None
+        if self._spare is not None:  # Never used
+            segment, file, segment_map = self._spare
+            segment_map.close()
+            file.close()
+            os.remove(self._segment_path(segment))
+            self._spare = None
+        self.write_text(self.take_pending_text())
+        if self._text_file is not None:
+            self._text_file.close()
+            self._text_file = None
+
+
+class TelemetryLogger:
+    """
+    Append-only columnar log of telemetry fields and events. Every field (or event) is an independent stream of
+    fixed-width (timestamp, value) records, written into memory-mapped segment files:
+        - Appending a record is a memory write: no system calls, no serialization.
+        - Segments are preallocated (sparse) files of fixed size, opened ahead by the flush. When one is full, the
+          next one is used ("<stream>.0001.bin", ...) and the full one is closed by the following flush. Optionally,
+          only the latest segments of each stream are kept.
+        - Dirty pages are written back periodically (see a_run_flush_loop) and only once per flush, so each record
+          costs its own 16 bytes on the SD card plus, at most, one partially rewritten page per stream and flush.
+        - Every file operation (segments, manifest, text files) runs in the flush: record() never touches the storage.
+          Records of new streams wait in memory until the flush opens their first segment.
+    Values are stored as float64: None is stored as NaN, booleans as 0/1. Strings are free-form (packet payloads,
+    commands...): each one is appended once to the text file of its stream ("<stream>.text", a JSON line per value,
+    written by the flush too) and the record stores its byte offset. Use load_session to read a session back.
+    """
+    DEFAULT_SEGMENT_SIZE = 256 * 1024  # Bytes per segment file
+    EVENT_PREFIX = "event."  # Prefix of the event streams (see log_event)
+
+    def __init__(self, directory: str, segment_size: int = None, max_segments: int = None,
+                 clock=time.monotonic):
+        """
+        :param directory: session directory (created if it does not exist)
+        :param segment_size: bytes per segment file (rounded down to whole records)
+        :param max_segments: max. number of segments kept per stream (None: keep everything)
+        :param clock: time source used when no timestamp is given. Must match the one used by the TelemetryStore
+        """
+        segment_size = segment_size if segment_size is not None else self.DEFAULT_SEGMENT_SIZE
+        self._segment_records = max(1, segment_size // RECORD_DTYPE.itemsize)
+        self._max_segments = max_segments
+        self._directory = directory
+        self._clock = clock
+        self._streams = {}  # Stream name -> _Stream
+        self._lock = Lock()
+        self._flush_lock = Lock()  # Serializes the flushes (text files are appended in order)
+        self._is_running = False
+        self._manifest_changed = False  # New streams not in the manifest file yet
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = {
+            'record_dtype': RECORD_DTYPE.descr,
+            'wall_time': time.time(),  # Wall-clock time matching "clock_time"
+            'clock_time': clock(),
+            'streams': {}  # Stream name -> file name
+        }
+        self._write_manifest(json.dumps(self._manifest))
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def streams(self):
+        return tuple(self._streams)
+
+    def _write_manifest(self, manifest: str):
+        path = os.path.join(self._directory, _MANIFEST_NAME)
+        with open(path + ".tmp", "w") as file:
+            file.write(manifest)
+        os.replace(path + ".tmp", path)
+
+    def record(self, name: str, value, timestamp: float = None):
+        """
+        Appends a value to the stream "name". Compatible with TelemetryStore.add_sink
+        """
+        timestamp = timestamp if timestamp is not None else self._clock()
+        with self._lock:
+            stream = self._streams.get(name)
+            if stream is None:
+                stream = _Stream(self._directory, name, self._segment_records, self._max_segments)
+                self._streams[name] = stream
+                self._manifest['streams'][name] = stream.file_name
+                self._manifest_changed = True
+            if value is None:
+                value = np.nan
+            elif isinstance(value, str):
+                value = stream.encode(value)
+            stream.append(timestamp, value)
+
+    def log_event(self, name: str, value=None, timestamp: float = None):
+        """
+        Appends an event (stored as the stream "event.<name>")
+        :param value: event data (number, string or None)
+        """
+        self.record(self.EVENT_PREFIX + name, value, timestamp)
+
+    def flush(self):
+        """
+        Writes back the new records of every stream, closes the full segments and opens the next ones ahead.
+        May block on slow storage: call it from a worker thread
+        """
+        with self._flush_lock:
+            with self._lock:
+                manifest = json.dumps(self._manifest) if self._manifest_changed else None
+                self._manifest_changed = False
+                segments = [(stream, stream.take_full_segments(), stream.reserve_segment())
+                            for stream in self._streams.values()]
+            if manifest is not None:
+                try:
+                    self._write_manifest(manifest)
+                except OSError:
+                    self._manifest_changed = True
+                    raise
+            # Files are handled without holding the lock, so record() never waits for the storage
+            for stream, full, segment in segments:
+                for full_segment in full:
+                    stream.close_segment(full_segment)
+                if segment is not None:
+                    segment = stream.open_segment(segment)
+                    with self._lock:
+                        stream.add_segment(segment)
+            with self._lock:
+                pending = [(stream, stream.dirty_range(), stream.take_pending_text())
+                           for stream in self._streams.values()]
+            # Records are only marked as flushed once they have actually been written back
+            for stream, dirty, lines in pending:
+                try:
+                    stream.write_text(lines)
+                except OSError:
+                    with self._lock:
+                        stream.restore_pending_text(lines)
+                    raise
+                if dirty is None:
+                    continue
+                segment_map, offset, length, mark = dirty
+                segment_map.flush(offset, length)  # Segments are only closed by the flush: still open
+                with self._lock:
+                    stream.mark_flushed(mark)
+
+    async def a_run_flush_loop(self, period: float = 5):
+        """
+        Periodically flushes the log from a worker thread. Asynchronous
+        """
+        if self._is_running:
+            return
+        self._is_running = True
+        while self._is_running:
+            await trio.sleep(period)
+            await trio.to_thread.run_sync(self.flush)
+
+    def stop_flush_loop(self):
+        self._is_running = False
+
+    def close(self):
+        self._is_running = False
+        with self._flush_lock, self._lock:
+            if self._manifest_changed:
+                self._write_manifest(json.dumps(self._manifest))
+                self._manifest_changed = False
+            for stream in self._streams.values():
+                stream.close()
+
+
+def load_session(directory: str, wall_time: bool = False) -> dict:
+    """
+    Loads a session written by TelemetryLogger
+    :param directory: session directory
+    :param wall_time: whether to convert the timestamps to wall-clock (Unix) time
+    :return: {stream name: (timestamps, values)}. Values of string streams are object arrays with the strings,
+             every other stream has float64 values
+    """
+    with open(os.path.join(directory, _MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+    dtype = np.dtype([tuple(field) for field in manifest['record_dtype']])
+    offset = manifest['wall_time'] - manifest['clock_time'] if wall_time else 0
+    session = {}
+    for name, file_name in manifest['streams'].items():
+        paths = sorted(glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(file_name)}.*{_SEGMENT_SUFFIX}")))
+        chunks = [np.fromfile(path, dtype=dtype) for path in paths]
+        records = np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+        # Segments that were not closed (e.g. power loss) keep their zero-filled tail: timestamps are never zero
+        records = records[records['timestamp'] != 0]
+        values = records['value']
+        text_path = os.path.join(directory, file_name + _TEXT_SUFFIX)
+        if os.path.exists(text_path):
+            with open(text_path, "rb") as file:
+                text = file.read()
+            decoded = np.empty(len(values), dtype=object)
+            for i, value in enumerate(values):
+                if not np.isnan(value):
+                    position = int(value)
+                    decoded[i] = json.loads(text[position:text.index(b"\n", position)])
+            values = decoded
+        session[name] = (records['timestamp'] + offset, values)
+    return session
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1:
+        # Summary of a recorded session
+        for stream, (timestamps, values) in load_session(sys.argv[1], wall_time=True).items():
+            print(f"{stream}: {len(values)} records")
+    else:
+        directory = tempfile.mkdtemp()
+        logger = TelemetryLogger(directory, segment_size=64 * 1024)
+        logger.record('motor_current', 0.0, 1.0)
+        logger.flush()  # Opens the first segment (otherwise, records wait in memory)
+        elapsed = 0
+        for i in range(1, 100000):
+            start = time.perf_counter()
+            logger.record('motor_current', i * 0.001, 1 + i * 0.005)
+            elapsed += time.perf_counter() - start
+            if i % 2048 == 0:  # As the flush loop: opens the next segments ahead (not timed, runs in a thread)
+                logger.flush()
+        logger.log_event('state_transition', "AUTOMATIC")
+        logger.close()
+        print(f"{elapsed / 100000 * 1e6:.2f}us per record")
+        for stream, (timestamps, values) in load_session(directory).items():
+            print(f"{stream}: {len(values)} records, last: {values[-1]}")
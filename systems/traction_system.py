@@ -1,7 +1,9 @@
 from collections import OrderedDict
+from threading import Lock
 
-from gpiozero import SourceMixin, CompositeDevice, GPIOPinMissing, PWMOutputDevice, DigitalOutputDevice, \
-    OutputDeviceBadValue
+from gpiozero import SourceMixin, CompositeDevice, GPIOPinMissing, DigitalOutputDevice, OutputDeviceBadValue
+from gpiozero.pins.mock import MockFactory
+from systems.pwm import create_pwm, PWM_BACKEND_SOFTWARE, PWM_BACKEND_PIGPIO, PWM_BACKEND_DUMMY
 
 
 class Motor(SourceMixin, CompositeDevice):
@@ -40,19 +42,61 @@ class Motor(SourceMixin, CompositeDevice):
     :param pin_factory:
         See :doc:`api_pins` for more information (this is an advanced feature
         which most users can ignore).
+
+    :type pwm_backend: str
+    :param pwm_backend:
+        Backend generating the enable (PWM) signal. See :mod:`systems.pwm`.
+
+    :type pwm_frequency: float or None
+    :param pwm_frequency:
+        Frequency of the enable (PWM) signal. If :data:`None`, the backend
+        default is used.
+
+    The logical output state is cached, so reading :attr:`value` does not touch
+    the pins, and pins are only written when their requested output changes.
     """
 
-    def __init__(self, forward=None, backward=None, enable=None, pin_factory=None):
+    def __init__(self, forward=None, backward=None, enable=None, pin_factory=None,
+                 pwm_backend=PWM_BACKEND_SOFTWARE, pwm_frequency=None):
         if not all(p is not None for p in [forward, backward, enable]):
             raise GPIOPinMissing(
                 'enable, forward and backward pins must be provided'
             )
         devices = OrderedDict((
-            ('forward_device', DigitalOutputDevice(forward, initial_value=False)),
-            ('backward_device', DigitalOutputDevice(backward, initial_value=False)),
-            ('enable_device', PWMOutputDevice(enable, frequency=100))
+            ('forward_device', DigitalOutputDevice(forward, initial_value=False, pin_factory=pin_factory)),
+            ('backward_device', DigitalOutputDevice(backward, initial_value=False, pin_factory=pin_factory)),
         ))
-        super(Motor, self).__init__(_order=devices.keys(), **devices)
+        # The enable output is not a gpiozero device (it may be generated by the pigpio daemon)
+        self._enable_output = create_pwm(enable, pwm_backend, pwm_frequency, pin_factory=pin_factory)
+        # Cached logical state (matches the initial values of the devices above)
+        self._forward_on = False
+        self._backward_on = False
+        self._duty = 0
+        super(Motor, self).__init__(_order=devices.keys(), pin_factory=pin_factory, **devices)
+
+    def _set_outputs(self, forward_on, backward_on, duty):
+        """
+        Writes the requested outputs, skipping the pins whose cached state already matches.
+        Direction pins are released before being set, so both are never active at once.
+        """
+        if forward_on != self._forward_on or backward_on != self._backward_on:
+            if self._forward_on and not forward_on:
+                self.forward_device.off()
+            if self._backward_on and not backward_on:
+                self.backward_device.off()
+            if forward_on and not self._forward_on:
+                self.forward_device.on()
+            if backward_on and not self._backward_on:
+                self.backward_device.on()
+            self._forward_on = forward_on
+            self._backward_on = backward_on
+        if duty != self._duty:
+            self._enable_output.value = duty
+            self._duty = duty
+
+    def close(self):
+        self._enable_output.close()
+        super(Motor, self).close()
 
     @property
     def value(self):
@@ -61,10 +105,10 @@ class Motor(SourceMixin, CompositeDevice):
         (full speed backward) and 1 (full speed forward), with 0 representing
         stopped.
         """
-        if self.forward_device.value and not self.backward_device.value:
-            return self.enable_device.value
-        elif not self.forward_device.value and self.backward_device.value:
-            return -self.enable_device.value
+        if self._forward_on and not self._backward_on:
+            return self._duty
+        elif not self._forward_on and self._backward_on:
+            return -self._duty
         else:
             return 0
 
@@ -99,7 +143,7 @@ class Motor(SourceMixin, CompositeDevice):
         Returns :data:`True` if the motor is currently braking
         :data:`False` otherwise.
         """
-        return self.backward_device.value ==0 and self.forward_device.value ==0
+        return not self._backward_on and not self._forward_on
 
     def forward(self, speed=1):
         """
@@ -112,9 +156,7 @@ class Motor(SourceMixin, CompositeDevice):
         if not 0 <= speed <= 1:
             raise ValueError('forward speed must be between 0 and 1')
 
-        self.backward_device.off()
-        self.forward_device.on()
-        self.enable_device.value = speed
+        self._set_outputs(True, False, speed)
 
     def backward(self, speed=1):
         """
@@ -127,9 +169,7 @@ class Motor(SourceMixin, CompositeDevice):
         if not 0 <= speed <= 1:
             raise ValueError('backward speed must be between 0 and 1')
 
-        self.backward_device.on()
-        self.forward_device.off()
-        self.enable_device.value = speed
+        self._set_outputs(False, True, speed)
 
     def reverse(self):
         """
@@ -148,9 +188,7 @@ class Motor(SourceMixin, CompositeDevice):
         """
         if not 0 <= brake_force <= 1:
             raise ValueError('brake force must be between 0 and 1')
-        self.forward_device.off()
-        self.backward_device.off()
-        self.enable_device.value = brake_force
+        self._set_outputs(False, False, brake_force)
 
     def idle(self):
         """
@@ -202,6 +240,16 @@ class TractionSystem:
     :param enable_global:
         GPIO pin that controlls power supply to the traction driver. If this is
         :data:`None` a :exc:`GPIOPinMissing` will be raised.
+
+    :type pwm_backend: str
+    :param pwm_backend:
+        Backend generating the motor enable (PWM) signals. With
+        PWM_BACKEND_DUMMY, every pin is simulated (no hardware access).
+
+    :type pwm_frequency: float or None
+    :param pwm_frequency:
+        Frequency of the motor enable (PWM) signals. If :data:`None`, the
+        backend default is used.
     """
     # Scale multipliers to compensate motor thrusts. All <=1
     _R_FORWARD_SCALE = 0.69    # Scale to right-motor PWM when going forwards
@@ -221,25 +269,37 @@ class TractionSystem:
     UNKNOWN_STATE = "UNKNOWN"
 
     def __init__(self, forward_r=None, backward_r=None, enable_r=None, forward_l=None, backward_l=None, enable_l=None,
-                 enable_global=None):
+                 enable_global=None, pwm_backend=PWM_BACKEND_SOFTWARE, pwm_frequency=None):
         required = [forward_r, backward_r, enable_r, forward_l, backward_l, enable_l, enable_global]
         if not all(p is not None for p in required):
             raise GPIOPinMissing(
                 'enable, forward and backward pins must be provided for both motors'
             )
 
+        pin_factory = MockFactory() if pwm_backend == PWM_BACKEND_DUMMY else None
         self._right_motor = Motor(
             forward=forward_r,
             backward=backward_r,
-            enable=enable_r
+            enable=enable_r,
+            pin_factory=pin_factory,
+            pwm_backend=pwm_backend,
+            pwm_frequency=pwm_frequency
         )
         self._left_motor = Motor(
             forward=forward_l,
             backward=backward_l,
-            enable=enable_l
+            enable=enable_l,
+            pin_factory=pin_factory,
+            pwm_backend=pwm_backend,
+            pwm_frequency=pwm_frequency
         )
-        self._enable = DigitalOutputDevice(enable_global)
+        self._enable = DigitalOutputDevice(enable_global, pin_factory=pin_factory)
         self._enable.off()
+        self._enabled = False
+        self._enable_lock = Lock()  # toggle_enable and trip may be called from different threads
+        self._tripped = False
+        self._velocity = (0, 0)
+        self._state = self.STOPPED_STATE
 
     @property
     def is_active(self):
@@ -247,7 +307,7 @@ class TractionSystem:
         Returns :data:`True` if any motor is currently running and
         :data:`False` otherwise.
         """
-        return self._right_motor.value != 0 or self._left_motor.value
+        return self._right_motor.value != 0 or self._left_motor.value != 0
 
     @property
     def is_enabled(self):
@@ -255,7 +315,24 @@ class TractionSystem:
         Returns :data:`True` if the global enable pin is active, and
         :data:`False` otherwise
         """
-        return self._enable.value == 1
+        return self._enabled
+
+    @property
+    def is_tripped(self):
+        """
+        Returns :data:`True` if the driver was cut off by :meth:`trip` and
+        has not been reset since
+        """
+        return self._tripped
+
+    @property
+    def velocity(self):
+        """
+        Returns the last commanded (linear, angular) pair, following the
+        conventions of :meth:`drive`. Discrete commands are translated onto
+        their equivalent pair (e.g. forward(0.5) is (0.5, 0)).
+        """
+        return self._velocity
 
     @property
     def state(self):
@@ -268,29 +345,67 @@ class TractionSystem:
             "STOPPED" if both motors are stopped
             "IDLE" if both motors are idle (disconnected)
             "UNKNOWN" if any other (should not happen)
+        The state is computed once per command (from the cached motor states), so this is a simple lookup.
         """
-        if self._right_motor.value > 0 and self._left_motor.value > 0:
-            return self.FORWARD_STATE
-        elif self._right_motor.value < 0 and self._left_motor.value < 0:
-            return self.BACKWARD_STATE
-        elif self._right_motor.value > 0 and self._left_motor.value <= 0:
-            return self.TURN_LEFT_STATE
-        elif self._right_motor.value <= 0 and self._left_motor.value > 0:
-            return self.TURN_RIGHT_STATE
+        return self._state
+
+    def _update_state(self, velocity):
+        """
+        Stores the commanded (linear, angular) pair and recomputes the cached state
+        """
+        self._velocity = velocity
+        right = self._right_motor.value
+        left = self._left_motor.value
+        if right > 0 and left > 0:
+            self._state = self.FORWARD_STATE
+        elif right < 0 and left < 0:
+            self._state = self.BACKWARD_STATE
+        elif right > 0 and left <= 0:
+            self._state = self.TURN_LEFT_STATE
+        elif right <= 0 and left > 0:
+            self._state = self.TURN_RIGHT_STATE
         elif self._right_motor.is_braking and self._left_motor.is_braking:
-            return self.STOPPED_STATE
+            self._state = self.STOPPED_STATE
         elif not self._right_motor.is_active and not self._left_motor.is_active:
-            return self.IDLE_STATE
+            self._state = self.IDLE_STATE
         else:
-            return self.UNKNOWN_STATE
+            self._state = self.UNKNOWN_STATE
 
     def toggle_enable(self, value: bool):
-        self._enable.value = 1 if value else 0
+        value = bool(value)
+        with self._enable_lock:
+            if value and self._tripped:
+                print("DRIVER TRIPPED - Call reset_trip before enabling it")
+                value = False
+            if value != self._enabled:
+                self._enable.value = 1 if value else 0
+                self._enabled = value
         if self.is_enabled:
             print("DRIVER ENABLED")
         else:
             print("DRIVER DISABLED")
 
+    def trip(self):
+        """
+        Emergency cut-off: disables the driver power supply at once. Safe to
+        call from any thread. The driver stays disabled (even if
+        :meth:`toggle_enable` is called) until :meth:`reset_trip` is called.
+        Motor outputs are left untouched.
+        """
+        with self._enable_lock:
+            self._tripped = True
+            if self._enabled:
+                self._enable.value = 0
+                self._enabled = False
+
+    def reset_trip(self):
+        """
+        Allows enabling the driver again after a :meth:`trip`. The driver is
+        not enabled by this call.
+        """
+        with self._enable_lock:
+            self._tripped = False
+
     def forward(self, speed=1):
         """
         Drive the system forwards.
@@ -304,6 +419,7 @@ class TractionSystem:
 
         self._right_motor.forward(speed * self._R_FORWARD_SCALE)
         self._left_motor.forward(speed * self._L_FORWARD_SCALE)
+        self._update_state((speed, 0))
 
     def backward(self, speed=1):
         """
@@ -318,6 +434,7 @@ class TractionSystem:
 
         self._right_motor.backward(speed*self._R_BACKWARD_SCALE)
         self._left_motor.backward(speed*self._L_BACKWARD_SCALE)
+        self._update_state((-speed, 0))
 
     def stop(self, brake_force=1):
         """
@@ -330,6 +447,7 @@ class TractionSystem:
             raise ValueError('brake force must be between 0 and 1')
         self._right_motor.stop(brake_force)
         self._left_motor.stop(brake_force)
+        self._update_state((0, 0))
 
     def idle(self):
         """
@@ -338,6 +456,48 @@ class TractionSystem:
         """
         self._right_motor.idle()
         self._left_motor.idle()
+        self._update_state((0, 0))
+
+    def drive(self, linear, angular):
+        """
+        Differential-drive motion: mixes a linear speed and a turn rate onto
+        both motors, so that arcs can be described while moving.
+        Each motor duty is scaled with the calibration multipliers, blending
+        the translation and rotation scales proportionally to each component.
+        :param float linear:
+            Between -1 (full speed backwards) and 1 (full speed forwards)
+        :param float angular:
+            Between 0 and 1 for counter-clockwise rotation, and between -1 and 0
+            for clockwise rotation (same convention as :meth:`turn`)
+        """
+        if not -1 <= linear <= 1:
+            raise ValueError('linear speed must be between -1 and 1')
+        if not -1 <= angular <= 1:
+            raise ValueError('angular speed must be between -1 and 1')
+
+        right = linear + angular
+        left = linear - angular
+        # Saturated commands keep their curvature (ratio between both motors)
+        saturation = max(abs(right), abs(left), 1)
+        right /= saturation
+        left /= saturation
+
+        magnitude = abs(linear) + abs(angular)
+        turn_weight = abs(angular) / magnitude if magnitude > 0 else 0
+        if linear >= 0:
+            r_linear_scale, l_linear_scale = self._R_FORWARD_SCALE, self._L_FORWARD_SCALE
+        else:
+            r_linear_scale, l_linear_scale = self._R_BACKWARD_SCALE, self._L_BACKWARD_SCALE
+        if angular >= 0:
+            r_angular_scale, l_angular_scale = self._R_LEFT_SCALE, self._L_LEFT_SCALE
+        else:
+            r_angular_scale, l_angular_scale = self._R_RIGHT_SCALE, self._L_RIGHT_SCALE
+        r_scale = r_linear_scale + (r_angular_scale - r_linear_scale) * turn_weight
+        l_scale = l_linear_scale + (l_angular_scale - l_linear_scale) * turn_weight
+
+        self._right_motor.value = right * r_scale
+        self._left_motor.value = left * l_scale
+        self._update_state((linear, angular))
 
     def turn(self, direction):
         """
@@ -355,6 +515,7 @@ class TractionSystem:
         else:  # Counter-clockwise (left turn)
             self._left_motor.backward(direction * self._L_LEFT_SCALE)
             self._right_motor.forward(direction * self._R_LEFT_SCALE)
+        self._update_state((0, direction))
 
 
 # Simple unit test for the traction system
@@ -373,7 +534,8 @@ if __name__ == "__main__":
         forward_l=MOTOR_L_FORWARD_PIN,
         backward_l=MOTOR_L_BACKWARD_PIN,
         enable_l=MOTOR_L_ENABLE_PIN,
-        enable_global=1
+        enable_global=1,
+        pwm_backend=PWM_BACKEND_PIGPIO
     )
     control = DigitalOutputDevice(12).on()
 
@@ -389,6 +551,8 @@ if __name__ == "__main__":
             tractor.idle()
         elif action == "T":
             tractor.turn(float(input("Value: ")))
+        elif action == "D":
+            tractor.drive(float(input("Linear: ")), float(input("Angular: ")))
         else:
             print(f"Current state: {tractor.state}")
 
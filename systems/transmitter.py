@@ -0,0 +1,191 @@
+import trio
+from systems.event_source import AsyncEventSource, BaseEventArgs
+from systems.pycc1101 import TICC1101
+
+# MARCSTATE values
+_STATE_RX = 0x0D
+_TX_STATES = (0x12, 0x13, 0x14, 0x15)  # FSTXON, TX, TX_END, RXTX_SWITCH
+
+
+class Transmitter(AsyncEventSource):
+    """
+    Asynchronous CC1101 packet transmitter. Packets are queued (send/send_nowait) and sent one at a time by the
+    transmit loop, which never blocks the event loop: the TX FIFO is loaded and STX strobed, and then the radio state
+    is polled with awaited sleeps until the packet is gone.
+    Each attempt has a timeout (e.g. the channel never clears with CCA enabled). Failed attempts are aborted (TX FIFO
+    flushed) and retried after a delay, up to "retries" times. The radio always ends up back in RX: MCSM1.TXOFF_MODE
+    should be RX, otherwise SRX is strobed after every packet.
+    Results are raised as TX_DONE_EVENT / TX_FAILED_EVENT events (and returned by send).
+    """
+    TX_DONE_EVENT = "TX_DONE_EVENT"
+    TX_FAILED_EVENT = "TX_FAILED_EVENT"
+
+    def __init__(self, radio: TICC1101, nursery, spi_lock: trio.Lock = None, queue_size: int = 16,
+                 timeout: float = 0.1, retries: int = 3, retry_delay: float = 0.02, poll_period: float = 0.001,
+                 notification_callbacks=None, error_callbacks=None):
+        """
+        :param radio: configured CC1101
+        :param nursery: Trio nursery
+        :param spi_lock: lock shared with every other user of the radio (e.g. the receiver)
+        :param queue_size: max. queued packets
+        :param timeout: max. time (s) for a transmission attempt (CCA wait included)
+        :param retries: attempts after the first failed one
+        :param retry_delay: wait (s) before retrying
+        :param poll_period: radio state polling period (s) while transmitting
+        """
+        super().__init__(nursery, notification_callbacks, error_callbacks)
+        self._radio = radio  # type: TICC1101
+        self._spi_lock = spi_lock if spi_lock is not None else trio.Lock()
+        self._send_channel, self._receive_channel = trio.open_memory_channel(queue_size)
+        self._timeout = timeout
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._poll_period = poll_period
+        self._loop_channel = None  # Clone of the queue read by the running transmit loop (closed to stop it)
+        self.sent_count = 0
+        self.failed_count = 0
+        self.retry_count = 0
+
+    async def send(self, payload) -> bool:
+        """
+        Queues a packet (waiting for room in the queue) and waits until it is sent
+        :param payload: bytes (or list of ints)
+        :return: whether the packet was sent
+        """
+        request = _TxRequest(payload)
+        await self._send_channel.send(request)
+        await request.done.wait()
+        return request.result
+
+    def send_nowait(self, payload):
+        """
+        Queues a packet without waiting (the result is raised as an event)
+        :raise trio.WouldBlock: if the queue is full
+        """
+        self._send_channel.send_nowait(_TxRequest(payload))
+
+    async def a_run_notification_loop(self):
+        if self._loop_channel is not None:
+            return
+        # Each run reads from its own clone of the queue: stopping closes it, so a stopped loop can never take
+        # another packet, even if a new one is started before it wakes up. Queued packets stay for the next run
+        channel = self._loop_channel = self._receive_channel.clone()
+        try:
+            async for request in channel:
+                attempts = 0
+                try:
+                    while True:
+                        attempts += 1
+                        result = await self._a_transmit(list(request.payload))
+                        if result or result is None or attempts > self._retries:  # Sent, invalid or out of retries
+                            request.result = bool(result)
+                            break
+                        self.retry_count += 1
+                        await trio.sleep(self._retry_delay)
+                finally:  # Also on errors and cancellation (result stays False): send() must not hang
+                    request.done.set()
+                if request.result:
+                    self.sent_count += 1
+                    await self.raise_event(TransmissionEventArgs(self.TX_DONE_EVENT, request.payload, attempts))
+                else:
+                    self.failed_count += 1
+                    await self.raise_event(TransmissionEventArgs(self.TX_FAILED_EVENT, request.payload, attempts))
+        except trio.ClosedResourceError:  # Stopped
+            pass
+        finally:
+            channel.close()
+            if self._loop_channel is channel:
+                self._loop_channel = None
+
+    def stop_notification_loop(self):
+        """
+        Stops after the packet being sent (if any)
+        """
+        if self._loop_channel is not None:
+            self._loop_channel.close()
+            self._loop_channel = None
+
+    async def _a_transmit(self, data) -> bool:
+        # One attempt. Returns None (no retries) if the packet cannot be sent at all
+        radio = self._radio
+        async with self._spi_lock:
+            if not radio.startTransmission(data):
+                return None
+        deadline = trio.current_time() + self._timeout
+        while True:
+            await trio.sleep(self._poll_period)
+            async with self._spi_lock:
+                state, remaining, underflow = radio.getTxStatus()
+                if underflow:
+                    radio.abortTransmission()
+                    return False
+                if remaining == 0 and state not in _TX_STATES:
+                    if state != _STATE_RX:  # TXOFF_MODE not RX (or CCA left it in IDLE)
+                        radio._setRXState()
+                    return True
+                if state == _STATE_RX:  # CCA: the channel was busy, STX was ignored
+                    radio._setTXState()
+                if trio.current_time() > deadline:
+                    radio.abortTransmission()
+                    return False
+
+
+class _TxRequest:
+    __slots__ = ('payload', 'done', 'result')
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.done = trio.Event()
+        self.result = False
+
+
+class TransmissionEventArgs(BaseEventArgs):
+    def __init__(self, event_type: str, payload, attempts: int):
+        """
+        :param event_type: event identifier
+        :param payload: packet payload
+        :param attempts: transmission attempts made
+        """
+        super().__init__(event_type)
+        self.payload = payload
+        self.attempts = attempts  # type: int
+
+
+if __name__ == "__main__":
+    # Simulated radio (no hardware needed): the event loop keeps running while packets are sent
+    import time
+    from systems.pycc1101 import DummySpiDev
+
+    spi = DummySpiDev()
+    radio = TICC1101(debug=False, performance_mode=True, spi=spi)
+    radio.reset()
+    radio.setDefaultValues()
+    radio._writeSingleByte(radio.PKTCTRL1, 0x04)
+    radio._writeSingleByte(radio.MCSM1, 0x2F)  # Stay in RX after RX, back to RX after TX
+    radio._setRXState()
+
+    async def tx_listener(source, param: TransmissionEventArgs):
+        print(f"{param.event_type}: {bytes(param.payload)} after {param.attempts} attempt(s)")
+
+    async def heartbeat():
+        worst = 0
+        for _ in range(200):
+            start = time.perf_counter()
+            await trio.sleep(0.001)
+            worst = max(worst, time.perf_counter() - start)
+        print(f"Event loop: worst 1ms sleep took {worst * 1000:.2f}ms")
+
+    async def parent():
+        async with trio.open_nursery() as nursery:
+            transmitter = Transmitter(radio, nursery, notification_callbacks=[tx_listener])
+            nursery.start_soon(transmitter.a_run_notification_loop)
+            nursery.start_soon(heartbeat)
+            for i in range(5):
+                transmitter.send_nowait(f"ACK {i}".encode())
+            print(f"Sent: {await transmitter.send(b'BEACON')}")
+            await trio.sleep(0.3)
+            print(f"Transmitted: {spi.transmitted}. Radio state: {hex(radio._getMRStateMachineState())}")
+            transmitter.stop_notification_loop()
+            nursery.cancel_scope.cancel()
+
+    trio.run(parent)